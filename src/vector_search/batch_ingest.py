@@ -0,0 +1,204 @@
+import argparse
+import csv
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from checkpoint import IngestJournal
+from chroma_db import ChromaClient
+from chunking import CHUNK_SIZE, CHUNK_OVERLAP
+from extraction import EXTRACT_KEYWORDS
+from file_reader import FileReader, OCR_ENGINE, OCR_LAYOUT, ocr_workers_for
+from ingestion import ingest_document, EMBED_BATCH_SIZE
+from utils.utils import LAYOUT_MODES, OCR_ENGINES
+
+METADATA_FIELDS = ("title", "authors", "publisher", "date_published")
+INGEST_WORKERS = 4
+
+
+def load_manifest(path):
+    """
+    Loads document metadata from a JSON or CSV manifest and returns it
+    keyed by file name. A JSON manifest is either a list of objects with
+    a "file" key or an object keyed by file name; a CSV manifest has a
+    "file" column. Both carry title, authors, publisher and date_published.
+    """
+    if path.lower().endswith(".csv"):
+        with open(path, newline="", encoding="utf-8") as f:
+            entries = list(csv.DictReader(f))
+    else:
+        with open(path, encoding="utf-8") as f:
+            entries = json.load(f)
+        if isinstance(entries, dict):
+            entries = [{"file": name, **meta} for name, meta in entries.items()]
+
+    return {os.path.basename(entry["file"]): entry for entry in entries}
+
+
+def document_metadata(filepath, manifest):
+    """
+    Returns the metadata for a document, taken from its sidecar file
+    (`<name>.pdf.json`) if there is one, then from the manifest. The
+    title falls back to the file name. An optional "document_key" marks
+    the file as a revision of the document ingested under the same key.
+    """
+    entry = {}
+    sidecar = f"{filepath}.json"
+    if os.path.exists(sidecar):
+        with open(sidecar, encoding="utf-8") as f:
+            entry = json.load(f)
+    elif os.path.basename(filepath) in manifest:
+        entry = manifest[os.path.basename(filepath)]
+
+    metadata = {field: str(entry.get(field) or "") for field in METADATA_FIELDS}
+    if not metadata["title"]:
+        metadata["title"] = os.path.splitext(os.path.basename(filepath))[0]
+    metadata["document_key"] = entry.get("document_key") or None
+    return metadata
+
+
+def ingest_file(filepath, metadata, collection, journal, args):
+    metadata = dict(metadata)
+    file = FileReader(
+        filepath,
+        ocr_workers=args.ocr_workers,
+        ocr_engine=args.ocr_engine,
+        ocr_layout=args.ocr_layout,
+        document_key=metadata.pop("document_key", None),
+    )
+    file.input_metadata(**metadata)
+
+    stats = ingest_document(
+        file,
+        collection,
+        journal,
+        chunk_size=args.chunk_size,
+        chunk_overlap=args.chunk_overlap,
+        batch_size=args.batch_size,
+        extract_keywords=args.keywords,
+    )
+
+    if not stats.failed and args.processed:
+        shutil.move(filepath, os.path.join(args.processed, file.generate_filename()))
+
+    return stats
+
+
+def run(args):
+    """
+    Ingests every PDF in the folder with a bounded pool of document
+    workers and returns the number of documents that failed.
+    """
+    manifest = load_manifest(args.manifest) if args.manifest else {}
+    filepaths = sorted(
+        os.path.join(args.folder, f)
+        for f in os.listdir(args.folder)
+        if f.lower().endswith(".pdf")
+    )
+    if args.processed:
+        os.makedirs(args.processed, exist_ok=True)
+
+    collection = ChromaClient().create_collection(args.collection)
+    journal = IngestJournal()
+
+    started = time.perf_counter()
+    pages = chunks = existing = 0
+    failures = []
+
+    print(f"Ingesting {len(filepaths)} documents with {args.workers} workers")
+
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = {}
+        for filepath in filepaths:
+            try:
+                metadata = document_metadata(filepath, manifest)
+            except Exception as e:
+                # such as a malformed sidecar, which only fails its own file
+                print(f"Failed {filepath}: bad metadata: {e}")
+                failures.append(filepath)
+                continue
+            future = executor.submit(
+                ingest_file, filepath, metadata, collection, journal, args
+            )
+            futures[future] = filepath
+
+        for future in as_completed(futures):
+            filepath = futures[future]
+            try:
+                stats = future.result()
+            except Exception as e:
+                print(f"Failed {filepath}: {e}")
+                failures.append(filepath)
+                continue
+
+            print(f"Ingested {filepath}: {stats.summary()}")
+            pages += stats.pages
+            chunks += stats.chunks
+            existing += stats.existing
+            if stats.failed:
+                failures.append(filepath)
+
+    elapsed = time.perf_counter() - started
+    done = len(filepaths) - len(failures)
+    print(
+        f"\nIngested {done}/{len(filepaths)} documents, {pages} pages and "
+        f"{chunks} new chunks ({existing} already embedded) in {elapsed:.1f}s: "
+        f"{done / elapsed * 60 if elapsed else 0:.1f} documents/min, "
+        f"{pages / elapsed if elapsed else 0:.1f} pages/s, "
+        f"{chunks / elapsed if elapsed else 0:.1f} chunks/s"
+    )
+    for filepath in failures:
+        print(f"Failed: {filepath}")
+
+    return len(failures)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="ingest", description="Ingest a folder of PDFs without the TUI."
+    )
+    parser.add_argument("folder", nargs="?", default="uploaded")
+    parser.add_argument(
+        "--manifest", help="JSON or CSV file with title, authors, publisher and date"
+    )
+    parser.add_argument("--collection", default="library")
+    parser.add_argument(
+        "--processed",
+        default="processed",
+        help="where ingested files are moved, pass an empty string to leave them",
+    )
+    parser.add_argument("--workers", type=int, default=INGEST_WORKERS)
+    parser.add_argument(
+        "--ocr-workers",
+        type=int,
+        default=None,
+        help="OCR processes per document, defaults to the CPUs split across workers",
+    )
+    parser.add_argument(
+        "--ocr-engine",
+        choices=OCR_ENGINES,
+        default=OCR_ENGINE,
+        help="OCR every text region on its own, or the whole page in one pass",
+    )
+    parser.add_argument(
+        "--ocr-layout",
+        choices=LAYOUT_MODES,
+        default=OCR_LAYOUT,
+        help="find the text regions on the full page or on a scaled down copy",
+    )
+    parser.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--chunk-overlap", type=int, default=CHUNK_OVERLAP)
+    parser.add_argument(
+        "--keywords",
+        action=argparse.BooleanOptionalAction,
+        default=EXTRACT_KEYWORDS,
+        help="store the key phrases and entities of every chunk in its metadata",
+    )
+
+    args = parser.parse_args(argv)
+    if args.ocr_workers is None:
+        args.ocr_workers = ocr_workers_for(args.workers)
+    return args
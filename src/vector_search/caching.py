@@ -0,0 +1,215 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+QUERY_CACHE_SIZE = 512
+QUERY_CACHE_TTL = 60 * 60
+RESULT_CACHE_SIZE = 256
+# how close, by cosine similarity, a query has to be to a cached one to
+# reuse its results
+RESULT_CACHE_THRESHOLD = float(os.environ.get("VECTOR_SEARCH_CACHE_THRESHOLD", "0.97"))
+VERSIONS_PATH = os.path.join("db", "versions.sqlite3")
+
+
+def normalize_query(text):
+    """
+    Collapses case and whitespace so trivially different spellings of
+    the same query share a cache entry.
+    """
+    return " ".join(text.casefold().split())
+
+
+class EmbeddingCache:
+    """
+    A bounded, thread-safe LRU cache of query embeddings keyed on the
+    normalized query text and the embedding model. Entries older than
+    `ttl` seconds are treated as misses.
+    """
+
+    def __init__(self, max_size=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, text, model):
+        key = (model, normalize_query(text))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored, embedding = entry
+                if time.monotonic() - stored <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return embedding
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, text, model, embedding):
+        key = (model, normalize_query(text))
+        with self._lock:
+            self._entries[key] = (time.monotonic(), embedding)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get_or_compute(self, text, model, compute):
+        """
+        Returns the cached embedding, or calls `compute()` and caches
+        its result on a miss.
+        """
+        embedding = self.get(text, model)
+        if embedding is None:
+            embedding = compute()
+            self.put(text, model, embedding)
+        return embedding
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+class CollectionVersions:
+    """
+    A counter per collection, kept in SQLite so every process sees it,
+    that ingestion bumps whenever it changes a collection. Anything cached
+    from a collection is only valid for the version it was read at.
+    """
+
+    def __init__(self, path=VERSIONS_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS versions (name TEXT PRIMARY KEY, version INTEGER)"
+        )
+
+    def get(self, name):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT version FROM versions WHERE name = ?", (name,)
+            ).fetchone()
+        return row[0] if row else 0
+
+    def bump(self, name):
+        """
+        Increments the version of the collection and returns the new one.
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO versions VALUES (?, 1) "
+                "ON CONFLICT(name) DO UPDATE SET version = version + 1",
+                (name,),
+            )
+            return self._conn.execute(
+                "SELECT version FROM versions WHERE name = ?", (name,)
+            ).fetchone()[0]
+
+
+_versions = {}
+_versions_lock = threading.Lock()
+
+
+def collection_versions(path=None):
+    """
+    Returns the shared CollectionVersions, opened on first use.
+    """
+    path = path or VERSIONS_PATH
+    with _versions_lock:
+        if path not in _versions:
+            _versions[path] = CollectionVersions(path)
+        return _versions[path]
+
+
+class ResultCache:
+    """
+    A bounded, thread-safe LRU cache of search results keyed on the query
+    embedding rather than its text, so near-identical queries such as
+    "invoice policy" and "the invoice policies" share an entry. A lookup
+    is a hit when a cached embedding with the same `key` (the collection
+    and search parameters) is within `threshold` cosine similarity and
+    was cached at the current collection version.
+    """
+
+    def __init__(self, max_size=RESULT_CACHE_SIZE, threshold=RESULT_CACHE_THRESHOLD):
+        self.max_size = max_size
+        self.threshold = threshold
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._next = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _unit(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get(self, embedding, key, version):
+        vector = self._unit(embedding)
+        with self._lock:
+            candidates = []
+            for entry_id, (entry_key, entry_version, cached, results) in list(
+                self._entries.items()
+            ):
+                if entry_key != key:
+                    continue
+                if entry_version != version:
+                    # the collection changed since, this can never hit again
+                    del self._entries[entry_id]
+                    continue
+                if cached.shape == vector.shape:
+                    candidates.append((entry_id, cached, results))
+
+            if candidates:
+                similarity = np.stack([c[1] for c in candidates]) @ vector
+                best = int(similarity.argmax())
+                if similarity[best] >= self.threshold:
+                    self._entries.move_to_end(candidates[best][0])
+                    self.hits += 1
+                    return candidates[best][2]
+            self.misses += 1
+            return None
+
+    def put(self, embedding, key, version, results):
+        with self._lock:
+            self._entries[self._next] = (key, version, self._unit(embedding), results)
+            self._next += 1
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
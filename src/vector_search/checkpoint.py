@@ -0,0 +1,129 @@
+import sqlite3
+import threading
+import time
+
+JOURNAL_PATH = "ingest_journal.sqlite3"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    document_id TEXT PRIMARY KEY,
+    filepath TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    status TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pages (
+    document_id TEXT NOT NULL,
+    page_number TEXT NOT NULL,
+    contents TEXT NOT NULL,
+    PRIMARY KEY (document_id, page_number)
+);
+CREATE TABLE IF NOT EXISTS chunks (
+    document_id TEXT NOT NULL,
+    chunk_id TEXT NOT NULL,
+    PRIMARY KEY (document_id, chunk_id)
+);
+"""
+
+
+class IngestJournal:
+    """
+    A small SQLite journal, kept next to db/, that records how far the
+    ingestion of each document got: the pages already extracted and the
+    chunks already committed to the collection. If a run is killed, the
+    next run of the same document resumes from the last committed batch
+    instead of starting over.
+    """
+
+    def __init__(self, path=JOURNAL_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(SCHEMA)
+
+    def start_document(self, document_id, filepath, content_hash):
+        """
+        Marks the document as in progress. Pages extracted from a
+        different revision of the file are thrown away; committed chunks
+        are kept since their ids are derived from their contents.
+        """
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT content_hash FROM documents WHERE document_id = ?",
+                (document_id,),
+            ).fetchone()
+            if row is not None and row[0] != content_hash:
+                self._conn.execute(
+                    "DELETE FROM pages WHERE document_id = ?", (document_id,)
+                )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO documents VALUES (?, ?, ?, 'in_progress', ?)",
+                (document_id, filepath, content_hash, time.time()),
+            )
+            return row is not None
+
+    def record_page(self, document_id, page):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?)",
+                (document_id, page["page_number"], page["contents"]),
+            )
+
+    def pages(self, document_id):
+        """
+        Returns the pages already extracted, keyed by page number.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT page_number, contents FROM pages WHERE document_id = ?",
+                (document_id,),
+            ).fetchall()
+        return {
+            page_number: {"page_number": page_number, "contents": contents}
+            for page_number, contents in rows
+        }
+
+    def commit_batch(self, document_id, chunk_ids):
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO chunks VALUES (?, ?)",
+                [(document_id, chunk_id) for chunk_id in chunk_ids],
+            )
+            self._conn.execute(
+                "UPDATE documents SET updated = ? WHERE document_id = ?",
+                (time.time(), document_id),
+            )
+
+    def committed_ids(self, document_id):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT chunk_id FROM chunks WHERE document_id = ?", (document_id,)
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def finish_document(self, document_id):
+        """
+        Marks the document as done and drops its page and chunk progress,
+        which is no longer needed once everything is in the collection.
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM pages WHERE document_id = ?", (document_id,)
+            )
+            self._conn.execute(
+                "DELETE FROM chunks WHERE document_id = ?", (document_id,)
+            )
+            self._conn.execute(
+                "UPDATE documents SET status = 'done', updated = ? WHERE document_id = ?",
+                (time.time(), document_id),
+            )
+
+    def status(self, document_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT status FROM documents WHERE document_id = ?", (document_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def close(self):
+        self._conn.close()
@@ -1,16 +1,184 @@
+import os
+import shutil
+import threading
+
 import chromadb
 
+from embeddings import LEGACY_ENDPOINT, get_embedder
+from sharding import ShardedCollection, shard_strategy
+from vector_store import NumpyCollection
+
+# set these to share one Chroma server between several processes, such as
+# the workers of the HTTP service, instead of opening db/ in each of them
+CHROMA_HOST = os.environ.get("CHROMA_HOST")
+CHROMA_PORT = int(os.environ.get("CHROMA_PORT", "8000"))
+# "chroma", or "numpy" for the in-process memory-mapped engine
+VECTOR_BACKEND = os.environ.get("VECTOR_SEARCH_BACKEND", "chroma")
+NUMPY_PATH = os.path.join("db", "numpy")
+# "source", "date[:years]" or "hash:<shards>" to split collections into
+# shards, see sharding.py
+SHARDING = os.environ.get("VECTOR_SEARCH_SHARDING", "")
+
+# HNSW settings for new collections, from fastest to most accurate. They
+# are fixed when a collection is created, so changing the profile of an
+# existing collection means re-ingesting it into a new one.
+INDEX_PROFILES = {
+    "low-latency": {
+        "hnsw:space": "cosine",
+        "hnsw:M": 12,
+        "hnsw:construction_ef": 100,
+        "hnsw:search_ef": 24,
+        "hnsw:batch_size": 1000,
+        "hnsw:sync_threshold": 5000,
+    },
+    "balanced": {
+        "hnsw:space": "cosine",
+        "hnsw:M": 16,
+        "hnsw:construction_ef": 200,
+        "hnsw:search_ef": 64,
+        "hnsw:batch_size": 500,
+        "hnsw:sync_threshold": 2000,
+    },
+    "high-recall": {
+        "hnsw:space": "cosine",
+        "hnsw:M": 32,
+        "hnsw:construction_ef": 400,
+        "hnsw:search_ef": 200,
+        "hnsw:batch_size": 100,
+        "hnsw:sync_threshold": 1000,
+    },
+}
+INDEX_PROFILE = os.environ.get("VECTOR_SEARCH_INDEX_PROFILE", "balanced")
+
+# collections already warned about, so a search doesn't warn on every call
+_warned = set()
+
 
 class ChromaClient:
-    def __init__(self) -> None:
-        self.client = chromadb.PersistentClient("db/")
+    def __init__(
+        self, host=CHROMA_HOST, port=CHROMA_PORT, backend=VECTOR_BACKEND
+    ) -> None:
+        self.backend = backend
+        # one ShardedCollection per collection, sharding and embedder, so
+        # its open shards and thread pool are shared by every caller
+        self._sharded = {}
+        self._sharded_lock = threading.Lock()
+        if backend == "numpy":
+            self.client = None
+        elif host:
+            self.client = chromadb.HttpClient(host=host, port=port)
+        else:
+            self.client = chromadb.PersistentClient("db/")
 
     def client_info(self):
         print(self.client)
 
     def collection_info(self):
-        print(self.client.list_collections())
+        print(self.list_collections())
+
+    def list_collections(self):
+        if self.backend == "numpy":
+            return sorted(os.listdir(NUMPY_PATH)) if os.path.isdir(NUMPY_PATH) else []
+        # Chroma 0.6 returns names, as a str subclass that raises on any
+        # other attribute, and older versions return collections
+        return [
+            c if isinstance(c, str) else c.name for c in self.client.list_collections()
+        ]
 
-    def create_collection(self, collection_name):
-        collection = self.client.get_or_create_collection(name=collection_name)
+    def delete_collection(self, collection_name):
+        if self.backend == "numpy":
+            shutil.rmtree(os.path.join(NUMPY_PATH, collection_name), ignore_errors=True)
+        else:
+            self.client.delete_collection(collection_name)
+
+    def create_collection(
+        self, collection_name, embedder=None, profile=INDEX_PROFILE, sharding=SHARDING
+    ):
+        """
+        Returns the collection, creating it if needed. New collections
+        record which embedder produced their vectors, and opening a
+        collection with a different embedder is an error. `profile` is
+        the name of one of the INDEX_PROFILES, or a dict of HNSW
+        settings, and only applies to collections created by this call.
+        With `sharding`, the collection is a ShardedCollection spread
+        over one collection per shard.
+        """
+        embedder = embedder or get_embedder()
+        metadata = {**embedder.metadata(), **index_settings(profile)}
+        strategy = shard_strategy(sharding)
+        if strategy is not None:
+            key = (collection_name, sharding, embedder.key)
+            with self._sharded_lock:
+                if key not in self._sharded:
+                    self._sharded[key] = ShardedCollection(
+                        collection_name,
+                        strategy,
+                        open_shard=lambda name, metadata: self._open_collection(
+                            name, metadata, embedder
+                        ),
+                        list_shards=self.list_collections,
+                        drop_shard=self.delete_collection,
+                        metadata=metadata,
+                    )
+                return self._sharded[key]
+        return self._open_collection(collection_name, metadata, embedder)
+
+    def _open_collection(self, collection_name, metadata, embedder):
+        if self.backend == "numpy":
+            collection = NumpyCollection(
+                os.path.join(NUMPY_PATH, collection_name),
+                collection_name,
+                metadata=metadata,
+            )
+        else:
+            collection = self.client.get_or_create_collection(
+                name=collection_name, metadata=metadata
+            )
+
+        recorded = (collection.metadata or {}).get("embedding_model")
+        if recorded is None:
+            self._check_unrecorded(collection_name, embedder)
+        elif recorded != embedder.name:
+            raise ValueError(
+                f"Collection '{collection_name}' was embedded with '{recorded}', "
+                f"not '{embedder.name}'"
+            )
         return collection
+
+    def _check_unrecorded(self, collection_name, embedder):
+        """
+        A collection that doesn't record its embedding model was created
+        before models were recorded, by Ollama's legacy endpoint. Which
+        model it holds is unknown, so it is only opened with an Ollama
+        embedder, and with a warning.
+        """
+        try:
+            embedder.with_endpoint(LEGACY_ENDPOINT)
+        except ValueError:
+            raise ValueError(
+                f"Collection '{collection_name}' does not record its embedding "
+                f"model and cannot be searched with '{embedder.name}'"
+            ) from None
+        if collection_name not in _warned:
+            _warned.add(collection_name)
+            print(
+                f"Warning: collection '{collection_name}' does not record its "
+                f"embedding model. It is assumed to hold '{embedder.name}' vectors "
+                "from the legacy embeddings endpoint; re-ingest it into a new "
+                "collection if it doesn't."
+            )
+
+
+def index_settings(profile):
+    """
+    Returns the collection metadata for an index profile, which is either
+    the name of one of the INDEX_PROFILES or a dict of HNSW settings.
+    """
+    if isinstance(profile, dict):
+        return {"index_profile": "custom", **profile}
+    if profile not in INDEX_PROFILES:
+        raise ValueError(
+            f"Unknown index profile '{profile}', expected one of "
+            f"{', '.join(INDEX_PROFILES)}"
+        )
+    return {"index_profile": profile, **INDEX_PROFILES[profile]}
@@ -0,0 +1,89 @@
+CHUNK_SIZE = 800
+CHUNK_OVERLAP = 200
+SEPARATORS = ("\n\n", "\n", ". ", " ")
+
+
+def split_spans(
+    text, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, separators=SEPARATORS
+):
+    """
+    Yields (start, end) character offsets of overlapping chunks of the
+    text. Each chunk is at most `chunk_size` characters long and ends on
+    the strongest separator found inside its window, and consecutive
+    chunks share up to `chunk_overlap` characters. Leading and trailing
+    whitespace is left out of every span.
+    """
+    if chunk_size <= 0:
+        raise ValueError("chunk_size must be positive")
+    if not 0 <= chunk_overlap < chunk_size:
+        raise ValueError("chunk_overlap must be between 0 and chunk_size")
+
+    length = len(text)
+    start = _skip_whitespace(text, 0, length)
+
+    while start < length:
+        end = min(start + chunk_size, length)
+
+        if end < length:
+            # only break after the overlap so every chunk moves forward
+            for separator in separators:
+                cut = text.rfind(separator, start + chunk_overlap + 1, end)
+                if cut != -1:
+                    end = cut + len(separator)
+                    break
+
+        stop = end
+        while stop > start and text[stop - 1].isspace():
+            stop -= 1
+        if stop > start:
+            yield start, stop
+
+        if end >= length:
+            break
+
+        # begin the next chunk on a word boundary inside the overlap
+        next_start = max(end - chunk_overlap, start + 1)
+        if chunk_overlap and not text[next_start - 1].isspace():
+            for i in range(next_start, end):
+                if text[i].isspace():
+                    next_start = i
+                    break
+        start = _skip_whitespace(text, next_start, length)
+
+
+def _skip_whitespace(text, position, length):
+    while position < length and text[position].isspace():
+        position += 1
+    return position
+
+
+def split_text(
+    text, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, separators=SEPARATORS
+):
+    """
+    Splits the text into a list of overlapping chunks.
+    """
+    return [
+        text[start:end]
+        for start, end in split_spans(text, chunk_size, chunk_overlap, separators)
+    ]
+
+
+def iter_chunks(pages, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
+    """
+    Streams chunks out of an iterable of scraped pages, as returned by
+    FileReader.scrape_text(). Every chunk carries its page number and
+    its character offsets within that page, so a hit can be traced back
+    to the exact passage it came from.
+    """
+    for page in pages:
+        text = page["contents"] or ""
+        spans = split_spans(text, chunk_size, chunk_overlap)
+        for chunk_index, (start, end) in enumerate(spans):
+            yield {
+                "page_number": page["page_number"],
+                "contents": text[start:end],
+                "chunk_index": chunk_index,
+                "char_start": start,
+                "char_end": end,
+            }
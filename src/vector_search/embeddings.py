@@ -0,0 +1,314 @@
+import asyncio
+import hashlib
+import math
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import ollama
+import stamina
+
+from caching import EmbeddingCache
+
+EMBED_MODEL = "nomic-embed-text"
+# "ollama" or "hashing", the latter runs offline for tests and benchmarks
+EMBEDDER = os.environ.get("VECTOR_SEARCH_EMBEDDER", "ollama")
+
+EMBED_TIMEOUT = 60.0
+EMBED_ATTEMPTS = 4
+EMBED_REQUEST_SIZE = 64
+EMBED_CONCURRENCY = 4
+HASHING_DIMENSION = 512
+
+# Ollama's /api/embed returns unit-length vectors, its legacy
+# /api/embeddings endpoint doesn't. Collections record the endpoint their
+# vectors came from, and keep being queried through it.
+EMBED_ENDPOINT = "embed"
+LEGACY_ENDPOINT = "embeddings"
+
+# embedding model -> dimension, recorded on every collection so vectors
+# from different embedders never end up side by side
+EMBEDDING_MODELS = {
+    "nomic-embed-text": 768,
+    "mxbai-embed-large": 1024,
+    "all-minilm": 384,
+    f"hashing-{HASHING_DIMENSION}": HASHING_DIMENSION,
+}
+
+
+class Embedder:
+    """
+    Base class for embedding providers. Subclasses implement embed(),
+    which turns a list of texts into a list of vectors in the same order.
+    """
+
+    name = None
+    dimension = None
+
+    @property
+    def key(self):
+        """
+        Identifies the vectors this embedder produces, for caching.
+        """
+        return self.name
+
+    def embed(self, texts):
+        raise NotImplementedError
+
+    def with_endpoint(self, endpoint):
+        """
+        Returns the embedder that produces vectors through `endpoint`.
+        Only Ollama has more than one.
+        """
+        if endpoint is not None:
+            raise ValueError(f"Embedder '{self.name}' has no '{endpoint}' endpoint")
+        return self
+
+    async def aembed(self, texts):
+        return await asyncio.to_thread(self.embed, texts)
+
+    def metadata(self):
+        metadata = {"embedding_model": self.name}
+        if self.dimension is not None:
+            metadata["embedding_dimension"] = self.dimension
+        return metadata
+
+
+class OllamaEmbedder(Embedder):
+    """
+    Embeds through Ollama over one persistent, pooled HTTP client. Large
+    inputs are split into requests of `request_size` texts, at most
+    `concurrency` requests are in flight at once, and failed requests
+    are retried with backoff. With the LEGACY_ENDPOINT, texts are sent
+    one per request, as the old endpoint takes a single prompt.
+    """
+
+    def __init__(
+        self,
+        model=EMBED_MODEL,
+        host=None,
+        timeout=EMBED_TIMEOUT,
+        request_size=EMBED_REQUEST_SIZE,
+        concurrency=EMBED_CONCURRENCY,
+        endpoint=EMBED_ENDPOINT,
+    ):
+        if endpoint not in (EMBED_ENDPOINT, LEGACY_ENDPOINT):
+            raise ValueError(f"Unknown Ollama endpoint '{endpoint}'")
+        self.name = model
+        self.dimension = EMBEDDING_MODELS.get(model)
+        self.endpoint = endpoint
+        self.host = host
+        self.timeout = timeout
+        self.request_size = request_size
+        self.concurrency = concurrency
+        limits = httpx.Limits(
+            max_connections=concurrency, max_keepalive_connections=concurrency
+        )
+        self._client = ollama.Client(host=host, timeout=timeout, limits=limits)
+        self._async_client = None
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._pool = ThreadPoolExecutor(max_workers=concurrency)
+        self._variants = {}
+        self._variants_lock = threading.Lock()
+
+    @stamina.retry(
+        on=(httpx.TransportError, ollama.ResponseError), attempts=EMBED_ATTEMPTS
+    )
+    def _request(self, texts):
+        with self._slots:
+            if self.endpoint == LEGACY_ENDPOINT:
+                return [
+                    self._client.embeddings(model=self.name, prompt=text)["embedding"]
+                    for text in texts
+                ]
+            return self._client.embed(model=self.name, input=texts)["embeddings"]
+
+    @property
+    def key(self):
+        if self.endpoint == EMBED_ENDPOINT:
+            return self.name
+        return f"{self.name}/{self.endpoint}"
+
+    def metadata(self):
+        return {**super().metadata(), "embedding_endpoint": self.endpoint}
+
+    def with_endpoint(self, endpoint):
+        if endpoint in (None, self.endpoint):
+            return self
+        with self._variants_lock:
+            if endpoint not in self._variants:
+                self._variants[endpoint] = OllamaEmbedder(
+                    self.name,
+                    self.host,
+                    self.timeout,
+                    self.request_size,
+                    self.concurrency,
+                    endpoint,
+                )
+            return self._variants[endpoint]
+
+    def embed(self, texts):
+        texts = list(texts)
+        requests = [
+            texts[i : i + self.request_size]
+            for i in range(0, len(texts), self.request_size)
+        ]
+        if len(requests) <= 1:
+            return self._request(texts) if texts else []
+
+        embeddings = []
+        for result in self._pool.map(self._request, requests):
+            embeddings.extend(result)
+        return embeddings
+
+    @stamina.retry(
+        on=(httpx.TransportError, ollama.ResponseError), attempts=EMBED_ATTEMPTS
+    )
+    async def aembed(self, texts):
+        # cancelling the awaiting task aborts the request to Ollama
+        if self._async_client is None:
+            self._async_client = ollama.AsyncClient(
+                host=self.host, timeout=self.timeout
+            )
+        if self.endpoint == LEGACY_ENDPOINT:
+            return [
+                (await self._async_client.embeddings(model=self.name, prompt=text))[
+                    "embedding"
+                ]
+                for text in texts
+            ]
+        response = await self._async_client.embed(model=self.name, input=list(texts))
+        return response["embeddings"]
+
+
+class HashingEmbedder(Embedder):
+    """
+    A deterministic, in-process stand-in for a real embedding model.
+    Words and character trigrams are hashed into a fixed number of signed
+    buckets and the vector is normalized, so texts sharing vocabulary
+    land close together. Needs no server, which makes the whole pipeline
+    runnable offline in tests and benchmarks.
+    """
+
+    def __init__(self, dimension=HASHING_DIMENSION):
+        self.name = f"hashing-{dimension}"
+        self.dimension = dimension
+
+    def _features(self, text):
+        words = re.findall(r"\w+", text.casefold())
+        for word in words:
+            yield word, 1.0
+            padded = f"#{word}#"
+            for i in range(len(padded) - 2):
+                yield padded[i : i + 3], 0.5
+
+    def embed_one(self, text):
+        vector = [0.0] * self.dimension
+        for feature, weight in self._features(text):
+            digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+            value = int.from_bytes(digest, "little")
+            sign = 1.0 if value & 1 else -1.0
+            vector[(value >> 1) % self.dimension] += sign * weight
+
+        norm = math.sqrt(sum(v * v for v in vector))
+        return [v / norm for v in vector] if norm else vector
+
+    def embed(self, texts):
+        return [self.embed_one(text) for text in texts]
+
+
+_embedders = {}
+_embedders_lock = threading.Lock()
+
+
+def get_embedder(name=None):
+    """
+    Returns the shared embedder for a backend ("ollama" or "hashing"),
+    defaulting to the one picked with VECTOR_SEARCH_EMBEDDER.
+    """
+    name = name or EMBEDDER
+    with _embedders_lock:
+        if name not in _embedders:
+            if name == "hashing":
+                _embedders[name] = HashingEmbedder()
+            elif name == "ollama":
+                _embedders[name] = OllamaEmbedder()
+            else:
+                raise ValueError(f"Unknown embedder '{name}'")
+        return _embedders[name]
+
+
+def embedder_for(collection, embedder=None):
+    """
+    Returns the embedder whose vectors match the ones stored in the
+    collection. Collections that don't record an embedding model predate
+    the /api/embed endpoint and are queried through the legacy one.
+    """
+    embedder = embedder or get_embedder()
+    metadata = collection.metadata or {}
+    if metadata.get("embedding_model") is None:
+        return embedder.with_endpoint(LEGACY_ENDPOINT)
+    return embedder.with_endpoint(metadata.get("embedding_endpoint"))
+
+
+def embed_texts(texts, embedder=None):
+    """
+    Embed a batch of texts and return the embeddings in the same order
+    as the texts.
+    """
+    return (embedder or get_embedder()).embed(texts)
+
+
+def embed_text(text, embedder=None):
+    """
+    Embed a single piece of text, such as a search prompt.
+    """
+    return embed_texts([text], embedder)[0]
+
+
+# shared by the search screen and any programmatic search
+query_cache = EmbeddingCache()
+
+
+def embed_query(prompt, embedder=None):
+    """
+    Embed a search prompt, reusing the cached embedding when the same
+    normalized prompt was embedded recently.
+    """
+    embedder = embedder or get_embedder()
+    return query_cache.get_or_compute(
+        prompt, embedder.key, lambda: embed_text(prompt, embedder)
+    )
+
+
+def embed_queries(prompts, embedder=None):
+    """
+    Embed several search prompts, serving what it can from the cache and
+    embedding the rest with a single request.
+    """
+    embedder = embedder or get_embedder()
+    embeddings = [query_cache.get(prompt, embedder.key) for prompt in prompts]
+    missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+
+    if missing:
+        computed = embed_texts([prompts[i] for i in missing], embedder)
+        for i, embedding in zip(missing, computed):
+            query_cache.put(prompts[i], embedder.key, embedding)
+            embeddings[i] = embedding
+
+    return embeddings
+
+
+async def aembed_query(prompt, embedder=None):
+    """
+    Async version of embed_query(). With Ollama, cancelling the awaiting
+    task aborts the request, so superseded prompts stop costing anything.
+    """
+    embedder = embedder or get_embedder()
+    embedding = query_cache.get(prompt, embedder.key)
+    if embedding is None:
+        embedding = (await embedder.aembed([prompt]))[0]
+        query_cache.put(prompt, embedder.key, embedding)
+    return embedding
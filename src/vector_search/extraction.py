@@ -0,0 +1,96 @@
+import os
+import threading
+from contextlib import contextmanager
+
+SPACY_MODEL = os.environ.get("VECTOR_SEARCH_SPACY_MODEL", "en_core_web_lg")
+# set VECTOR_SEARCH_KEYWORDS=1 to extract keywords and entities while ingesting
+EXTRACT_KEYWORDS = os.environ.get("VECTOR_SEARCH_KEYWORDS", "") not in ("", "0")
+KEYWORD_PHRASES = 5
+ENTITY_LIMIT = 10
+NLP_BATCH_SIZE = 64
+
+# TextRank keys its phrases on the lemma and part of speech of the noun
+# chunks, so it needs the tagger, attribute_ruler, lemmatizer and parser,
+# and the entities need the ner; of the en_core_web pipes only senter, a
+# disabled stand-in for the parser's sentence boundaries, goes unused
+UNUSED_COMPONENTS = ("senter",)
+
+_models = {}
+# a spaCy pipeline is not safe to run from several threads at once
+_model_locks = {}
+_models_lock = threading.Lock()
+
+
+def get_nlp(model=SPACY_MODEL):
+    """
+    Returns the spaCy pipeline, with TextRank added, loading it the first
+    time it is asked for in this process. Every ingestion worker and
+    helper shares the one copy instead of loading its own, and annotate()
+    runs it from one thread at a time.
+    """
+    with _models_lock:
+        if model not in _models:
+            import spacy
+            import pytextrank  # noqa: F401, registers the "textrank" pipe
+
+            print(f"Loading spaCy model {model}")
+            nlp = spacy.load(model, exclude=list(UNUSED_COMPONENTS))
+            nlp.add_pipe("textrank")
+            _models[model] = nlp
+        return _models[model]
+
+
+def _lock_for(nlp):
+    with _models_lock:
+        return _model_locks.setdefault(id(nlp), threading.Lock())
+
+
+@contextmanager
+def shared_nlp(model=SPACY_MODEL):
+    """
+    Lends out the shared spaCy pipeline, to one thread at a time, for
+    anything that runs it directly rather than through annotate().
+    """
+    nlp = get_nlp(model)
+    with _lock_for(nlp):
+        yield nlp
+
+
+def annotate(texts, nlp=None, batch_size=NLP_BATCH_SIZE, phrases=KEYWORD_PHRASES):
+    """
+    Streams the texts through the pipeline in batches and returns, for
+    every text, its top TextRank phrases and its named entities as
+    comma-separated strings, ready to be stored as chunk metadata. Calls
+    sharing a pipeline wait for each other.
+    """
+    nlp = nlp or get_nlp()
+    annotations = []
+    with _lock_for(nlp):
+        for doc in nlp.pipe(texts, batch_size=batch_size):
+            entities = list(dict.fromkeys(ent.text for ent in doc.ents))
+            annotations.append(
+                {
+                    "keywords": ", ".join(p.text for p in doc._.phrases[:phrases]),
+                    "entities": ", ".join(entities[:ENTITY_LIMIT]),
+                }
+            )
+    return annotations
+
+
+def extract_batch(batch, nlp=None):
+    """
+    Adds keywords and entities to the metadata of the chunks of a batch
+    that are not stored yet. Errors are kept on the batch, like the
+    embedding errors, so a failing batch doesn't stop the others.
+    """
+    if batch.error is not None:
+        return batch
+    try:
+        new = [i for i, uid in enumerate(batch.ids) if uid not in batch.existing]
+        if new:
+            annotations = annotate([batch.texts[i] for i in new], nlp)
+            for i, annotation in zip(new, annotations):
+                batch.metadatas[i].update(annotation)
+    except Exception as e:
+        batch.error = e
+    return batch
@@ -1,14 +1,64 @@
 import os
-import fnmatch
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 import pypdf
 
-from utils.utils import pdf_to_images, scrape_page, replace_with_underscores
+from page_cache import page_cache
+from utils.utils import (
+    count_pdf_pages,
+    file_hash,
+    iter_pdf_pages,
+    is_usable_text,
+    LAYOUT_MODE,
+    ocr_pdf_page,
+    PAGE_OCR_CONFIG,
+    REGION_OCR_CONFIG,
+    scrape_image,
+    replace_with_underscores,
+)
+
+OCR_DPI = 150
+OCR_WORKERS = os.cpu_count() or 1
+# OCR processes are started from a forkserver rather than forked from an
+# ingesting process, whose other threads may hold locks (stdout, the HTTP
+# pool) that a forked child would wait on forever
+OCR_START_METHOD = "forkserver"
+
+
+def ocr_workers_for(jobs):
+    """
+    The OCR processes of each document when `jobs` documents are
+    ingested at the same time, so together they use every CPU once.
+    """
+    return max(1, OCR_WORKERS // max(1, jobs))
+
+
+OCR_ENGINE = "region"
+OCR_LAYOUT = LAYOUT_MODE
 
 
 class FileReader:
-    def __init__(self, filepath):
+    def __init__(
+        self,
+        filepath,
+        ocr_workers=OCR_WORKERS,
+        ocr_engine=OCR_ENGINE,
+        ocr_layout=OCR_LAYOUT,
+        cache=None,
+        document_key=None,
+    ):
         self.filepath = filepath
+        self.document_key = document_key
+        self.ocr_workers = ocr_workers
+        self.ocr_engine = ocr_engine
+        self.ocr_layout = ocr_layout
+        # extracted pages are looked up here before any page is read or
+        # OCR'd, pass False to always extract them again
+        self.cache = page_cache() if cache is None else cache or None
+        self._content_hash = None
+        self.document_id = self.generate_document_id()
         self.readable = self.is_readable()
         self.title = None
         self.authors = None
@@ -36,6 +86,64 @@ class FileReader:
         filename = f"{title}_{authors}_{timestamp}"
         return filename
 
+    def generate_document_id(self):
+        """
+        The document id is derived from the file's contents, so different
+        files never share an id, whatever they are called. A caller that
+        knows a file is a revision of an earlier document passes the same
+        `document_key` for both instead: the revision then keeps the id,
+        only its changed chunks are embedded and the chunks of the old
+        revision that are gone are removed.
+        """
+        if self.document_key is not None:
+            key = f"key:{self.document_key}"
+            return hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+        return self.content_hash()[:16]
+
+    def content_hash(self):
+        """
+        Hash of the file's bytes, used to tell revisions of a document apart
+        and to find its pages in the page cache.
+        """
+        if self._content_hash is None:
+            self._content_hash = file_hash(self.filepath)
+        return self._content_hash
+
+    def text_settings(self):
+        """
+        The settings pages read from the text layer are cached under.
+        """
+        return f"text pypdf={pypdf.__version__}"
+
+    def ocr_settings(self):
+        """
+        The settings OCR'd pages are cached under; changing any of them
+        means the pages have to be scanned again.
+        """
+        config = PAGE_OCR_CONFIG if self.ocr_engine == "page" else REGION_OCR_CONFIG
+        return (
+            f"ocr dpi={OCR_DPI} engine={self.ocr_engine} "
+            f"layout={self.ocr_layout} config={config}"
+        )
+
+    def cached_pages(self, settings, page_numbers=None):
+        """
+        Pages already extracted from an identical file with the same
+        settings, keyed by page number.
+        """
+        if self.cache is None:
+            return {}
+        return self.cache.pages(self.content_hash(), settings, page_numbers)
+
+    def cache_page(self, settings, page):
+        if self.cache is not None and "error" not in page:
+            self.cache.put(
+                self.content_hash(),
+                settings,
+                int(page["page_number"]),
+                page["contents"],
+            )
+
     def is_readable(self):
         """
         Determine whether or not the document is readable or not
@@ -49,61 +157,207 @@ class FileReader:
         except Exception:
             return False
 
-    def scrape_text(self):
+    def page_count(self):
+        if self.readable:
+            with open(self.filepath, "rb") as file:
+                return len(pypdf.PdfReader(file).pages)
+        return count_pdf_pages(self.filepath)
+
+    def scrape_text(self, completed_pages=None, on_page=None):
         """
-        This is to execute a scrape of a document
+        This is to execute a scrape of a document. Readable documents are
+        routed page by page, so only the pages without a usable text
+        layer are rendered and OCR'd.
+
+        `completed_pages` maps page numbers to pages OCR'd by an earlier,
+        interrupted run, which are reused instead of scanned again, and
+        `on_page` is called with every page as soon as its OCR finishes.
         """
-        folder_path = "image_store"
-        if not os.path.exists(folder_path):
-            os.makedirs(folder_path)
-            print(f"Folder '{folder_path}' created.")
-        else:
-            print(f"Folder '{folder_path}' already exists.")
+        text_list = list(self.iter_pages(completed_pages, on_page))
+        return text_list
 
+    def iter_pages(self, completed_pages=None, on_page=None):
+        """
+        Same as scrape_text(), but yields the pages in order as soon as
+        each one is ready, so later stages can start on the first pages
+        while the rest are still being scanned.
+        """
         if self.readable:
-            text_list = self.structured_scrape()
-            return text_list
+            yield from self.iter_hybrid(completed_pages, on_page)
 
         else:
-            text_list = self.unstructured_scrape()
-            return text_list
+            yield from self.iter_unstructured(completed_pages, on_page)
 
     def structured_scrape(self):
         text_list = []
         print(f"Beginning Structured Scrape of {self.title}")
-        pdf_to_images(self.filepath, self.title)
 
-        pdf = open(self.filepath, mode="rb")
-        pdf_document = pypdf.PdfReader(pdf)
-        num_pages = len(pdf_document.pages)
+        settings = self.text_settings()
+        cached = self.cached_pages(settings)
+
+        with open(self.filepath, mode="rb") as pdf:
+            pdf_document = pypdf.PdfReader(pdf)
+            num_pages = len(pdf_document.pages)
 
-        for i in range(num_pages):
-            page = pdf_document.pages[i]
-            contents = page.extract_text()
-            text_list.append({"page_number": str(i + 1), "contents": contents})
+            for i in range(num_pages):
+                if i + 1 in cached:
+                    text_list.append(
+                        {"page_number": str(i + 1), "contents": cached[i + 1]}
+                    )
+                    continue
+                page = pdf_document.pages[i]
+                contents = page.extract_text()
+                text_list.append({"page_number": str(i + 1), "contents": contents})
+                self.cache_page(settings, text_list[-1])
 
         print(f"Finished Structured Scrape of {self.title}")
 
         return text_list
 
-    def unstructured_scrape(self):
+    def hybrid_scrape(self, completed_pages=None, on_page=None):
+        return list(self.iter_hybrid(completed_pages, on_page))
+
+    def iter_hybrid(self, completed_pages=None, on_page=None):
+        """
+        Reads the text layer of every page with pypdf and keeps the pages
+        where it is usable. Pages that come back empty or garbled are the
+        only ones rendered and sent through OCR.
+        """
+        print(f"Beginning Hybrid Scrape of {self.title}")
+        text_list = self.structured_scrape()
+
+        ocr_pages = [
+            int(page["page_number"])
+            for page in text_list
+            if not is_usable_text(page["contents"])
+        ]
+
+        if ocr_pages:
+            print(f"{len(ocr_pages)} of {len(text_list)} pages need OCR")
+            scanned = self.iter_ocr_pages(ocr_pages, completed_pages, on_page)
+            ocr_pages = set(ocr_pages)
+            # closing this generator early closes the OCR one too, which
+            # drops the pages that have not been scanned yet
+            try:
+                for page in text_list:
+                    if int(page["page_number"]) in ocr_pages:
+                        yield next(scanned)
+                    else:
+                        yield page
+            finally:
+                scanned.close()
+        else:
+            yield from text_list
+
+        print(f"Finished Hybrid Scrape of {self.title}")
+
+    def unstructured_scrape(self, completed_pages=None, on_page=None):
+        return list(self.iter_unstructured(completed_pages, on_page))
+
+    def iter_unstructured(self, completed_pages=None, on_page=None):
         """
         Main application, the function will scrape one entire document
         based on the filepath provided
         """
         print(f"Beginning Unstructured Scrape of '{self.filepath}'\n")
-        pdf_to_images(self.filepath, self.title)
 
-        dir_path = "image_store"
+        if (
+            self.ocr_workers > 1
+            or completed_pages
+            or self.cached_pages(self.ocr_settings())
+        ):
+            yield from self.iter_ocr_pages(
+                range(1, count_pdf_pages(self.filepath) + 1), completed_pages, on_page
+            )
+        else:
+            for page_number, image in iter_pdf_pages(self.filepath, OCR_DPI):
+                contents = scrape_image(
+                    image, page_number, self.ocr_engine, self.ocr_layout
+                )
+                page = {"page_number": str(page_number), "contents": contents}
+                self.cache_page(self.ocr_settings(), page)
+                if on_page is not None:
+                    on_page(page)
+                yield page
 
-        number_of_files = len(fnmatch.filter(os.listdir(dir_path), f"{self.title}_*"))
+        print(f"Finished Unstructured Scrape of '{self.filepath}'\n")
 
-        text_list = []
+    def ocr_pages(self, page_numbers, completed_pages=None, on_page=None):
+        return list(self.iter_ocr_pages(page_numbers, completed_pages, on_page))
 
-        for i in range(number_of_files):
-            contents = scrape_page((i + 1), self.title)
-            text_list.append({"page_number": str(i + 1), "contents": contents})
+    def iter_ocr_pages(self, page_numbers, completed_pages=None, on_page=None):
+        """
+        Renders and scrapes the given pages, concurrently in a pool of
+        `ocr_workers` processes when there is more than one worker. All
+        pages are submitted straight away and yielded in page order as
+        they finish. A page that fails is yielded with empty contents
+        and the error instead of failing the whole document, and pages
+        found in `completed_pages` or in the page cache are not scanned
+        again.
+        """
+        page_numbers = sorted(page_numbers)
+        cached = self.cached_pages(self.ocr_settings(), page_numbers)
+        completed_pages = {
+            **{
+                str(page_number): {"page_number": str(page_number), "contents": text}
+                for page_number, text in cached.items()
+            },
+            **(completed_pages or {}),
+        }
+        pending = [p for p in page_numbers if str(p) not in completed_pages]
+        if len(pending) < len(page_numbers):
+            print(
+                f"Reusing {len(page_numbers) - len(pending)} pages scanned by an earlier run"
+                f" or found in the page cache"
+            )
 
-        print(f"Finished Unstructured Scrape of '{self.filepath}'\n")
+        if self.ocr_workers > 1 and len(pending) > 1:
+            executor = ProcessPoolExecutor(
+                max_workers=min(self.ocr_workers, len(pending)),
+                mp_context=multiprocessing.get_context(OCR_START_METHOD),
+            )
+        else:
+            executor = ThreadPoolExecutor(max_workers=1)
 
-        return text_list
+        futures = {
+            page_number: executor.submit(
+                ocr_pdf_page,
+                self.filepath,
+                page_number,
+                OCR_DPI,
+                self.ocr_engine,
+                self.ocr_layout,
+            )
+            for page_number in pending
+        }
+
+        return self._collect_ocr_pages(
+            executor, page_numbers, futures, completed_pages, on_page
+        )
+
+    def _collect_ocr_pages(
+        self, executor, page_numbers, futures, completed_pages, on_page
+    ):
+        # the generator may be closed early, such as when the pipeline
+        # reading it aborts, so drop the pages that have not started yet
+        # rather than waiting for the whole document to be OCR'd
+        try:
+            for page_number in page_numbers:
+                if page_number not in futures:
+                    yield completed_pages[str(page_number)]
+                    continue
+
+                page = {"page_number": str(page_number), "contents": ""}
+                try:
+                    page["contents"] = futures[page_number].result()
+                    self.cache_page(self.ocr_settings(), page)
+                    if on_page is not None:
+                        on_page(page)
+                except Exception as e:
+                    print(
+                        f"Error scraping page {page_number} of '{self.filepath}': {e}"
+                    )
+                    page["error"] = str(e)
+                yield page
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,210 @@
+import re
+import threading
+from collections import Counter
+
+from caching import collection_versions
+
+METADATA_PAGE_SIZE = 5000
+
+# the search box accepts these prefixes, for example `author:Smith` or
+# `title:"annual report"`, and maps them to metadata fields
+FIELD_ALIASES = {
+    "source": "source",
+    "title": "source",
+    "author": "authors",
+    "authors": "authors",
+    "publisher": "publisher",
+    "date": "date_published",
+    "year": "date_published",
+    "date_published": "date_published",
+    "keyword": "keywords",
+    "keywords": "keywords",
+}
+
+_FILTER = re.compile(r'(\w+):(?:"([^"]*)"|(\S+))')
+
+
+def parse_query(text):
+    """
+    Splits the filters out of a search box entry. Returns the remaining
+    prompt and a dict of filters; unknown prefixes, such as the scheme of
+    a URL, are left in the prompt.
+    """
+    filters = {}
+
+    def take(match):
+        field = FIELD_ALIASES.get(match.group(1).lower())
+        if field is None:
+            return match.group(0)
+        value = match.group(2) if match.group(2) is not None else match.group(3)
+        filters[field] = value
+        return " "
+
+    prompt = _FILTER.sub(take, text)
+    return " ".join(prompt.split()), filters
+
+
+class MetadataIndex:
+    """
+    In-memory index of the document-level metadata of a collection, one
+    entry per document rather than per chunk. Filters are matched here,
+    case-insensitively and on part of a value, so `author:smith` finds
+    "Jane Smith, John Doe". Fields that differ between the chunks of a
+    document, such as the extracted keywords, match when any chunk
+    matches. The filters are then pushed down to the collection
+    as a `where` clause on the matching documents, which narrows the
+    search to them and skips it entirely when there are none.
+
+    Ingestion in this process keeps the index up to date through
+    record_changes(), which adds and removes the metadata of the chunks
+    it wrote or deleted. The index is only rebuilt from the collection
+    when its version moved on without it, such as when another process
+    ingested, or after invalidate().
+    """
+
+    def __init__(self, collection, fields):
+        self.collection = collection
+        self.fields = fields
+        # the values of every field, counted over the document's chunks
+        self.documents = {}
+        self._chunks = Counter()
+        self._version = None
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        with self._lock:
+            self._version = None
+
+    def refresh(self):
+        with self._lock:
+            version = collection_versions().get(self.collection.name)
+            if version != self._version:
+                self._build()
+                self._version = version
+
+    def _build(self):
+        self.documents = {}
+        self._chunks = Counter()
+        offset = 0
+        while True:
+            page = self.collection.get(
+                include=["metadatas"], limit=METADATA_PAGE_SIZE, offset=offset
+            )
+            if not page["ids"]:
+                break
+            offset += len(page["ids"])
+            self._count(page["metadatas"], 1)
+
+    def _count(self, metadatas, step):
+        for metadata in metadatas:
+            document_id = (metadata or {}).get("document_id")
+            if document_id is None:
+                continue
+            values = self.documents.setdefault(
+                document_id, {field: Counter() for field in self.fields}
+            )
+            for field in self.fields:
+                if metadata.get(field):
+                    values[field][str(metadata[field])] += step
+                    if values[field][str(metadata[field])] <= 0:
+                        del values[field][str(metadata[field])]
+            self._chunks[document_id] += step
+            if self._chunks[document_id] <= 0:
+                del self._chunks[document_id]
+                del self.documents[document_id]
+
+    def apply(self, added=(), removed=()):
+        """
+        Bumps the version of the collection after its chunks changed. The
+        metadata of the chunks `removed` and `added` is taken out of and
+        put into the index if it was current, saving a rebuild; an index
+        that had missed an earlier change is rebuilt on its next use.
+        """
+        with self._lock:
+            versions = collection_versions()
+            before = versions.get(self.collection.name)
+            after = versions.bump(self.collection.name)
+            if self._version == before and after == before + 1:
+                self._count(removed, -1)
+                self._count(added, 1)
+                self._version = after
+
+    def match(self, filters):
+        """
+        Returns the ids of the documents that match every filter, or None
+        when there are no filters.
+        """
+        wanted = {
+            field: str(value).casefold()
+            for field, value in (filters or {}).items()
+            if field in self.fields and value not in (None, "")
+        }
+        if not wanted:
+            return None
+
+        self.refresh()
+        return sorted(
+            document_id
+            for document_id, metadata in self.documents.items()
+            if all(
+                any(value in stored.casefold() for stored in metadata[field])
+                for field, value in wanted.items()
+            )
+        )
+
+    def where(self, document_ids, fields=()):
+        """
+        The `where` clause that limits a search to the given documents.
+        The stored values of `fields` for those documents are added as
+        well, so a sharded collection can skip the shards without them.
+        """
+        clauses = [{"document_id": {"$in": list(document_ids)}}]
+        for field in fields:
+            values = sorted(
+                set().union(*(self.documents[d][field] for d in document_ids))
+            )
+            clauses.append({field: {"$in": values}})
+        return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def metadata_index(collection, fields):
+    """
+    Returns the shared MetadataIndex of a collection.
+    """
+    with _indexes_lock:
+        index = _indexes.get(collection.name)
+        if index is None:
+            index = _indexes[collection.name] = MetadataIndex(collection, fields)
+        # callers may open a new handle on the same collection every time
+        index.collection = collection
+        return index
+
+
+def record_changes(collection, added=(), removed=()):
+    """
+    Bumps the version of a collection whose chunks were written or
+    deleted, keeping its MetadataIndex up to date. `added` and `removed`
+    are the metadata of the chunks stored and deleted; a chunk whose
+    metadata was updated is removed with its old metadata and added with
+    its new.
+    """
+    with _indexes_lock:
+        index = _indexes.get(collection.name)
+    if index is None:
+        collection_versions().bump(collection.name)
+    else:
+        index.apply(added, removed)
+
+
+def invalidate(collection):
+    """
+    Marks the index of a collection as stale, after its metadata changed.
+    """
+    with _indexes_lock:
+        index = _indexes.get(collection.name)
+    if index is not None:
+        index.invalidate()
@@ -0,0 +1,446 @@
+import hashlib
+import time
+from dataclasses import dataclass, field
+from itertools import chain
+
+from chunking import iter_chunks, CHUNK_SIZE, CHUNK_OVERLAP
+from embeddings import embed_texts, embedder_for
+from extraction import extract_batch, EXTRACT_KEYWORDS
+from filters import record_changes
+from keyword_index import keyword_index
+from pipeline import Pipeline, QUEUE_SIZE
+
+EMBED_BATCH_SIZE = 32
+EMBED_WORKERS = 2
+EXTRACT_WORKERS = 1
+
+# chunk fields copied into the stored metadata when present
+CHUNK_METADATA_KEYS = ("chunk_index", "char_start", "char_end")
+
+
+@dataclass
+class IngestStats:
+    """Running totals for a single ingestion run."""
+
+    pages: int = 0
+    total_pages: int = 0
+    chunks: int = 0
+    batches: int = 0
+    existing: int = 0
+    skipped: int = 0
+    failed: int = 0
+    removed: int = 0
+    last_page: str = ""
+    queue_depths: dict = field(default_factory=dict)
+    started: float = field(default_factory=time.perf_counter)
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def chunks_per_second(self):
+        elapsed = self.elapsed
+        return self.chunks / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def percent_complete(self):
+        if not self.total_pages or not self.last_page:
+            return 0
+        return int(self.last_page) * 100 // self.total_pages
+
+    def summary(self):
+        return (
+            f"{self.chunks} chunks in {self.elapsed:.1f}s "
+            f"({self.chunks_per_second:.1f} chunks/s, {self.batches} batches, "
+            f"{self.existing} already embedded, {self.removed} removed, "
+            f"{self.skipped} skipped, {self.failed} failed)"
+        )
+
+
+def chunk_id(document_id, page_number, text):
+    """
+    Returns the deterministic id of a chunk, so the same text on the same
+    page of the same document always maps to the same vector.
+    """
+    digest = hashlib.sha256()
+    for part in (document_id, str(page_number), text):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+@dataclass
+class ChunkBatch:
+    """A batch of chunks on its way to the collection."""
+
+    ids: list
+    texts: list
+    metadatas: list
+    # the stored metadata of the chunks that are already in the collection
+    existing: dict = field(default_factory=dict)
+    embeddings: list = None
+    error: Exception = None
+
+
+class BatchBuilder:
+    """
+    Turns chunks into batches of `batch_size` with their ids and
+    metadata, leaving out blank chunks, repeated chunks and chunks that
+    are already known to be committed.
+    """
+
+    def __init__(self, metadata, document_id, stats, batch_size, committed_ids=None):
+        self.metadata = metadata
+        self.document_id = document_id
+        self.stats = stats
+        self.batch_size = batch_size
+        self.committed_ids = committed_ids or set()
+        self.seen_ids = set()
+        self._pending = ChunkBatch([], [], [])
+
+    def add(self, chunk):
+        """
+        Adds a chunk and returns a batch once one is full.
+        """
+        self.stats.last_page = chunk["page_number"]
+        if not chunk["contents"] or not chunk["contents"].strip():
+            self.stats.skipped += 1
+            return None
+
+        uid = chunk_id(self.document_id, chunk["page_number"], chunk["contents"])
+        if uid in self.seen_ids:
+            self.stats.skipped += 1
+            return None
+        self.seen_ids.add(uid)
+        if uid in self.committed_ids:
+            self.stats.existing += 1
+            return None
+
+        self._pending.ids.append(uid)
+        self._pending.texts.append(chunk["contents"])
+        self._pending.metadatas.append(
+            {
+                "unique_id": uid,
+                **self.metadata,
+                "document_id": self.document_id,
+                "page": chunk["page_number"],
+                **{k: chunk[k] for k in CHUNK_METADATA_KEYS if k in chunk},
+            }
+        )
+
+        if len(self._pending.ids) >= self.batch_size:
+            return self.flush()
+        return None
+
+    def flush(self):
+        """
+        Returns whatever is left as a final, possibly short, batch.
+        """
+        batch, self._pending = self._pending, ChunkBatch([], [], [])
+        return batch if batch.ids else None
+
+
+def embed_batch(collection, batch):
+    """
+    Looks up which chunks of the batch are already stored with one
+    `collection.get` and embeds the rest with one request. Errors are
+    kept on the batch so that one bad batch doesn't stop the others.
+    """
+    try:
+        stored = collection.get(ids=batch.ids, include=["metadatas"])
+        batch.existing = dict(zip(stored["ids"], stored["metadatas"]))
+        new_texts = [
+            text
+            for uid, text in zip(batch.ids, batch.texts)
+            if uid not in batch.existing
+        ]
+        batch.embeddings = (
+            embed_texts(new_texts, embedder_for(collection)) if new_texts else []
+        )
+    except Exception as e:
+        batch.error = e
+    return batch
+
+
+def write_batch(collection, index, batch, stats, on_batch=None):
+    """
+    Stores the new chunks of an embedded batch with one `collection.add`,
+    adds them to the keyword `index` and refreshes the metadata of the
+    chunks that were already stored.
+    """
+    if batch.error is None:
+        try:
+            existing = [i for i, uid in enumerate(batch.ids) if uid in batch.existing]
+            new = [i for i, uid in enumerate(batch.ids) if uid not in batch.existing]
+
+            if existing:
+                collection.update(
+                    ids=[batch.ids[i] for i in existing],
+                    metadatas=[batch.metadatas[i] for i in existing],
+                )
+                stats.existing += len(existing)
+
+            if new:
+                collection.add(
+                    ids=[batch.ids[i] for i in new],
+                    embeddings=batch.embeddings,
+                    documents=[batch.texts[i] for i in new],
+                    metadatas=[batch.metadatas[i] for i in new],
+                )
+                # extracted key phrases are indexed with the text, which
+                # boosts the chunks they were found in
+                index.add(
+                    [batch.ids[i] for i in new],
+                    [
+                        f"{batch.texts[i]}\n{batch.metadatas[i].get('keywords', '')}"
+                        for i in new
+                    ],
+                    [batch.metadatas[i]["document_id"] for i in new],
+                )
+                stats.chunks += len(new)
+                stats.batches += 1
+
+            record_changes(
+                collection,
+                added=[
+                    {**batch.existing.get(uid, {}), **metadata}
+                    for uid, metadata in zip(batch.ids, batch.metadatas)
+                ],
+                removed=[
+                    batch.existing[uid] for uid in batch.ids if uid in batch.existing
+                ],
+            )
+            if on_batch is not None:
+                on_batch(batch.ids)
+        except Exception as e:
+            batch.error = e
+
+    if batch.error is not None:
+        stats.failed += len(batch.ids)
+        print("Error: ", batch.error)
+
+
+def ingest_chunks(
+    collection,
+    chunks,
+    metadata,
+    document_id,
+    batch_size=EMBED_BATCH_SIZE,
+    progress=None,
+    committed_ids=None,
+    on_batch=None,
+    stats=None,
+    extract_keywords=EXTRACT_KEYWORDS,
+):
+    """
+    Embed and store an iterable of chunks, where each chunk is a dict
+    with "page_number" and "contents" and optionally the offsets added
+    by chunking.iter_chunks(). Chunks are grouped into batches
+    of `batch_size`. The ids of each batch are looked up with one
+    `collection.get`; only chunks that are not stored yet are embedded
+    (with one request) and written (with one `collection.add`), while
+    chunks that are already stored just get their metadata refreshed.
+    Chunks of the document that no longer exist are removed at the end.
+
+    `metadata` is merged into every chunk's metadata, and `progress` is
+    called with the running stats after every batch. Chunks listed in
+    `committed_ids` are known to be stored already, such as the ones an
+    interrupted run committed, and are skipped without any lookup;
+    `on_batch` is called with the ids of every batch once it is stored.
+    With `extract_keywords`, the key phrases and named entities of every
+    new chunk are stored in its metadata as well.
+    """
+    stats = stats or IngestStats()
+    builder = BatchBuilder(metadata, document_id, stats, batch_size, committed_ids)
+    index = keyword_index(collection)
+
+    for chunk in chain(chunks, [None]):
+        batch = builder.add(chunk) if chunk is not None else builder.flush()
+        if batch is None:
+            continue
+
+        batch = embed_batch(collection, batch)
+        if extract_keywords:
+            batch = extract_batch(batch)
+        write_batch(collection, index, batch, stats, on_batch)
+        if progress is not None:
+            progress(stats)
+
+    if not stats.failed:
+        stats.removed = remove_stale_chunks(collection, document_id, builder.seen_ids)
+
+    return stats
+
+
+def ingest_pages(
+    collection,
+    pages,
+    metadata,
+    document_id,
+    chunk_size=CHUNK_SIZE,
+    chunk_overlap=CHUNK_OVERLAP,
+    batch_size=EMBED_BATCH_SIZE,
+    embed_workers=EMBED_WORKERS,
+    queue_size=QUEUE_SIZE,
+    progress=None,
+    committed_ids=None,
+    on_batch=None,
+    stats=None,
+    extract_keywords=EXTRACT_KEYWORDS,
+    extract_workers=EXTRACT_WORKERS,
+):
+    """
+    Pipelined version of ingest_chunks() that takes pages rather than
+    chunks. Extraction (iterating `pages`), chunking, embedding and
+    writing each run on their own threads, connected by queues of
+    `queue_size` items, so OCR, embedding requests and database writes
+    overlap. Embedding runs on `embed_workers` threads; chunking and
+    writing run on one each. With `extract_keywords`, an extraction
+    stage between embedding and writing runs the new chunks through the
+    shared spaCy pipeline on `extract_workers` threads, which take turns
+    on it. The stats passed to `progress` carry the depth of every queue.
+
+    Pages that could not be scraped (those with an "error") count as
+    failed, like chunks that could not be embedded, and keep the
+    document's stale chunks from being removed.
+    """
+    stats = stats or IngestStats()
+    builder = BatchBuilder(metadata, document_id, stats, batch_size, committed_ids)
+    # opened, and built for a collection that predates it, before any
+    # stage starts, rather than by the write stage while the queues fill
+    index = keyword_index(collection)
+    pipeline = Pipeline(queue_size)
+
+    def chunk(page):
+        stats.pages += 1
+        if "error" in page:
+            # the page is missing from this run, so the document is not complete
+            stats.failed += 1
+        batches = (
+            builder.add(chunk)
+            for chunk in iter_chunks([page], chunk_size, chunk_overlap)
+        )
+        return [batch for batch in batches if batch is not None]
+
+    def flush():
+        batch = builder.flush()
+        return [batch] if batch is not None else []
+
+    def embed(batch):
+        return [embed_batch(collection, batch)]
+
+    def write(batch):
+        write_batch(collection, index, batch, stats, on_batch)
+        stats.queue_depths = pipeline.depths()
+        if progress is not None:
+            progress(stats)
+
+    pipeline.add_stage("chunk", chunk, flush=flush)
+    pipeline.add_stage("embed", embed, workers=embed_workers)
+    if extract_keywords:
+        pipeline.add_stage(
+            "extract", lambda batch: [extract_batch(batch)], workers=extract_workers
+        )
+    pipeline.add_stage("write", write)
+    pipeline.run(pages)
+
+    if not stats.failed:
+        stats.removed = remove_stale_chunks(collection, document_id, builder.seen_ids)
+
+    return stats
+
+
+def remove_stale_chunks(collection, document_id, keep_ids):
+    """
+    Deletes the chunks stored for the document that are not in `keep_ids`,
+    such as the passages of a revised document that changed, and returns
+    how many were removed.
+    """
+    stored = collection.get(where={"document_id": document_id}, include=["metadatas"])
+    stale = [
+        (uid, metadata)
+        for uid, metadata in zip(stored["ids"], stored["metadatas"])
+        if uid not in keep_ids
+    ]
+    if stale:
+        collection.delete(ids=[uid for uid, _ in stale])
+        keyword_index(collection).delete([uid for uid, _ in stale])
+        record_changes(collection, removed=[metadata for _, metadata in stale])
+    return len(stale)
+
+
+def apply_metadata(collection, document_id, metadata):
+    """
+    Writes document-level metadata, such as a title entered after the
+    document was already embedded, onto all of its stored chunks with a
+    single bulk update. Nothing has to be embedded again.
+    """
+    stored = collection.get(where={"document_id": document_id}, include=["metadatas"])
+    if stored["ids"]:
+        updated = [{**m, **metadata} for m in stored["metadatas"]]
+        collection.update(ids=stored["ids"], metadatas=updated)
+        record_changes(collection, added=updated, removed=stored["metadatas"])
+    return len(stored["ids"])
+
+
+def ingest_document(
+    file,
+    collection,
+    journal,
+    chunk_size=CHUNK_SIZE,
+    chunk_overlap=CHUNK_OVERLAP,
+    batch_size=EMBED_BATCH_SIZE,
+    embed_workers=EMBED_WORKERS,
+    queue_size=QUEUE_SIZE,
+    progress=None,
+    extract_keywords=EXTRACT_KEYWORDS,
+):
+    """
+    Scrapes, chunks, embeds and stores a single FileReader, checkpointing
+    its progress in the journal so an interrupted run picks up where it
+    left off. The stages run as a pipeline, so embedding starts with the
+    first scraped pages.
+
+    The chunks are stored with the file's metadata as it is when the call
+    starts. That may be provisional, such as a title taken from the file
+    name while the user is still entering the real one: the caller then
+    writes the final metadata onto the stored chunks with apply_metadata()
+    once it is known, which doesn't embed anything again.
+    """
+    content_hash = file.content_hash()
+    if journal.start_document(file.document_id, file.filepath, content_hash):
+        print(f"Resuming ingestion of {file.filepath}")
+
+    pages = file.iter_pages(
+        journal.pages(file.document_id),
+        on_page=lambda page: journal.record_page(file.document_id, page),
+    )
+
+    stats = ingest_pages(
+        collection,
+        pages,
+        {
+            "source": file.title,
+            "authors": file.authors,
+            "publisher": file.publisher,
+            "date_published": file.date_published,
+            "content_hash": content_hash,
+        },
+        file.document_id,
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        batch_size=batch_size,
+        embed_workers=embed_workers,
+        queue_size=queue_size,
+        progress=progress,
+        committed_ids=journal.committed_ids(file.document_id),
+        on_batch=lambda ids: journal.commit_batch(file.document_id, ids),
+        stats=IngestStats(total_pages=file.page_count()),
+        extract_keywords=extract_keywords,
+    )
+
+    if not stats.failed:
+        journal.finish_document(file.document_id)
+
+    return stats
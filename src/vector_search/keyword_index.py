@@ -0,0 +1,310 @@
+import heapq
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+
+KEYWORD_INDEX_PATH = os.path.join("db", "keywords")
+BM25_K1 = 1.2
+BM25_B = 0.75
+REBUILD_PAGE_SIZE = 5000
+# changes kept for other processes to catch up with; one further behind
+# reloads the whole index
+CHANGE_LOG_SIZE = 50000
+
+# words, plus codes like "AB-1234" or "3.2.1" kept together as one term
+_TOKEN = re.compile(r"\w+(?:[-./]\w+)*")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    row INTEGER PRIMARY KEY,
+    id TEXT UNIQUE NOT NULL,
+    document_id TEXT,
+    terms TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    row INTEGER,
+    id TEXT,
+    removed TEXT
+);
+"""
+
+
+def tokenize(text):
+    """
+    Lower-cased terms of a text. A code made of several parts is indexed
+    both whole and by part, so "AB-1234" is found by "ab-1234" and "1234".
+    """
+    terms = []
+    for match in _TOKEN.finditer(text.casefold()):
+        term = match.group(0)
+        terms.append(term)
+        if not term.isalnum():
+            terms.extend(re.findall(r"\w+", term))
+    return terms
+
+
+def is_lexical(query):
+    """
+    Whether a query looks like a keyword lookup rather than a question:
+    a quoted phrase, a single word such as a surname, or anything with a
+    number in it, such as a part number.
+    """
+    query = query.strip()
+    if len(query) > 1 and query[0] == query[-1] == '"':
+        return True
+    words = query.split()
+    return len(words) == 1 or any(any(c.isdigit() for c in word) for word in words)
+
+
+class KeywordIndex:
+    """
+    BM25 inverted index over the chunks of one collection, kept in memory
+    for lookups and in a SQLite file so it survives restarts. Ingestion
+    adds chunks as they are written to the collection and removes them
+    when they are deleted, so the two stay in step without a rebuild.
+    Every add and delete is also logged, so changes committed by another
+    process are picked up by replaying the log rather than reloading.
+    """
+
+    def __init__(self, path, k1=BM25_K1, b=BM25_B):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(SCHEMA)
+        self._load()
+
+    def _data_version(self):
+        return self._db.execute("PRAGMA data_version").fetchone()[0]
+
+    def _last_change(self):
+        (seq,) = self._db.execute("SELECT MAX(seq) FROM changes").fetchone()
+        return seq or 0
+
+    def _load(self):
+        with self._lock:
+            # read before the chunks, so a change committed in between is
+            # replayed rather than missed
+            self._version = self._data_version()
+            self._seq = self._last_change()
+            self.postings = {}
+            self.rows = {}
+            self.document_ids = {}
+            self.lengths = {}
+            self.total_length = 0
+            for row, uid, document_id, terms in self._db.execute(
+                "SELECT row, id, document_id, terms FROM chunks"
+            ):
+                self._index(row, uid, document_id, json.loads(terms))
+
+    def _refresh(self):
+        """
+        Catches up with the chunks other processes added or deleted since
+        the last refresh, by replaying the changes they logged. The index
+        is only reloaded in full when it was cleared, or when the changes
+        it missed have already been trimmed from the log.
+        """
+        version = self._data_version()
+        if version == self._version:
+            return
+        self._version = version
+        changes = self._db.execute(
+            "SELECT seq, row, id, removed FROM changes WHERE seq > ? ORDER BY seq",
+            (self._seq,),
+        ).fetchall()
+        if changes and changes[0][0] != self._seq + 1:
+            self._load()
+            return
+        for seq, row, uid, removed in changes:
+            if row is None:
+                self._load()
+                return
+            if removed is not None:
+                # replaying is idempotent: the change may already be applied
+                if self.rows.get(uid) == row:
+                    self._unindex(row, json.loads(removed))
+            elif row not in self.document_ids:
+                chunk = self._db.execute(
+                    "SELECT id, document_id, terms FROM chunks WHERE row = ?", (row,)
+                ).fetchone()
+                if chunk is not None and chunk[0] not in self.rows:
+                    self._index(row, chunk[0], chunk[1], json.loads(chunk[2]))
+            self._seq = seq
+
+    def _log(self, rows, removed=None):
+        """
+        Logs changes made by this index, and skips them when refreshing if
+        no other process logged any since the last refresh.
+        """
+        first = None
+        for row, uid in rows:
+            seq = self._db.execute(
+                "INSERT INTO changes (row, id, removed) VALUES (?, ?, ?)",
+                (row, uid, removed and removed[uid]),
+            ).lastrowid
+            first = first or seq
+        if first is None:
+            return
+        if first == self._seq + 1:
+            self._seq = seq
+        self._db.execute("DELETE FROM changes WHERE seq <= ?", (seq - CHANGE_LOG_SIZE,))
+
+    def _index(self, row, uid, document_id, terms):
+        self.rows[uid] = row
+        self.document_ids[row] = (uid, document_id)
+        self.lengths[row] = sum(terms.values())
+        self.total_length += self.lengths[row]
+        for term, tf in terms.items():
+            self.postings.setdefault(term, {})[row] = tf
+
+    def _unindex(self, row, terms):
+        for term in terms:
+            postings = self.postings.get(term, {})
+            postings.pop(row, None)
+            if not postings:
+                self.postings.pop(term, None)
+        self.total_length -= self.lengths.pop(row)
+        uid, _ = self.document_ids.pop(row)
+        del self.rows[uid]
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return len(self.rows)
+
+    def add(self, ids, texts, document_ids=None):
+        """
+        Indexes chunks by id. Chunks that are already indexed are skipped,
+        since a chunk's id is derived from its text.
+        """
+        document_ids = document_ids or [None] * len(ids)
+        with self._lock, self._db:
+            self._refresh()
+            added = []
+            for uid, text, document_id in zip(ids, texts, document_ids):
+                if uid in self.rows:
+                    continue
+                terms = Counter(tokenize(text or ""))
+                row = self._db.execute(
+                    "INSERT INTO chunks (id, document_id, terms) VALUES (?, ?, ?)",
+                    (uid, document_id, json.dumps(terms)),
+                ).lastrowid
+                self._index(row, uid, document_id, terms)
+                added.append((row, uid))
+            self._log(added)
+
+    def delete(self, ids):
+        with self._lock, self._db:
+            self._refresh()
+            deleted = []
+            removed = {}
+            for uid in ids:
+                row = self.rows.get(uid)
+                if row is None:
+                    continue
+                (terms,) = self._db.execute(
+                    "SELECT terms FROM chunks WHERE row = ?", (row,)
+                ).fetchone()
+                self._unindex(row, json.loads(terms))
+                self._db.execute("DELETE FROM chunks WHERE row = ?", (row,))
+                deleted.append((row, uid))
+                removed[uid] = terms
+            self._log(deleted, removed)
+
+    def clear(self):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM chunks")
+            self._db.execute("DELETE FROM changes")
+            # a change without a row tells other processes to reload
+            self._db.execute("INSERT INTO changes (row) VALUES (NULL)")
+            self._load()
+
+    def search(self, query, n_results, document_ids=None):
+        """
+        Returns the ids and BM25 scores of the best `n_results` chunks for
+        the query, best first, optionally only from the given documents.
+        """
+        terms = set(tokenize(query))
+        with self._lock:
+            self._refresh()
+            count = len(self.rows)
+            if not count or not terms:
+                return []
+            average = self.total_length / count
+            allowed = set(document_ids) if document_ids is not None else None
+
+            scores = {}
+            for term in terms:
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(
+                    1 + (count - len(postings) + 0.5) / (len(postings) + 0.5)
+                )
+                for row, tf in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self.lengths[row] / average)
+                    scores[row] = scores.get(row, 0.0) + idf * tf * (self.k1 + 1) / (
+                        tf + norm
+                    )
+
+            if allowed is not None:
+                scores = {
+                    row: score
+                    for row, score in scores.items()
+                    if self.document_ids[row][1] in allowed
+                }
+            best = heapq.nlargest(n_results, scores.items(), key=lambda item: item[1])
+            return [(self.document_ids[row][0], score) for row, score in best]
+
+    def rebuild(self, collection, page_size=REBUILD_PAGE_SIZE):
+        """
+        Indexes every chunk already stored in the collection, for
+        collections ingested before the keyword index existed.
+        """
+        self.clear()
+        offset = 0
+        while True:
+            page = collection.get(
+                include=["documents", "metadatas"], limit=page_size, offset=offset
+            )
+            if not page["ids"]:
+                break
+            offset += len(page["ids"])
+            self.add(
+                page["ids"],
+                page["documents"],
+                [(m or {}).get("document_id") for m in page["metadatas"]],
+            )
+
+    def close(self):
+        self._db.close()
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def keyword_index(collection):
+    """
+    Returns the shared KeywordIndex of a collection. The first time an
+    index is opened next to a collection that already has chunks, it is
+    filled from the collection.
+    """
+    with _indexes_lock:
+        index = _indexes.get(collection.name)
+        if index is None:
+            index = KeywordIndex(
+                os.path.join(KEYWORD_INDEX_PATH, f"{collection.name}.sqlite3")
+            )
+            if not len(index) and collection.count():
+                print(f"Building the keyword index of '{collection.name}'")
+                index.rebuild(collection)
+            _indexes[collection.name] = index
+        return index
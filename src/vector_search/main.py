@@ -1,17 +1,15 @@
 from __future__ import annotations
 import os
+import sys
 import shutil
 import builtins
 from typing_extensions import Doc
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 from rich.console import Console
-from tqdm import tqdm
-import ollama
-import uuid
-from PIL import Image
-from pdf2image import convert_from_path
-from textual import work, on
+from textual import on
 from textual.reactive import reactive
 from textual.screen import Screen
 from textual.app import App, ComposeResult
@@ -19,12 +17,38 @@ from textual.containers import VerticalScroll
 from textual.widget import Widget
 from textual.widgets import Input, Markdown, Static, Button, Header
 
-from file_reader import FileReader
-from chroma_db import ChromaClient
+# The OCR, embedding and database modules pull in cv2, chromadb, ollama
+# and the like, which take seconds to import. They are imported by the
+# screens and commands that use them, not here, so the first frame shows
+# up straight away; see warm_up().
 
 console = Console()
-_client = ChromaClient()
-Image.MAX_IMAGE_PIXELS = None
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """
+    Opens the Chroma client the first time it is needed.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            from chroma_db import ChromaClient
+
+            _client = ChromaClient()
+        return _client
+
+
+def warm_up():
+    """
+    Imports the search stack and opens the client in the background once
+    the first frame is up, so the first search doesn't pay for it.
+    """
+    import search  # noqa: F401
+    import scheduler  # noqa: F401
+
+    get_client()
 
 
 def rich_print(*args, **kwargs):
@@ -37,7 +61,7 @@ SETTINGS_TEXT = """
 
 VectorSearch Application
 
-Press "Ctrl + a" to go to the search page. As you type, answers will appear from the database.
+Press "Ctrl + a" to go to the search page. As you type, answers will appear from the database. Narrow a search down with filters such as author:Smith, title:"Annual Report", publisher:Penguin or year:1999.
 
 Press "Ctrl + s" to return to this page, the settings page. If you are in an input box these controls dont work.
 
@@ -102,98 +126,112 @@ class Processing(Screen):
         yield Name()
 
     async def scan_documents(self):
+        from pdf2image import convert_from_path
+
+        from checkpoint import IngestJournal
+        from file_reader import FileReader
+        from ingestion import ingest_document, apply_metadata
+
         folderpath = "./uploaded"
-        _client.client_info
+        client = get_client()
+        client.client_info
+        journal = IngestJournal()
 
         for f in os.listdir(folderpath):
             filepath = os.path.join(folderpath, f)
 
             self.query_one(Name).status = f"Beginning scrape of {filepath}"
-            time.sleep(2)
             file = FileReader(filepath)
 
-            images = convert_from_path(filepath, dpi=200, first_page=1, last_page=1)
-            image = images[0]
-            image.show()
-
-            self.query_one(
-                Name
-            ).status = (
-                f"Enter metadata for {filepath} in the form above and click 'Submit'"
-            )
-
-            while True:
-                try:
-                    if self.run_scrape:
-                        file.input_metadata(
-                            self.title,
-                            self.authors,
-                            self.publisher,
-                            self.date_published,
-                        )
-                        break
-                    else:
-                        time.sleep(5)
-                        pass
-                except Exception as e:
-                    print(f"An error occurred: {e}. Please try again.")
-
-            new_filename = file.generate_filename()
-            text_list = file.scrape_text()
+            # start scraping and embedding straight away under a provisional
+            # title, the real metadata is attached once it has been entered
+            file.input_metadata(os.path.splitext(f)[0], "", "", "")
+            collection = client.create_collection("library")
 
-            self.run_scrape = False
+            print("Collection: ", collection)
 
-            collection = _client.create_collection("library")
+            def report_progress(stats):
+                queued = ", ".join(f"{k} {v}" for k, v in stats.queue_depths.items())
+                self.query_one(Name).status = (
+                    f"{filepath} is being scanned {stats.percent_complete}% complete "
+                    f"({stats.chunks_per_second:.1f} chunks/s, queued: {queued})..."
+                    + ("" if self.run_scrape else " Enter metadata and click 'Submit'")
+                )
 
-            print("Collection: ", collection)
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                scan = executor.submit(
+                    ingest_document, file, collection, journal, progress=report_progress
+                )
 
-            list_length = len(text_list)
+                images = convert_from_path(
+                    filepath, dpi=200, first_page=1, last_page=1
+                )
+                image = images[0]
+                image.show()
 
-            for i, text in enumerate(tqdm(text_list)):
-                print(i, text)
                 self.query_one(
                     Name
                 ).status = (
-                    f"{self.title} is being scanned {i // list_length}% complete..."
+                    f"Enter metadata for {filepath} in the form above and click 'Submit'"
+                )
+
+                while True:
+                    try:
+                        if self.run_scrape:
+                            file.input_metadata(
+                                self.title,
+                                self.authors,
+                                self.publisher,
+                                self.date_published,
+                            )
+                            break
+                        else:
+                            time.sleep(0.5)
+                            pass
+                    except Exception as e:
+                        print(f"An error occurred: {e}. Please try again.")
+
+                new_filename = file.generate_filename()
+
+                stats = scan.result()
+
+            self.run_scrape = False
+
+            apply_metadata(
+                collection,
+                file.document_id,
+                {
+                    "source": file.title,
+                    "authors": file.authors,
+                    "publisher": file.publisher,
+                    "date_published": file.date_published,
+                },
+            )
+            print(f"Ingested {file.title}: {stats.summary()}")
+
+            if stats.failed:
+                # left in ./uploaded, so the next scan resumes it from the journal
+                self.query_one(Name).status = (
+                    f"{self.title} was not fully scanned and stays in ./uploaded "
+                    f"to be retried: {stats.summary()}"
                 )
+            else:
+                source = filepath
+                destination = os.path.join("./processed", new_filename)
                 try:
-                    response = ollama.embeddings(
-                        model="nomic-embed-text", prompt=text["contents"]
-                    )
-
-                    embedding = response["embedding"]
-                    random_id = str(uuid.uuid4())
-
-                    collection.add(
-                        ids=[random_id],
-                        embeddings=[embedding],
-                        documents=[text["contents"]],
-                        metadatas=[
-                            {
-                                "unique_id": random_id,
-                                "source": file.title,
-                                "authors": file.authors,
-                                "publisher": file.publisher,
-                                "date_published": file.date_published,
-                                "page": text["page_number"],
-                            }
-                        ],
-                    )
+                    shutil.move(source, destination)
+                    self.query_one(
+                        Name
+                    ).status = f"{self.title} scanning complete! {stats.summary()}"
                 except Exception as e:
                     print("Error: ", e)
+                    continue
 
-            source = filepath
-            destination = os.path.join("./processed", new_filename)
-            try:
-                shutil.move(source, destination)
-                self.query_one(Name).status = f"{self.title} scanning complete!"
-                time.sleep(3)
-                self.title = ""
-                self.authors = ""
-                self.publisher = ""
-                self.date_published = ""
-            except Exception as e:
-                print("Error: ", e)
+            time.sleep(3)
+            self.title = ""
+            self.authors = ""
+            self.publisher = ""
+            self.date_published = ""
 
     @on(Input.Changed, "#title")
     async def title_changed(self, message: Input.Changed) -> None:
@@ -241,19 +279,24 @@ class VectorSearch(Screen):
         with VerticalScroll(id="results-container"):
             yield Markdown(id="results")
 
+    def on_mount(self) -> None:
+        from scheduler import QueryScheduler
+
+        self.scheduler = QueryScheduler(
+            self.query_documents, self.show_results, prefetch=self.prefetch
+        )
+
     async def on_input_changed(self, message: Input.Changed) -> None:
         """A coroutine to handle a text changed message."""
         if message.value:
-            self.run_worker(self.lookup_word(message.value), thread=True)
+            self.scheduler.submit(message.value)
         else:
             # Clear the existing results
+            self.scheduler.cancel()
             await self.query_one("#results", Markdown).update("")
 
-    @work(exclusive=True)
-    async def lookup_word(self, prompt: str) -> None:
-        """Looks up a source"""
-        results = await self.query_documents(prompt)
-
+    def show_results(self, prompt: str, results) -> None:
+        """Shows the results of a finished search"""
         if not results:
             results = [
                 {
@@ -275,41 +318,32 @@ class VectorSearch(Screen):
 
         return "\n".join(lines)
 
-    async def query_documents(self, prompt: str):
+    async def prefetch(self, prompt: str):
         """
-        Tool to get data from chronmadb and inject it into the history
+        Embeds a likely prompt ahead of time, without its filters.
         """
-        _collection = _client.create_collection("library")
+        from embeddings import aembed_query, embedder_for
+        from filters import parse_query
 
-        try:
-            # generate an embedding for the prompt and retrieve the most relevant doc
-            response = ollama.embeddings(prompt=prompt, model="nomic-embed-text")
+        collection = get_client().create_collection("library")
+        return await aembed_query(parse_query(prompt)[0], embedder_for(collection))
 
-            results = _collection.query(
-                query_embeddings=[response["embedding"]],
-                n_results=10,
-            )
+    async def query_documents(self, prompt: str):
+        """
+        Tool to get data from chronmadb and inject it into the history.
+        Filters typed into the prompt, like `author:Smith`, narrow the
+        search down to the matching documents.
+        """
+        from filters import parse_query
+        from search import aquery_documents
 
-            data = results["documents"][0]
-            metadata = results["metadatas"][0]
-
-            data_list = []
-
-            for i, x in enumerate(data):
-                data_list.append(
-                    {
-                        "unique_id": metadata[i]["unique_id"],
-                        "source": metadata[i]["source"],
-                        "authors": metadata[i]["authors"],
-                        "date_published": metadata[i]["date_published"],
-                        "publisher": metadata[i]["publisher"],
-                        "page": metadata[i]["page"],
-                        "citation": f"{metadata[i]["authors"]}({metadata[i]["date_published"]}) {metadata[i]["source"]}. Pgs. {metadata[i]["page"]}",
-                        "contents": data[i],
-                    }
-                )
+        _collection = get_client().create_collection("library")
+        prompt, filters = parse_query(prompt)
 
-            return data_list
+        try:
+            return await aquery_documents(
+                _collection, prompt or " ".join(filters.values()), filters=filters
+            )
 
         except Exception as e:
             print(e)
@@ -332,6 +366,8 @@ class VectorSearchApp(App):
 
     def on_mount(self) -> None:
         self.switch_mode("settings")
+        # a failed warm-up is retried by the first search, not fatal
+        self.run_worker(warm_up, thread=True, exit_on_error=False)
 
 
 def main():
@@ -351,5 +387,58 @@ def main():
     app.run()
 
 
+def ingest(argv=None):
+    """
+    Headless ingestion of a folder of PDFs, for bulk loads that nobody
+    has to sit in front of. Metadata comes from sidecar files or a
+    manifest instead of the Processing screen.
+    """
+    import batch_ingest
+
+    failures = batch_ingest.run(batch_ingest.parse_args(argv))
+    sys.exit(1 if failures else 0)
+
+
+def serve():
+    """
+    Runs the HTTP search and ingestion service.
+    """
+    import service
+
+    service.serve(
+        address=os.environ.get("SERVICE_ADDRESS", "127.0.0.1"),
+        port=int(os.environ.get("SERVICE_PORT", "8080")),
+        workers=int(os.environ.get("SERVICE_WORKERS", "1")),
+    )
+
+
+def tune(argv=None):
+    """
+    Measures recall@k and query latency of the vector index, optionally
+    comparing the index profiles on a copy of the collection.
+    """
+    import tuning
+
+    tuning.run(tuning.parse_args(argv))
+
+
+def bench_startup(argv=None):
+    """
+    Measures how long the app takes to import and to draw its first frame.
+    """
+    import startup_benchmark
+
+    startup_benchmark.run(startup_benchmark.parse_args(argv))
+
+
 if __name__ == "__main__":
-    main()
+    if sys.argv[1:2] == ["ingest"]:
+        ingest(sys.argv[2:])
+    elif sys.argv[1:2] == ["serve"]:
+        serve()
+    elif sys.argv[1:2] == ["tune"]:
+        tune(sys.argv[2:])
+    elif sys.argv[1:2] == ["bench-startup"]:
+        bench_startup(sys.argv[2:])
+    else:
+        main()
@@ -0,0 +1,145 @@
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+PAGE_CACHE_PATH = os.path.join("db", "pages.sqlite3")
+# the cache is trimmed back to this many bytes of compressed text, set
+# VECTOR_SEARCH_PAGE_CACHE_MB=0 to turn it off
+PAGE_CACHE_BYTES = int(os.environ.get("VECTOR_SEARCH_PAGE_CACHE_MB", "512")) << 20
+# bump when a change to the extraction code makes cached pages stale
+PAGE_CACHE_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    file_hash TEXT NOT NULL,
+    page_number INTEGER NOT NULL,
+    settings TEXT NOT NULL,
+    contents BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    used REAL NOT NULL,
+    PRIMARY KEY (file_hash, settings, page_number)
+);
+CREATE INDEX IF NOT EXISTS pages_used ON pages (used);
+"""
+
+
+class PageCache:
+    """
+    Text extracted from PDF pages, kept on disk in SQLite and keyed by the
+    hash of the file, the page number and the extraction settings, so a
+    byte-identical file is never rendered or OCR'd twice with the same
+    settings, whatever its name. The text is stored zlib-compressed and
+    the least recently used pages are evicted once the cache grows past
+    `max_bytes`.
+    """
+
+    def __init__(self, path=PAGE_CACHE_PATH, max_bytes=PAGE_CACHE_BYTES):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(SCHEMA)
+        (self._size,) = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM pages"
+        ).fetchone()
+
+    @staticmethod
+    def _settings(settings):
+        return f"v{PAGE_CACHE_VERSION} {settings}"
+
+    def pages(self, file_hash, settings, page_numbers=None):
+        """
+        Returns the cached text of the file's pages extracted with these
+        settings, keyed by page number, optionally only the given pages.
+        """
+        with self._lock, self._conn:
+            rows = self._conn.execute(
+                "SELECT page_number, contents FROM pages "
+                "WHERE file_hash = ? AND settings = ?",
+                (file_hash, self._settings(settings)),
+            ).fetchall()
+            if page_numbers is not None:
+                wanted = set(page_numbers)
+                rows = [row for row in rows if row[0] in wanted]
+            self._conn.executemany(
+                "UPDATE pages SET used = ? "
+                "WHERE file_hash = ? AND settings = ? AND page_number = ?",
+                [
+                    (time.time(), file_hash, self._settings(settings), page_number)
+                    for page_number, _ in rows
+                ],
+            )
+        return {
+            page_number: zlib.decompress(contents).decode("utf-8")
+            for page_number, contents in rows
+        }
+
+    def put(self, file_hash, settings, page_number, text):
+        contents = zlib.compress(text.encode("utf-8"))
+        with self._lock, self._conn:
+            old = self._conn.execute(
+                "SELECT size FROM pages "
+                "WHERE file_hash = ? AND settings = ? AND page_number = ?",
+                (file_hash, self._settings(settings), page_number),
+            ).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    file_hash,
+                    page_number,
+                    self._settings(settings),
+                    contents,
+                    len(contents),
+                    time.time(),
+                ),
+            )
+            self._size += len(contents) - (old[0] if old else 0)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # another process may have written to the file as well
+        (self._size,) = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM pages"
+        ).fetchone()
+        target = self.max_bytes * 0.9
+        for rowid, size in self._conn.execute(
+            "SELECT rowid, size FROM pages ORDER BY used"
+        ).fetchall():
+            if self._size <= target:
+                break
+            self._conn.execute("DELETE FROM pages WHERE rowid = ?", (rowid,))
+            self._size -= size
+
+    def size(self):
+        with self._lock:
+            return self._size
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM pages")
+            self._size = 0
+
+    def close(self):
+        self._conn.close()
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def page_cache(path=None):
+    """
+    Returns the shared PageCache, opened on first use, or None when the
+    cache is turned off.
+    """
+    if PAGE_CACHE_BYTES <= 0:
+        return None
+    path = path or PAGE_CACHE_PATH
+    with _caches_lock:
+        if path not in _caches:
+            _caches[path] = PageCache(path)
+        return _caches[path]
@@ -0,0 +1,145 @@
+import queue
+import threading
+
+QUEUE_SIZE = 8
+
+_DONE = object()
+
+
+class PipelineAborted(Exception):
+    """Raised inside a stage when another stage has already failed."""
+
+
+class Stage:
+    def __init__(self, name, func, workers, flush, queue_size):
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.flush = flush
+        self.inbox = queue.Queue(maxsize=queue_size)
+        self.processed = 0
+        self._running = workers
+        self._lock = threading.Lock()
+
+
+class Pipeline:
+    """
+    Runs items from a source iterable through a chain of stages, each on
+    its own threads and connected by bounded queues. A stage only blocks
+    when the queue in front of the next stage is full, so a slow stage
+    holds back the ones before it instead of letting work pile up in
+    memory, while every stage keeps working on whatever it has.
+
+    A stage is a function taking one item and returning an iterable of
+    items for the next stage (or None). Stages can run several workers;
+    a single-worker stage can also have a `flush` function, called once
+    its input is exhausted, for anything it was holding back.
+    """
+
+    def __init__(self, queue_size=QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.stages = []
+        self._abort = threading.Event()
+        self._errors = []
+
+    def add_stage(self, name, func, workers=1, flush=None):
+        if flush is not None and workers != 1:
+            raise ValueError("only single-worker stages can be flushed")
+        self.stages.append(Stage(name, func, workers, flush, self.queue_size))
+        return self
+
+    def depths(self):
+        """
+        Returns how many items are waiting in front of each stage.
+        """
+        return {stage.name: stage.inbox.qsize() for stage in self.stages}
+
+    def run(self, source):
+        """
+        Feeds the source through every stage and waits for them to
+        finish. The first exception raised by any stage is re-raised
+        here once all threads have stopped.
+        """
+        threads = [threading.Thread(target=self._feed, args=(source,), daemon=True)]
+        for index, stage in enumerate(self.stages):
+            for _ in range(stage.workers):
+                threads.append(
+                    threading.Thread(
+                        target=self._work, args=(index, stage), daemon=True
+                    )
+                )
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if self._errors:
+            raise self._errors[0]
+
+    def _put(self, stage, item):
+        while True:
+            try:
+                stage.inbox.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                if self._abort.is_set():
+                    raise PipelineAborted()
+
+    def _send(self, index, items):
+        if index + 1 < len(self.stages) and items is not None:
+            for item in items:
+                self._put(self.stages[index + 1], item)
+
+    def _finish(self, index):
+        if index + 1 < len(self.stages):
+            next_stage = self.stages[index + 1]
+            for _ in range(next_stage.workers):
+                self._put(next_stage, _DONE)
+
+    def _fail(self, error):
+        if not isinstance(error, PipelineAborted):
+            self._errors.append(error)
+        self._abort.set()
+
+    def _feed(self, source):
+        try:
+            for item in source:
+                if self._abort.is_set():
+                    raise PipelineAborted()
+                self._put(self.stages[0], item)
+            self._finish(-1)
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            # lets a generator source clean up, such as cancelling its OCR
+            close = getattr(source, "close", None)
+            if close is not None:
+                close()
+
+    def _work(self, index, stage):
+        try:
+            while True:
+                try:
+                    item = stage.inbox.get(timeout=0.1)
+                except queue.Empty:
+                    if self._abort.is_set():
+                        raise PipelineAborted()
+                    continue
+
+                if item is _DONE:
+                    break
+                self._send(index, stage.func(item))
+                with stage._lock:
+                    stage.processed += 1
+
+            with stage._lock:
+                stage._running -= 1
+                last = stage._running == 0
+
+            if last:
+                if stage.flush is not None:
+                    self._send(index, stage.flush())
+                self._finish(index)
+        except BaseException as e:
+            self._fail(e)
@@ -0,0 +1,92 @@
+import asyncio
+from collections import deque
+
+from caching import normalize_query
+
+SEARCH_DEBOUNCE = 0.3
+PREFETCH_DELAY = 1.0
+PREFETCH_LIMIT = 3
+HISTORY_SIZE = 200
+
+
+class QueryScheduler:
+    """
+    Schedules as-you-type searches. A prompt is only searched once the
+    user has stopped typing for `debounce` seconds, and submitting a new
+    prompt cancels the pending or in-flight search for the old one, so
+    abandoned keystrokes never reach the embedder or the database.
+
+    When `prefetch` is given, it is called for up to `prefetch_limit`
+    earlier queries that continue the current prompt once the user has
+    been idle for `prefetch_delay` seconds, so they are warm if the user
+    finishes typing one of them.
+    """
+
+    def __init__(
+        self,
+        search,
+        on_results,
+        debounce=SEARCH_DEBOUNCE,
+        prefetch=None,
+        prefetch_delay=PREFETCH_DELAY,
+        prefetch_limit=PREFETCH_LIMIT,
+    ):
+        self.search = search
+        self.on_results = on_results
+        self.debounce = debounce
+        self.prefetch = prefetch
+        self.prefetch_delay = prefetch_delay
+        self.prefetch_limit = prefetch_limit
+        self.history = deque(maxlen=HISTORY_SIZE)
+        self._task = None
+        self._prefetch_task = None
+
+    def submit(self, prompt):
+        """
+        Schedules a search for the prompt, replacing any earlier one.
+        """
+        self.cancel()
+        self._task = asyncio.get_running_loop().create_task(self._run(prompt))
+
+    def cancel(self):
+        """
+        Cancels the pending search and any prefetching.
+        """
+        for task in (self._task, self._prefetch_task):
+            if task is not None and not task.done():
+                task.cancel()
+        self._task = None
+        self._prefetch_task = None
+
+    def continuations(self, prompt):
+        """
+        Returns earlier queries that start with the prompt, most recent first.
+        """
+        prefix = normalize_query(prompt)
+        candidates = []
+        for query in reversed(self.history):
+            if query != prefix and query.startswith(prefix) and query not in candidates:
+                candidates.append(query)
+                if len(candidates) == self.prefetch_limit:
+                    break
+        return candidates
+
+    async def _run(self, prompt):
+        await asyncio.sleep(self.debounce)
+        results = await self.search(prompt)
+
+        self.history.append(normalize_query(prompt))
+        self.on_results(prompt, results)
+
+        if self.prefetch is not None:
+            self._prefetch_task = asyncio.get_running_loop().create_task(
+                self._prefetch(prompt)
+            )
+
+    async def _prefetch(self, prompt):
+        await asyncio.sleep(self.prefetch_delay)
+        for candidate in self.continuations(prompt):
+            try:
+                await self.prefetch(candidate)
+            except Exception as e:
+                print(f"Prefetch of '{candidate}' failed: {e}")
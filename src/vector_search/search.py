@@ -0,0 +1,245 @@
+import asyncio
+import json
+
+from caching import ResultCache, collection_versions
+from embeddings import embed_query, embed_queries, aembed_query, embedder_for
+from filters import metadata_index
+from keyword_index import is_lexical, keyword_index
+
+N_RESULTS = 10
+
+# metadata fields that can be used to narrow down a search; the document
+# fields are the same on every chunk of a document and are pushed down
+DOCUMENT_FIELDS = ("source", "authors", "publisher", "date_published")
+FILTER_FIELDS = DOCUMENT_FIELDS + ("keywords",)
+
+# constant of reciprocal-rank fusion, damping the weight of the top ranks
+RRF_K = 60
+
+RESULT_FIELDS = ("ids", "distances", "documents", "metadatas")
+
+result_cache = ResultCache()
+
+
+def resolve_filters(collection, filters):
+    """
+    Matches the filters against the collection's metadata index. Returns
+    the `where` clause to push down to the collection and the ids of the
+    matching documents, both None for an unfiltered search. An empty list
+    of documents means nothing matches and there is nothing to search.
+    """
+    index = metadata_index(collection, FILTER_FIELDS)
+    document_ids = index.match(filters)
+    if not document_ids:
+        return None, document_ids
+    where = index.where(
+        document_ids,
+        [field for field in DOCUMENT_FIELDS if (filters or {}).get(field)],
+    )
+    return where, document_ids
+
+
+def prepare_search(collection, prompts, n_results, filters):
+    """
+    Resolves the filters and looks every prompt up in the keyword index,
+    which takes no embedding. Returns the `where` clause, the matching
+    documents and the keyword hits of every prompt.
+    """
+    where, document_ids = resolve_filters(collection, filters)
+    if document_ids == []:
+        return where, document_ids, [[] for _ in prompts]
+    index = keyword_index(collection)
+    hits = [index.search(prompt, n_results, document_ids) for prompt in prompts]
+    return where, document_ids, hits
+
+
+def fetch_chunks(collection, ids):
+    """
+    Returns the chunks with the given ids, in that order, shaped like the
+    result of a single Chroma query.
+    """
+    stored = collection.get(ids=ids, include=["documents", "metadatas"]) if ids else {}
+    found = dict(
+        zip(
+            stored.get("ids", []),
+            zip(stored.get("documents", []), stored.get("metadatas", [])),
+        )
+    )
+    ids = [uid for uid in ids if uid in found]
+    return {
+        "ids": [ids],
+        "documents": [[found[uid][0] for uid in ids]],
+        "metadatas": [[found[uid][1] for uid in ids]],
+    }
+
+
+def fuse(collection, results, keyword_hits, n_results, query_index=0):
+    """
+    Merges the vector results of one query with its keyword hits by
+    reciprocal-rank fusion, so a chunk ranked well by either search ends
+    up near the top. Returns a single query result.
+    """
+    rankings = (results["ids"][query_index], [uid for uid, _ in keyword_hits])
+    scores = {}
+    for ranking in rankings:
+        for rank, uid in enumerate(ranking):
+            scores[uid] = scores.get(uid, 0.0) + 1.0 / (RRF_K + rank + 1)
+    ranked = sorted(scores, key=scores.get, reverse=True)[:n_results]
+
+    known = dict(
+        zip(
+            results["ids"][query_index],
+            zip(results["documents"][query_index], results["metadatas"][query_index]),
+        )
+    )
+    missing = fetch_chunks(collection, [uid for uid in ranked if uid not in known])
+    known.update(
+        zip(missing["ids"][0], zip(missing["documents"][0], missing["metadatas"][0]))
+    )
+    ranked = [uid for uid in ranked if uid in known]
+    return {
+        "ids": [ranked],
+        "documents": [[known[uid][0] for uid in ranked]],
+        "metadatas": [[known[uid][1] for uid in ranked]],
+    }
+
+
+def cache_key(collection, n_results, where):
+    return (collection.name, n_results, json.dumps(where, sort_keys=True))
+
+
+def cached_query(collection, embeddings, n_results, where):
+    """
+    Runs a vector query for several embeddings, serving every embedding
+    close enough to a recent query at the current collection version from
+    the result cache and querying the collection once for the rest.
+    Returns one single query result per embedding.
+    """
+    key = cache_key(collection, n_results, where)
+    version = collection_versions().get(collection.name)
+    answers = [result_cache.get(embedding, key, version) for embedding in embeddings]
+    missing = [i for i, answer in enumerate(answers) if answer is None]
+
+    if missing:
+        results = collection.query(
+            query_embeddings=[embeddings[i] for i in missing],
+            n_results=n_results,
+            where=where,
+        )
+        for j, i in enumerate(missing):
+            answers[i] = {
+                field: [results[field][j]]
+                for field in RESULT_FIELDS
+                if results.get(field) is not None
+            }
+            result_cache.put(embeddings[i], key, version, answers[i])
+
+    return answers
+
+
+def query_documents(collection, prompt, n_results=N_RESULTS, filters=None):
+    """
+    Returns the best chunks in the collection for the prompt as a list of
+    result dicts, ready to be rendered or serialized. Prompts that look
+    like a keyword lookup, such as a part number or a surname, are
+    answered from the keyword index without embedding them; others are
+    embedded and their closest chunks fused with the keyword hits.
+    """
+    where, document_ids, (hits,) = prepare_search(
+        collection, [prompt], n_results, filters
+    )
+    if document_ids == []:
+        return []
+    if hits and is_lexical(prompt):
+        return format_results(fetch_chunks(collection, [uid for uid, _ in hits]))
+
+    # generate an embedding for the prompt and retrieve the most relevant doc
+    embedding = embed_query(prompt, embedder_for(collection))
+
+    (results,) = cached_query(collection, [embedding], n_results, where)
+
+    return format_results(fuse(collection, results, hits, n_results))
+
+
+def query_many(collection, prompts, n_results=N_RESULTS, filters=None):
+    """
+    Runs several searches at once: the prompts that need it are embedded
+    together and sent to the collection as a single query. Returns one
+    result list per prompt.
+    """
+    where, document_ids, hits = prepare_search(collection, prompts, n_results, filters)
+    if document_ids == []:
+        return [[] for _ in prompts]
+
+    answers = [None] * len(prompts)
+    semantic = []
+    for i, prompt in enumerate(prompts):
+        if hits[i] and is_lexical(prompt):
+            answers[i] = fetch_chunks(collection, [uid for uid, _ in hits[i]])
+        else:
+            semantic.append(i)
+
+    if semantic:
+        results = cached_query(
+            collection,
+            embed_queries([prompts[i] for i in semantic], embedder_for(collection)),
+            n_results,
+            where,
+        )
+        for j, i in enumerate(semantic):
+            answers[i] = fuse(collection, results[j], hits[i], n_results)
+
+    return [format_results(answer) for answer in answers]
+
+
+async def aquery_documents(collection, prompt, n_results=N_RESULTS, filters=None):
+    """
+    Async version of query_documents(). The embedding request can be
+    cancelled mid-flight, and a cancelled search never reaches the
+    collection.
+    """
+    where, document_ids, (hits,) = await asyncio.to_thread(
+        prepare_search, collection, [prompt], n_results, filters
+    )
+    if document_ids == []:
+        return []
+    if hits and is_lexical(prompt):
+        return format_results(
+            await asyncio.to_thread(fetch_chunks, collection, [uid for uid, _ in hits])
+        )
+
+    embedding = await aembed_query(prompt, embedder_for(collection))
+
+    (results,) = await asyncio.to_thread(
+        cached_query, collection, [embedding], n_results, where
+    )
+
+    return format_results(
+        await asyncio.to_thread(fuse, collection, results, hits, n_results)
+    )
+
+
+def format_results(results, query_index=0):
+    """
+    Flattens one query of a Chroma result set into result dicts.
+    """
+    data = results["documents"][query_index]
+    metadata = results["metadatas"][query_index]
+
+    data_list = []
+
+    for i, x in enumerate(data):
+        data_list.append(
+            {
+                "unique_id": metadata[i]["unique_id"],
+                "source": metadata[i]["source"],
+                "authors": metadata[i]["authors"],
+                "date_published": metadata[i]["date_published"],
+                "publisher": metadata[i]["publisher"],
+                "page": metadata[i]["page"],
+                "citation": f"{metadata[i]["authors"]}({metadata[i]["date_published"]}) {metadata[i]["source"]}. Pgs. {metadata[i]["page"]}",
+                "contents": data[i],
+            }
+        )
+
+    return data_list
@@ -0,0 +1,255 @@
+import asyncio
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import FastAPI, HTTPException
+from pydantic import BaseModel, Field
+
+from checkpoint import IngestJournal
+from chroma_db import ChromaClient, CHROMA_HOST
+from file_reader import FileReader, ocr_workers_for
+from ingestion import ingest_document
+from search import query_documents, query_many, N_RESULTS
+
+COLLECTION_NAME = "library"
+SEARCH_CONCURRENCY = int(os.environ.get("SEARCH_CONCURRENCY", "8"))
+INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", "2"))
+# only files under this directory can be ingested
+UPLOAD_DIR = os.environ.get("VECTOR_SEARCH_UPLOAD_DIR", "uploaded")
+MAX_RESULTS = 100
+MAX_BATCH_QUERIES = 64
+# finished jobs are forgotten after this many seconds, or sooner once
+# there are more than MAX_FINISHED_JOBS of them
+JOB_TTL = 3600
+MAX_FINISHED_JOBS = 1000
+
+app = FastAPI(title="Vector Search")
+
+_search_slots = asyncio.Semaphore(SEARCH_CONCURRENCY)
+_ingest_pool = ThreadPoolExecutor(max_workers=INGEST_WORKERS)
+_jobs = {}
+_jobs_lock = threading.Lock()
+_state = {}
+_state_lock = threading.Lock()
+
+
+def get_collection():
+    """
+    The Chroma client is opened on first use and shared by every request
+    handled by this process.
+    """
+    with _state_lock:
+        if "collection" not in _state:
+            _state["client"] = ChromaClient()
+            _state["collection"] = _state["client"].create_collection(COLLECTION_NAME)
+        return _state["collection"]
+
+
+def get_journal():
+    with _state_lock:
+        if "journal" not in _state:
+            _state["journal"] = IngestJournal()
+        return _state["journal"]
+
+
+def upload_path(filepath):
+    """
+    Resolves a path given by a client against the upload directory,
+    refusing anything that ends up outside of it, such as "../" or a
+    symlink out.
+    """
+    root = os.path.realpath(UPLOAD_DIR)
+    path = os.path.realpath(os.path.join(root, filepath))
+    if os.path.commonpath([root, path]) != root:
+        raise HTTPException(403, f"Not in the upload directory: {filepath}")
+    return path
+
+
+class Filters(BaseModel):
+    source: str | None = None
+    authors: str | None = None
+    publisher: str | None = None
+    date_published: str | None = None
+    keywords: str | None = None
+
+
+class BatchSearch(BaseModel):
+    queries: list[str] = Field(min_length=1, max_length=MAX_BATCH_QUERIES)
+    n_results: int = Field(N_RESULTS, ge=1, le=MAX_RESULTS)
+    filters: Filters = Filters()
+
+
+class IngestRequest(BaseModel):
+    filepath: str
+    title: str = ""
+    authors: str = ""
+    publisher: str = ""
+    date_published: str = ""
+    # ingests the file as a revision of the document with the same key
+    document_key: str | None = None
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+
+@app.get("/search")
+async def search(
+    q: str,
+    n_results: int = N_RESULTS,
+    source: str | None = None,
+    authors: str | None = None,
+    publisher: str | None = None,
+    date_published: str | None = None,
+    keywords: str | None = None,
+):
+    """
+    Searches the library for a single query.
+    """
+    if not 1 <= n_results <= MAX_RESULTS:
+        raise HTTPException(422, f"n_results must be between 1 and {MAX_RESULTS}")
+    filters = Filters(
+        source=source,
+        authors=authors,
+        publisher=publisher,
+        date_published=date_published,
+        keywords=keywords,
+    )
+
+    async with _search_slots:
+        results = await asyncio.to_thread(
+            query_documents,
+            get_collection(),
+            q,
+            n_results,
+            filters.model_dump(),
+        )
+    return {"query": q, "results": results}
+
+
+@app.post("/search")
+async def search_batch(request: BatchSearch):
+    """
+    Searches the library for several queries at once, embedding them in
+    one request and querying the collection once.
+    """
+    async with _search_slots:
+        results = await asyncio.to_thread(
+            query_many,
+            get_collection(),
+            request.queries,
+            request.n_results,
+            request.filters.model_dump(),
+        )
+    return {
+        "results": [
+            {"query": query, "results": hits}
+            for query, hits in zip(request.queries, results)
+        ]
+    }
+
+
+def _run_ingest(job_id, request):
+    with _jobs_lock:
+        _jobs[job_id]["status"] = "running"
+
+    def report_progress(stats):
+        with _jobs_lock:
+            _jobs[job_id]["progress"] = stats.summary()
+
+    try:
+        # the concurrent jobs share the CPUs between their OCR processes
+        file = FileReader(
+            request.filepath,
+            ocr_workers=ocr_workers_for(INGEST_WORKERS),
+            document_key=request.document_key,
+        )
+        file.input_metadata(
+            request.title or os.path.splitext(os.path.basename(request.filepath))[0],
+            request.authors,
+            request.publisher,
+            request.date_published,
+        )
+        stats = ingest_document(
+            file, get_collection(), get_journal(), progress=report_progress
+        )
+        result = {
+            "status": "failed" if stats.failed else "done",
+            "progress": stats.summary(),
+        }
+    except Exception as e:
+        result = {"status": "failed", "error": str(e)}
+
+    with _jobs_lock:
+        _jobs[job_id].update(result, finished=time.time())
+        _evict_jobs()
+
+
+def _evict_jobs():
+    # called with _jobs_lock held
+    finished = [job for job in _jobs.values() if "finished" in job]
+    finished.sort(key=lambda job: job["finished"])
+    expired = time.time() - JOB_TTL
+    for index, job in enumerate(finished):
+        if job["finished"] < expired or index < len(finished) - MAX_FINISHED_JOBS:
+            del _jobs[job["job_id"]]
+
+
+@app.post("/ingest", status_code=202)
+async def submit_ingest(request: IngestRequest):
+    """
+    Queues a PDF from the server's upload directory for ingestion and
+    returns the id of the job. Relative paths are taken from the upload
+    directory.
+    """
+    filepath = upload_path(request.filepath)
+    if not os.path.isfile(filepath):
+        raise HTTPException(404, f"No such file: {request.filepath}")
+    request = request.model_copy(update={"filepath": filepath})
+
+    job_id = uuid.uuid4().hex
+    with _jobs_lock:
+        _jobs[job_id] = {
+            "job_id": job_id,
+            "filepath": request.filepath,
+            "status": "queued",
+        }
+        job = dict(_jobs[job_id])
+    _ingest_pool.submit(_run_ingest, job_id, request)
+    return job
+
+
+@app.get("/ingest/{job_id}")
+async def ingest_status(job_id: str):
+    with _jobs_lock:
+        if job_id not in _jobs:
+            raise HTTPException(404, f"No such job: {job_id}")
+        return dict(_jobs[job_id])
+
+
+def serve(address="127.0.0.1", port=8080, workers=1):
+    """
+    Serves the app with granian. Every worker process opens the store on
+    its own, so more than one worker needs a shared Chroma server
+    (CHROMA_HOST) rather than the local db/ folder.
+    """
+    from granian import Granian
+    from granian.constants import Interfaces
+
+    if workers > 1 and not CHROMA_HOST:
+        raise SystemExit(
+            "Running more than one worker needs a Chroma server, "
+            "start one with 'chroma run --path db/' and set CHROMA_HOST"
+        )
+
+    Granian(
+        "service:app",
+        address=address,
+        port=port,
+        interface=Interfaces.ASGI,
+        workers=workers,
+    ).serve()
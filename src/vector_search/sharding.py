@@ -0,0 +1,457 @@
+import hashlib
+import heapq
+import json
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+SHARD_WORKERS = 8
+DATE_SPAN = 10
+# paged reads remembered, so the next page starts where the last one ended
+MAX_CURSORS = 64
+
+_YEAR = re.compile(r"\b(\d{4})\b")
+
+
+class ShardStrategy:
+    """
+    Decides which shard a chunk belongs to from one metadata field.
+    """
+
+    prefix = None
+    field = None
+
+    def key(self, value):
+        raise NotImplementedError
+
+    def key_of(self, metadata):
+        return self.key((metadata or {}).get(self.field))
+
+
+class SourceShards(ShardStrategy):
+    """One shard per source document title."""
+
+    prefix = "src"
+    field = "source"
+
+    def key(self, value):
+        return hashlib.sha1(str(value or "").encode("utf-8")).hexdigest()[:12]
+
+
+class DateShards(ShardStrategy):
+    """One shard per `span` years of publication date."""
+
+    prefix = "date"
+    field = "date_published"
+
+    def __init__(self, span=DATE_SPAN):
+        self.span = span
+
+    def key(self, value):
+        year = _YEAR.search(str(value or ""))
+        if year is None:
+            return "undated"
+        return str(int(year.group(1)) // self.span * self.span)
+
+
+class HashShards(ShardStrategy):
+    """A fixed number of shards, chosen by hashing the document id."""
+
+    prefix = "hash"
+    field = "document_id"
+
+    def __init__(self, count):
+        self.count = count
+
+    def key(self, value):
+        digest = hashlib.sha1(str(value or "").encode("utf-8")).digest()
+        return str(int.from_bytes(digest[:8], "big") % self.count)
+
+
+def shard_strategy(spec):
+    """
+    Parses a sharding spec: "source", "date" or "date:<years>", or
+    "hash:<shards>". Returns None for an empty spec.
+    """
+    if not spec:
+        return None
+    kind, _, arg = spec.partition(":")
+    if kind == "source":
+        return SourceShards()
+    if kind == "date":
+        return DateShards(int(arg) if arg else DATE_SPAN)
+    if kind == "hash" and arg:
+        return HashShards(int(arg))
+    raise ValueError(
+        f"Unknown sharding '{spec}', expected source, date[:years] or hash:<shards>"
+    )
+
+
+def _constrained_values(where, field):
+    """
+    Returns the values `field` is limited to by a where clause, or None
+    when the clause doesn't pin it down.
+    """
+    if not where:
+        return None
+    if "$and" in where:
+        for clause in where["$and"]:
+            values = _constrained_values(clause, field)
+            if values is not None:
+                return values
+        return None
+    if "$or" in where:
+        values = [_constrained_values(clause, field) for clause in where["$or"]]
+        if any(v is None for v in values):
+            return None
+        return [value for v in values for value in v]
+    condition = where.get(field)
+    if condition is None:
+        return None
+    if not isinstance(condition, dict):
+        return [condition]
+    if "$eq" in condition:
+        return [condition["$eq"]]
+    if "$in" in condition:
+        return list(condition["$in"])
+    return None
+
+
+class ShardedCollection:
+    """
+    Spreads one logical collection over several collections, the shards,
+    with the same interface as a single collection. Every chunk lives in
+    the shard its metadata maps to, so a metadata update that changes the
+    shard key moves the chunk. Queries run on all shards in parallel and
+    their results are merged into one global top-k; filters on the shard
+    key skip the shards that can't match. Retiring a shard is dropping
+    a collection.
+
+    Paged reads (`get` with a limit or offset) walk the shards in order
+    and remember where each page ended, so reading page after page
+    touches only the shards the page falls in.
+
+    `open_shard(name, metadata)` returns (creating if needed) a shard,
+    `list_shards()` returns the names of the existing collections and
+    `drop_shard(name)` deletes one.
+    """
+
+    def __init__(
+        self,
+        name,
+        strategy,
+        open_shard,
+        list_shards,
+        drop_shard,
+        metadata=None,
+        workers=SHARD_WORKERS,
+    ):
+        self.name = name
+        self.strategy = strategy
+        self.metadata = metadata or {}
+        self._open_shard = open_shard
+        self._list_shards = list_shards
+        self._drop_shard = drop_shard
+        self._shards = {}
+        self._cursors = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+
+    def shard_name(self, key):
+        return f"{self.name}-{self.strategy.prefix}-{key}"
+
+    def _shard(self, key):
+        name = self.shard_name(key)
+        with self._lock:
+            if name not in self._shards:
+                self._shards[name] = self._open_shard(
+                    name, {**self.metadata, "shard_of": self.name, "shard_key": key}
+                )
+            return self._shards[name]
+
+    def shards(self, where=None):
+        """
+        Returns the existing shards a where clause could match.
+        """
+        prefix = self.shard_name("")
+        names = [name for name in self._list_shards() if name.startswith(prefix)]
+        values = _constrained_values(where, self.strategy.field)
+        if values is not None:
+            wanted = {self.shard_name(self.strategy.key(v)) for v in values}
+            names = [name for name in names if name in wanted]
+        return [self._shard(name[len(prefix) :]) for name in sorted(names)]
+
+    def retire(self, key):
+        """
+        Drops the shard for a shard key, such as a decade of a date sharded
+        library, with everything in it.
+        """
+        name = self.shard_name(key)
+        with self._lock:
+            self._shards.pop(name, None)
+        self._drop_shard(name)
+
+    def _fan_out(self, func, shards):
+        return list(self._executor.map(func, shards))
+
+    def count(self):
+        return sum(self._fan_out(lambda shard: shard.count(), self.shards()))
+
+    def _group(self, metadatas):
+        groups = {}
+        for i, metadata in enumerate(metadatas):
+            groups.setdefault(self.strategy.key_of(metadata), []).append(i)
+        return groups
+
+    def add(self, ids, embeddings, documents=None, metadatas=None):
+        metadatas = metadatas or [{} for _ in ids]
+        for key, rows in self._group(metadatas).items():
+            self._shard(key).add(
+                ids=[ids[i] for i in rows],
+                embeddings=[embeddings[i] for i in rows],
+                documents=[documents[i] for i in rows] if documents else None,
+                metadatas=[metadatas[i] for i in rows],
+            )
+
+    def _locate(self, ids, include=(), shards=None):
+        """
+        Finds the shard of every stored id, as {id: (shard, record)},
+        looking in `shards` or in all of them.
+        """
+        found = {}
+
+        def lookup(shard):
+            return shard, shard.get(ids=ids, include=list(include))
+
+        if shards is None:
+            shards = self.shards()
+        for shard, stored in self._fan_out(lookup, shards):
+            for i, uid in enumerate(stored["ids"]):
+                found[uid] = (
+                    shard,
+                    {field: stored[field][i] for field in include if field in stored},
+                )
+        return found
+
+    def _locate_pinned(self, ids, metadatas):
+        """
+        Same as _locate(), but ids whose new metadata has the shard key
+        are looked for in the shard it names first, which is where they
+        are unless the update moves them.
+        """
+        pinned = {}
+        for uid, metadata in zip(ids, metadatas or []):
+            if metadata and self.strategy.field in metadata:
+                key = self.strategy.key_of(metadata)
+                pinned.setdefault(self.shard_name(key), (key, []))[1].append(uid)
+
+        located = {}
+        existing = set(self._list_shards()) if pinned else set()
+        for name, (key, pinned_ids) in pinned.items():
+            if name in existing:
+                located.update(
+                    self._locate(pinned_ids, ["metadatas"], [self._shard(key)])
+                )
+        rest = [uid for uid in ids if uid not in located]
+        if rest:
+            located.update(self._locate(rest, include=["metadatas"]))
+        return located
+
+    def update(self, ids, embeddings=None, metadatas=None, documents=None):
+        located = self._locate_pinned(ids, metadatas)
+        in_place, moves = {}, []
+        for i, uid in enumerate(ids):
+            if uid not in located:
+                continue
+            shard, stored = located[uid]
+            merged = {
+                **(stored.get("metadatas") or {}),
+                **(metadatas[i] if metadatas else {}),
+            }
+            if self.shard_name(self.strategy.key_of(merged)) == shard.name:
+                in_place.setdefault(shard.name, (shard, []))[1].append(i)
+            else:
+                moves.append((i, shard, merged))
+
+        for shard, rows in in_place.values():
+            shard.update(
+                ids=[ids[i] for i in rows],
+                embeddings=[embeddings[i] for i in rows] if embeddings else None,
+                metadatas=[metadatas[i] for i in rows] if metadatas else None,
+                documents=[documents[i] for i in rows] if documents else None,
+            )
+
+        if moves:
+            self._move(ids, moves, embeddings, documents)
+
+    def _move(self, ids, moves, embeddings, documents):
+        """
+        Moves chunks whose new metadata belongs to another shard.
+        """
+        by_shard = {}
+        for i, shard, merged in moves:
+            by_shard.setdefault(shard.name, (shard, []))[1].append((i, merged))
+
+        for shard, rows in by_shard.values():
+            moved_ids = [ids[i] for i, _ in rows]
+            stored = shard.get(ids=moved_ids, include=["embeddings", "documents"])
+            position = {uid: j for j, uid in enumerate(stored["ids"])}
+            self.add(
+                ids=moved_ids,
+                embeddings=[
+                    (
+                        embeddings[i]
+                        if embeddings
+                        else stored["embeddings"][position[ids[i]]]
+                    )
+                    for i, _ in rows
+                ],
+                documents=[
+                    documents[i] if documents else stored["documents"][position[ids[i]]]
+                    for i, _ in rows
+                ],
+                metadatas=[merged for _, merged in rows],
+            )
+            shard.delete(ids=moved_ids)
+
+    def upsert(self, ids, embeddings, documents=None, metadatas=None):
+        located = self._locate_pinned(ids, metadatas)
+        existing = [i for i, uid in enumerate(ids) if uid in located]
+        new = [i for i, uid in enumerate(ids) if uid not in located]
+        for rows, write in ((existing, self.update), (new, self.add)):
+            if rows:
+                write(
+                    ids=[ids[i] for i in rows],
+                    embeddings=[embeddings[i] for i in rows],
+                    documents=[documents[i] for i in rows] if documents else None,
+                    metadatas=[metadatas[i] for i in rows] if metadatas else None,
+                )
+
+    def delete(self, ids=None, where=None):
+        self._fan_out(
+            lambda shard: shard.delete(ids=ids, where=where), self.shards(where)
+        )
+
+    def get(
+        self,
+        ids=None,
+        where=None,
+        limit=None,
+        offset=None,
+        include=("metadatas", "documents"),
+    ):
+        def get(shard, **kwargs):
+            if where:
+                kwargs["where"] = where
+            return shard.get(ids=ids, include=list(include), **kwargs)
+
+        result = {"ids": []}
+        for field in include:
+            result[field] = []
+
+        def extend(stored):
+            for field, values in stored.items():
+                if field in result and values is not None:
+                    result[field].extend(values)
+
+        shards = self.shards(where)
+        if limit is None and not offset:
+            for stored in self._fan_out(get, shards):
+                extend(stored)
+            return result
+
+        # rows are in shard order, so a page is read shard by shard from
+        # the cursor the previous page left, or found by counting rows
+        offset = offset or 0
+        key = (
+            json.dumps(where, sort_keys=True),
+            None if ids is None else tuple(ids),
+            tuple(include),
+        )
+        with self._lock:
+            cursor = self._cursors.pop((key, offset), None)
+        names = [shard.name for shard in shards]
+        if cursor is not None and cursor[0] in names:
+            index, skip = names.index(cursor[0]), cursor[1]
+        else:
+            index, skip = self._seek(shards, ids, where, offset)
+
+        while index < len(shards):
+            kwargs = {"offset": skip}
+            if limit is not None:
+                kwargs["limit"] = limit - len(result["ids"])
+            stored = get(shards[index], **kwargs)
+            extend(stored)
+            skip += len(stored["ids"])
+            if limit is not None and len(result["ids"]) >= limit:
+                break
+            index, skip = index + 1, 0
+
+        if index < len(shards):
+            with self._lock:
+                self._cursors[(key, offset + len(result["ids"]))] = (names[index], skip)
+                while len(self._cursors) > MAX_CURSORS:
+                    self._cursors.pop(next(iter(self._cursors)))
+        return result
+
+    def _seek(self, shards, ids, where, offset):
+        """
+        Returns the index of the shard holding the row at `offset` and
+        the position of the row within that shard.
+        """
+        for index, shard in enumerate(shards):
+            if ids is None and not where:
+                size = shard.count()
+            else:
+                kwargs = {"where": where} if where else {}
+                size = len(shard.get(ids=ids, include=[], **kwargs)["ids"])
+            if offset < size:
+                return index, offset
+            offset -= size
+        return len(shards), 0
+
+    def query(
+        self,
+        query_embeddings,
+        n_results=10,
+        where=None,
+        include=("metadatas", "documents", "distances"),
+    ):
+        include = [field for field in include if field != "distances"]
+
+        def query(shard):
+            return shard.query(
+                query_embeddings=query_embeddings,
+                n_results=n_results,
+                where=where,
+                include=[*include, "distances"],
+            )
+
+        answers = self._fan_out(query, self.shards(where))
+
+        result = {"ids": [], "distances": []}
+        for field in include:
+            result[field] = []
+
+        for q in range(len(query_embeddings)):
+            # every shard returns its hits sorted, so a k-way heap merge
+            # only has to look at the first n_results of them
+            candidates = list(
+                islice(
+                    heapq.merge(
+                        *(
+                            [(d, s, j) for j, d in enumerate(answer["distances"][q])]
+                            for s, answer in enumerate(answers)
+                        )
+                    ),
+                    n_results,
+                )
+            )
+            result["ids"].append([answers[s]["ids"][q][j] for _, s, j in candidates])
+            result["distances"].append([distance for distance, _, _ in candidates])
+            for field in include:
+                result[field].append(
+                    [answers[s][field][q][j] for _, s, j in candidates]
+                )
+        return result
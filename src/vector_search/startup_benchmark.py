@@ -0,0 +1,108 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+STARTUP_RUNS = 5
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# modules that take long to import and must not be loaded by main.py
+# itself, only by the screen or command that needs them
+HEAVY_MODULES = (
+    "chromadb",
+    "ollama",
+    "httpx",
+    "numpy",
+    "cv2",
+    "pytesseract",
+    "pdf2image",
+    "PIL",
+    "pypdf",
+    "matplotlib",
+    "spacy",
+    "pytextrank",
+    "fastapi",
+    "granian",
+)
+
+_IMPORT_PROBE = """
+import json, sys, time
+sys.path.insert(0, {app_dir!r})
+started = time.perf_counter()
+import main
+elapsed = time.perf_counter() - started
+loaded = [name for name in {heavy!r} if name in sys.modules]
+print(json.dumps({{"seconds": elapsed, "loaded": loaded}}))
+"""
+
+_FIRST_FRAME_PROBE = """
+import asyncio, json, sys, time
+started = time.perf_counter()
+sys.path.insert(0, {app_dir!r})
+import main
+main.warm_up = lambda: None
+
+async def first_frame():
+    async with main.VectorSearchApp().run_test() as pilot:
+        await pilot.pause()
+        return time.perf_counter() - started
+
+print(json.dumps({{"seconds": asyncio.run(first_frame())}}))
+"""
+
+
+def _probe(code):
+    """
+    Runs a probe in a fresh interpreter, so nothing is imported already.
+    """
+    completed = subprocess.run(
+        [sys.executable, "-c", code.format(app_dir=APP_DIR, heavy=HEAVY_MODULES)],
+        capture_output=True,
+        text=True,
+        cwd=APP_DIR,
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip())
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def measure_import(runs=STARTUP_RUNS):
+    """
+    Median time to import main.py, and the heavy modules it loaded.
+    """
+    probes = [_probe(_IMPORT_PROBE) for _ in range(runs)]
+    return {
+        "seconds": statistics.median(p["seconds"] for p in probes),
+        "loaded": probes[-1]["loaded"],
+    }
+
+
+def measure_first_frame(runs=STARTUP_RUNS):
+    """
+    Median time from starting the interpreter to the first frame of the
+    app, including the import of main.py.
+    """
+    return statistics.median(
+        _probe(_FIRST_FRAME_PROBE)["seconds"] for _ in range(runs)
+    )
+
+
+def run(args):
+    imported = measure_import(args.runs)
+    first_frame = measure_first_frame(args.runs)
+    print(f"import main.py: {imported['seconds'] * 1000:.0f} ms")
+    print(f"first frame:    {first_frame * 1000:.0f} ms")
+    if imported["loaded"]:
+        print(f"heavy modules loaded at import: {', '.join(imported['loaded'])}")
+    return {**imported, "first_frame": first_frame}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="bench-startup",
+        description="Measure how long the app takes to import and draw its first frame.",
+    )
+    parser.add_argument("--runs", type=int, default=STARTUP_RUNS)
+    return parser.parse_args(argv)
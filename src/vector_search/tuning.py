@@ -0,0 +1,203 @@
+import argparse
+import tempfile
+import time
+
+import chromadb
+import numpy as np
+
+from chroma_db import ChromaClient, INDEX_PROFILES, index_settings
+from embeddings import embed_texts, embedder_for
+from search import N_RESULTS
+
+SAMPLE_QUERIES = 200
+WARMUP_QUERIES = 10
+PAGE_SIZE = 5000
+QUERY_BLOCK = 32
+
+
+def load_vectors(collection, page_size=PAGE_SIZE):
+    """
+    Reads every id and embedding of a collection, a page at a time.
+    """
+    ids, vectors = [], []
+    offset = 0
+    while True:
+        page = collection.get(include=["embeddings"], limit=page_size, offset=offset)
+        if not page["ids"]:
+            break
+        ids.extend(page["ids"])
+        vectors.extend(page["embeddings"])
+        offset += len(page["ids"])
+    return ids, np.asarray(vectors, dtype=np.float32)
+
+
+def exact_neighbours(vectors, queries, k, space="l2"):
+    """
+    Brute-force top `k` rows of `vectors` for every query, in the same
+    distance space as the index, used as the ground truth for recall.
+    """
+    if space == "cosine":
+        vectors = vectors / np.maximum(
+            np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12
+        )
+        queries = queries / np.maximum(
+            np.linalg.norm(queries, axis=1, keepdims=True), 1e-12
+        )
+
+    k = min(k, len(vectors))
+    neighbours = []
+    for start in range(0, len(queries), QUERY_BLOCK):
+        block = queries[start : start + QUERY_BLOCK]
+        if space == "l2":
+            # |v|^2 - 2 q.v, the |q|^2 term doesn't change the order
+            scores = 2 * block @ vectors.T - (vectors * vectors).sum(axis=1)
+        else:
+            scores = block @ vectors.T
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        order = np.take_along_axis(scores, top, axis=1).argsort(axis=1)[:, ::-1]
+        neighbours.extend(np.take_along_axis(top, order, axis=1))
+    return np.asarray(neighbours)
+
+
+def evaluate(collection, queries, truth, k=N_RESULTS):
+    """
+    Sends the queries one at a time, as the search screen does, and
+    returns recall@k against `truth` (the expected ids of every query)
+    with the p50 and p99 latency in milliseconds.
+    """
+    for query in queries[:WARMUP_QUERIES]:
+        collection.query(query_embeddings=[query.tolist()], n_results=k)
+
+    latencies, hits = [], 0
+    for query, expected in zip(queries, truth):
+        started = time.perf_counter()
+        results = collection.query(query_embeddings=[query.tolist()], n_results=k)
+        latencies.append((time.perf_counter() - started) * 1000)
+        hits += len(set(results["ids"][0]) & set(expected))
+
+    return {
+        "recall": hits / max(1, sum(len(expected) for expected in truth)),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+    }
+
+
+def build_copy(client, name, ids, vectors, profile, page_size=PAGE_SIZE):
+    """
+    Loads the vectors into a new collection with the given index profile.
+    """
+    try:
+        client.delete_collection(name)
+    except Exception:
+        pass
+    collection = client.create_collection(name, metadata=index_settings(profile))
+    for start in range(0, len(ids), page_size):
+        collection.add(
+            ids=ids[start : start + page_size],
+            embeddings=vectors[start : start + page_size].tolist(),
+        )
+    return collection
+
+
+def sample_queries(ids, vectors, count, seed=0):
+    """
+    Picks `count` stored vectors to use as queries. Returns the indexes
+    of the queries and of the vectors left over.
+    """
+    order = np.random.default_rng(seed).permutation(len(ids))
+    return order[:count], order[count:]
+
+
+def run(args):
+    """
+    Measures recall@k and latency of the collection as it is, or of a
+    copy of its vectors indexed with each of `args.profiles`.
+    """
+    collection = ChromaClient().create_collection(args.collection)
+    ids, vectors = load_vectors(collection)
+    if not ids:
+        print(f"Collection '{args.collection}' is empty")
+        return []
+
+    if args.queries:
+        with open(args.queries, encoding="utf-8") as f:
+            texts = [line.strip() for line in f if line.strip()]
+        queries = np.asarray(
+            embed_texts(texts, embedder_for(collection)), dtype=np.float32
+        )
+        corpus = np.arange(len(ids))
+    else:
+        picked, corpus = sample_queries(ids, vectors, min(args.samples, len(ids) // 2))
+        queries = vectors[picked]
+
+    if args.profiles:
+        # held-out queries against fresh copies, one per profile
+        corpus_ids = [ids[i] for i in corpus]
+        # an in-memory Chroma index rejects the hnsw:batch_size and
+        # hnsw:sync_threshold keys of the profiles, so the copies are
+        # persisted to a scratch folder, removed once they are measured
+        scratch = tempfile.TemporaryDirectory(
+            prefix="tuning-", ignore_cleanup_errors=True
+        )
+        client = chromadb.PersistentClient(scratch.name)
+        targets = [
+            (
+                profile,
+                build_copy(
+                    client, f"tuning-{profile}", corpus_ids, vectors[corpus], profile
+                ),
+            )
+            for profile in args.profiles
+        ]
+        spaces = {
+            profile: INDEX_PROFILES[profile]["hnsw:space"] for profile in args.profiles
+        }
+    else:
+        scratch = None
+        corpus = np.arange(len(ids))
+        corpus_ids = ids
+        profile = (collection.metadata or {}).get("index_profile", "default")
+        targets = [(profile, collection)]
+        spaces = {profile: (collection.metadata or {}).get("hnsw:space", "l2")}
+
+    try:
+        report = []
+        print(f"{len(queries)} queries against {len(corpus_ids)} vectors, k={args.k}")
+        print(f"{'profile':<14}{'recall@k':>10}{'p50 ms':>10}{'p99 ms':>10}")
+        for profile, target in targets:
+            truth = [
+                [corpus_ids[i] for i in row]
+                for row in exact_neighbours(
+                    vectors[corpus], queries, args.k, spaces[profile]
+                )
+            ]
+            result = {"profile": profile, **evaluate(target, queries, truth, args.k)}
+            report.append(result)
+            print(
+                f"{profile:<14}{result['recall']:>10.3f}"
+                f"{result['p50_ms']:>10.2f}{result['p99_ms']:>10.2f}"
+            )
+        return report
+    finally:
+        if scratch is not None:
+            scratch.cleanup()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="tune",
+        description="Measure recall@k and query latency of the vector index.",
+    )
+    parser.add_argument("--collection", default="library")
+    parser.add_argument("-k", type=int, default=N_RESULTS)
+    parser.add_argument(
+        "--profiles",
+        nargs="*",
+        choices=list(INDEX_PROFILES),
+        help="compare copies of the collection indexed with these profiles",
+    )
+    parser.add_argument(
+        "--queries", help="text file with one query per line, instead of sampling"
+    )
+    parser.add_argument("--samples", type=int, default=SAMPLE_QUERIES)
+    return parser.parse_args(argv)
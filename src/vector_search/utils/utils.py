@@ -1,25 +1,63 @@
 import os
 import time
+import hashlib
 import datetime
 import fnmatch
 import json
+import math
 
 # import csv
 import re
 
 import cv2
-import matplotlib.pyplot as plt
-from pdf2image import convert_from_path
+import numpy as np
+from pdf2image import convert_from_path, pdfinfo_from_path
 import pytesseract
 import pypdf
-import spacy
-from spacy.matcher import Matcher
-from langchain.text_splitter import CharacterTextSplitter
-import pytextrank
 from PIL import Image
 
+# matplotlib is only needed for debugging and spacy for keyword extraction,
+# they are imported by the functions that use them
+
+from chunking import split_text
+from extraction import shared_nlp
+
 Image.MAX_IMAGE_PIXELS = None
 
+# "region" runs one Tesseract call per detected region, "page" binarizes
+# the page once and recognizes every region in a single Tesseract pass
+OCR_ENGINES = ("region", "page")
+PAGE_OCR_CONFIG = "--psm 3"
+REGION_OCR_CONFIG = "--psm 6"
+# words Tesseract is less sure of than this are dropped by the page engine
+PAGE_OCR_MIN_CONFIDENCE = 30
+
+# "full" finds the text regions on the page as rendered, "scaled" on a
+# copy no wider than LAYOUT_WIDTH pixels, which is several times faster
+LAYOUT_MODES = ("full", "scaled")
+LAYOUT_MODE = "full"
+LAYOUT_WIDTH = 800
+# set VECTOR_SEARCH_LAYOUT_DEBUG=1 to see the regions found on every page
+LAYOUT_DEBUG = os.environ.get("VECTOR_SEARCH_LAYOUT_DEBUG", "") not in ("", "0")
+
+# below these, a page's text layer is treated as missing or garbled
+MIN_TEXT_CHARS = 25
+MIN_TEXT_QUALITY = 0.85
+
+# spaCy Matcher patterns, one JSON file per pattern
+MATCHPATH = "match_patterns"
+
+
+def file_hash(filepath, block_size=1 << 20):
+    """
+    Returns the sha256 hex digest of the file's contents.
+    """
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as file:
+        for block in iter(lambda: file.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
 
 def replace_with_underscores(input_string):
     cleaned_string = re.sub(r"[\s,]+", "_", input_string)
@@ -41,11 +79,75 @@ def pdf_to_images(filepath, title):
         i += 1
 
 
+def is_usable_text(text, min_chars=MIN_TEXT_CHARS, min_quality=MIN_TEXT_QUALITY):
+    """
+    Decides whether text pulled from a page's text layer can be used
+    as-is. Pages with almost no text, unmapped glyphs such as "(cid:12)"
+    or mostly non-word characters need to be OCR'd instead.
+    """
+    if not text:
+        return False
+
+    stripped = "".join(text.split())
+    if len(stripped) < min_chars:
+        return False
+
+    if "(cid:" in text or stripped.count("\ufffd") > len(stripped) * 0.01:
+        return False
+
+    wordlike = sum(1 for c in stripped if c.isalnum() or c in ".,;:!?'\"()-%$&/")
+    return wordlike / len(stripped) >= min_quality
+
+
+def count_pdf_pages(filepath):
+    """
+    Returns the number of pages in the PDF without rendering any of them.
+    """
+    return pdfinfo_from_path(filepath)["Pages"]
+
+
+def page_to_array(page):
+    """
+    Converts a rendered PIL page into the BGR numpy array
+    layout that OpenCV expects.
+    """
+    return cv2.cvtColor(np.asarray(page.convert("RGB")), cv2.COLOR_RGB2BGR)
+
+
+def iter_pdf_pages(filepath, dpi=150, window=1, first_page=1, last_page=None):
+    """
+    Renders the PDF `window` pages at a time and yields
+    (page_number, image) pairs, with each image as an in-memory
+    numpy array. Only one window of pages is held in memory at once
+    and nothing is written to disk.
+    """
+    if last_page is None:
+        last_page = count_pdf_pages(filepath)
+
+    for start in range(first_page, last_page + 1, window):
+        end = min(start + window - 1, last_page)
+        pages = convert_from_path(filepath, dpi, first_page=start, last_page=end)
+        for offset, page in enumerate(pages):
+            yield start + offset, page_to_array(page)
+
+
+def load_image(image):
+    """
+    Accepts either a path to an image on disk or an image
+    already in memory and returns it as a numpy array.
+    """
+    if isinstance(image, np.ndarray):
+        return image
+    return cv2.imread(image)
+
+
 def show_image(image):
     """
     This administrative function can show any of the images
     during transformation or plotting areas to scrape
     """
+    import matplotlib.pyplot as plt
+
     plt.figure(figsize=(10, 10))
     plt.imshow(image)
     plt.show()
@@ -53,60 +155,102 @@ def show_image(image):
     plt.close("all")
 
 
-def mark_region(image_path):
+def detect_regions(gray, blur_size, block_size, dilate_size, iterations):
     """
-    This section performs a transform against the image provided,
-    and then it finds each section of text to be scanned and
-    returns the coordinates.
+    Finds the bounding boxes of the blocks of text on a grayscale page,
+    as (x, y, w, h) in the coordinates of that image.
     """
-    im = cv2.imread(image_path)
-
-    gray = cv2.cvtColor(im, cv2.COLOR_BGR2GRAY)
-    blur = cv2.GaussianBlur(gray, (9, 9), 0)
+    blur = cv2.GaussianBlur(gray, (blur_size, blur_size), 0)
     thresh = cv2.adaptiveThreshold(
-        blur, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, 11, 30
+        blur, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, block_size, 30
     )
 
     # Dilate to combine adjacent text contours
-    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (9, 9))
-    dilate = cv2.dilate(thresh, kernel, iterations=6)
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (dilate_size, dilate_size))
+    dilate = cv2.dilate(thresh, kernel, iterations=iterations)
 
-    # Find contours, highlight text areas, and extract ROIs
     cnts = cv2.findContours(dilate, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
     cnts = cnts[0] if len(cnts) == 2 else cnts[1]
+    return [cv2.boundingRect(c) for c in cnts]
+
+
+def _odd(size):
+    return max(3, int(round(size)) | 1)
+
+
+def mark_region(image, layout=LAYOUT_MODE, debug=LAYOUT_DEBUG):
+    """
+    This section performs a transform against the image provided,
+    and then it finds each section of text to be scanned and
+    returns the coordinates. The image can be a path or an array.
 
-    line_items_coordinates = []
-    count = 0
-    # Select sections of text
-    for c in cnts:
-        count += 1
-        area = cv2.contourArea(c)
-        x, y, w, h = cv2.boundingRect(c)
+    With the "scaled" layout the regions are found on a copy of the
+    page no wider than LAYOUT_WIDTH, with the filters shrunk to match,
+    and the boxes are mapped back to the full page for the OCR step.
+    Every box reaches the right edge of the page. The boxes are only
+    drawn onto a copy of the page, and shown, when `debug` is set.
+    """
+    im = load_image(image)
+    height, width = im.shape[:2]
+    gray = cv2.cvtColor(im, cv2.COLOR_BGR2GRAY)
 
-        image = cv2.rectangle(
-            im, (x, y), (2800, y + h), color=(255, 0, 255), thickness=3
+    if layout == "full":
+        boxes = detect_regions(gray, 9, 11, 9, 6)
+    elif layout == "scaled":
+        scale = min(1.0, LAYOUT_WIDTH / width)
+        small = cv2.resize(
+            gray,
+            (max(1, round(width * scale)), max(1, round(height * scale))),
+            interpolation=cv2.INTER_AREA,
         )
-        image = cv2.putText(
-            im,
-            f"{count}",
-            (x + 5, y + 10),
-            cv2.FONT_HERSHEY_SIMPLEX,
-            0.9,
-            (36, 255, 12),
-            2,
+        # the threshold keeps its 11 pixel neighbourhood, which has to be
+        # wider than a stroke; six dilations with a 9x9 kernel grow a
+        # region by 24 pixels on every side, as one 49x49 dilation does
+        boxes = [
+            (
+                int(x / scale),
+                int(y / scale),
+                math.ceil(w / scale),
+                math.ceil(h / scale),
+            )
+            for x, y, w, h in detect_regions(
+                small, _odd(9 * scale), 11, _odd(49 * scale), 1
+            )
+        ]
+    else:
+        raise ValueError(
+            f"Unknown layout mode '{layout}', expected one of {LAYOUT_MODES}"
         )
-        line_items_coordinates.append([(x, y), (2800, y + h)])
+
+    line_items_coordinates = [
+        [(x, y), (width, min(height, y + h))] for x, y, w, h in boxes
+    ]
+
+    if debug:
+        annotated = im.copy()
+        for count, (start, end) in enumerate(line_items_coordinates, 1):
+            cv2.rectangle(annotated, start, end, color=(255, 0, 255), thickness=3)
+            cv2.putText(
+                annotated,
+                f"{count}",
+                (start[0] + 5, start[1] + 10),
+                cv2.FONT_HERSHEY_SIMPLEX,
+                0.9,
+                (36, 255, 12),
+                2,
+            )
+        show_image(annotated)
 
     return line_items_coordinates
 
 
-def get_text(coordinates, filepath):
+def get_text(coordinates, image):
     """
     Recieves coordinates grabbed with OpenCV, and then scrapes text off
     of these areas using tesseract
     """
     # load the original image
-    image = cv2.imread(filepath)
+    image = load_image(image)
 
     # get co-ordinates to crop the image
     c = coordinates
@@ -118,27 +262,89 @@ def get_text(coordinates, filepath):
     ret, thresh1 = cv2.threshold(img, 120, 255, cv2.THRESH_BINARY)
 
     # pytesseract image to string to get results
-    text = str(pytesseract.image_to_string(thresh1, config="--psm 6"))
+    text = str(pytesseract.image_to_string(thresh1, config=REGION_OCR_CONFIG))
 
     return text
 
 
-def scrape_page(page_number, title):
+def get_page_text(coordinates, image):
+    """
+    Recognizes every region of the page with one Tesseract pass. The
+    page is binarized once, everything outside the regions is blanked,
+    and the words returned by image_to_data are assigned back to the
+    region that contains their centre. Returns one string per region,
+    in the same order as the coordinates. Words recognized with less
+    confidence than PAGE_OCR_MIN_CONFIDENCE are left out.
+    """
+    image = load_image(image)
+
+    # convert the page to black and white once for better OCR
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    ret, thresh = cv2.threshold(gray, 120, 255, cv2.THRESH_BINARY)
+
+    # only keep the pixels that fall inside a marked region
+    page = np.full_like(thresh, 255)
+    for c in coordinates:
+        page[c[0][1] : c[1][1], c[0][0] : c[1][0]] = thresh[
+            c[0][1] : c[1][1], c[0][0] : c[1][0]
+        ]
+
+    data = pytesseract.image_to_data(
+        page, config=PAGE_OCR_CONFIG, output_type=pytesseract.Output.DICT
+    )
+
+    # region index -> line key -> words, in tesseract's reading order
+    region_lines = [{} for _ in coordinates]
+    for i, word in enumerate(data["text"]):
+        if not word.strip() or float(data["conf"][i]) < PAGE_OCR_MIN_CONFIDENCE:
+            continue
+
+        x = data["left"][i] + data["width"][i] // 2
+        y = data["top"][i] + data["height"][i] // 2
+        for index, c in enumerate(coordinates):
+            if c[0][0] <= x < c[1][0] and c[0][1] <= y < c[1][1]:
+                key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+                region_lines[index].setdefault(key, []).append(word)
+                break
+
+    return [
+        "\n".join(" ".join(words) for words in lines.values()) + "\n"
+        for lines in region_lines
+    ]
+
+
+def scrape_page(page_number, title, engine="region", layout=LAYOUT_MODE):
     """
     Once images are generated from the pdf, this function first uses
     OpenCV to mark the regions for scraping ( mark_region() )
     and then uses tesseract to get each section of text ( get_text() )
     """
     filepath = os.path.abspath(f"image_store/{title}_page_{page_number}.jpg")
-    print(f"Scanning Page {page_number}\n")
-    coordinates = mark_region(filepath)
+    return scrape_image(cv2.imread(filepath), page_number, engine, layout)
 
-    page_text = []
-    count = 0
-    for coordinate_set in coordinates:
-        count += 1
-        section_text = get_text(coordinate_set, filepath)
-        page_text.append(section_text)
+
+def scrape_image(image, page_number, engine="region", layout=LAYOUT_MODE):
+    """
+    Same as scrape_page(), but works on a page image that is already
+    in memory, such as the ones yielded by iter_pdf_pages(). The engine
+    is one of OCR_ENGINES and the layout one of LAYOUT_MODES.
+    """
+    print(f"Scanning Page {page_number}\n")
+    coordinates = mark_region(image, layout)
+
+    if engine == "page":
+        page_text = get_page_text(coordinates, image)
+    elif engine == "region":
+        page_text = []
+        count = 0
+        for coordinate_set in coordinates:
+            count += 1
+            section_text = get_text(coordinate_set, image)
+            page_text.append(section_text)
+    else:
+        raise ValueError(
+            f"Unknown OCR engine '{engine}', expected one of {OCR_ENGINES}"
+        )
 
     page_text.reverse()
     page_text = "\n".join(page_text)
@@ -146,6 +352,19 @@ def scrape_page(page_number, title):
     return page_text
 
 
+def ocr_pdf_page(filepath, page_number, dpi=150, engine="region", layout=LAYOUT_MODE):
+    """
+    Renders and scrapes a single page of the PDF. This is the unit of
+    work handed to the OCR process pool, so only the filepath and page
+    number have to cross the process boundary.
+    """
+    for _, image in iter_pdf_pages(
+        filepath, dpi, first_page=page_number, last_page=page_number
+    ):
+        return scrape_image(image, page_number, engine, layout)
+    return ""
+
+
 def unstructured_scrape(filepath):
     """
     Main application, the function will scrape one entire document
@@ -206,7 +425,7 @@ def search_document(nlp, document, matcher):
         # for match_id, start, end in matches:
         #     print(f"Match ID: {match_id}, Matched Text: {doc[start:end].text}\n")
 
-    return matches
+    return doc, matches
 
 
 def create_timestamp():
@@ -220,7 +439,7 @@ def create_timestamp():
 
 
 def load_pattern(filename):
-    f = open(f"match_patterns/{filename}")
+    f = open(os.path.join(MATCHPATH, filename))
     pattern = json.load(f)
 
     return pattern
@@ -235,14 +454,8 @@ def add_matcher_pattern(matcher, pattern_name, pattern_config):
 
 
 def text_split(raw_text):
-    # We need to split the text using Character Text Split such that it sshould not increse token size
-    text_splitter = CharacterTextSplitter(
-        separator="\n",
-        chunk_size=800,
-        chunk_overlap=200,
-        length_function=len,
-    )
-    texts = text_splitter.split_text(raw_text)
+    # We need to split the text such that it should not increase token size
+    texts = split_text(raw_text, chunk_size=800, chunk_overlap=200)
     return texts
 
 
@@ -251,43 +464,28 @@ def remove_filetype(string, symbol):
 
 
 def get_text_matches(raw_text, title):
-    nlp = spacy.load("en_core_web_lg")
+    from spacy.matcher import Matcher
 
-    matcher = Matcher(nlp.vocab)
+    # the matcher adds its patterns to the vocabulary shared with the
+    # pipeline, so it is built and run while holding the pipeline
+    with shared_nlp() as nlp:
+        matcher = Matcher(nlp.vocab)
 
-    for pattern in os.listdir(MATCHPATH):
-        pattern_title = remove_filetype(pattern, ".")
-        print(
-            f"Constructing the following match pattern: title={pattern_title}, file={pattern}\n"
-        )
-        matcher = add_matcher_pattern(matcher, f"{pattern_title}", pattern)
+        for pattern in os.listdir(MATCHPATH):
+            pattern_title = remove_filetype(pattern, ".")
+            print(
+                f"Constructing the following match pattern: title={pattern_title}, file={pattern}\n"
+            )
+            matcher = add_matcher_pattern(matcher, f"{pattern_title}", pattern)
 
-    # TODO: fix the scraper to get proper nouns - current matches are noise and often just single characters
-    matches = search_document(nlp, raw_text, matcher)
+        # TODO: fix the scraper to get proper nouns - current matches are noise and often just single characters
+        doc, matches = search_document(nlp, raw_text, matcher)
 
     matched_words = []
 
     for match_id, start, end in matches:
-        matched_words.append(f"{raw_text[start:end]}")
-
-    ## Created Matches report (inactive)
-    # fieldnames = ["title", "contents"]
-
-    # with open(
-    #    f"reports/document_report_{create_timestamp()}.csv",
-    #    "w",
-    #    encoding="UTF8",
-    #    newline="",
-    # ) as f:
-    #    writer = csv.DictWriter(f, fieldnames=fieldnames)
-    #    writer.writeheader()
-    #    writer.writerows(matched_document_list)
-    # print(document_texts[0])
-
-    for doc in document_texts:
-        f = open(f"data/{doc['title']}.txt", "a")
-        f.write(doc["contents"])
-        f.close()
+        # the matches are token offsets into the parsed document
+        matched_words.append(doc[start:end].text)
 
     if len(matched_words) > 0:
         print(f"Found the following matches in {title}: {matched_words}\n")
@@ -298,10 +496,8 @@ def get_text_matches(raw_text, title):
 
 
 def get_keywords(text):
-    nlp = spacy.load("en_core_web_lg")
-
-    nlp.add_pipe("textrank")
-    doc = nlp(text)
+    with shared_nlp() as nlp:
+        doc = nlp(text)
 
     keywords = []
 
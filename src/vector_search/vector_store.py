@@ -0,0 +1,558 @@
+import json
+import os
+import sqlite3
+import threading
+from itertools import chain
+
+import numpy as np
+
+# rows scored per block, keeps the temporary float32 copy of the int8 codes small
+BLOCK_ROWS = 65536
+# candidates re-scored exactly per requested result when searching the int8 copy
+RESCORE_FACTOR = 8
+MIN_CANDIDATES = 64
+# rows looked up per SQLite statement, below its limit on bound variables
+SQL_BATCH = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rows (
+    row INTEGER PRIMARY KEY,
+    id TEXT NOT NULL,
+    document TEXT,
+    metadata TEXT NOT NULL,
+    alive INTEGER NOT NULL,
+    document_id TEXT
+);
+CREATE INDEX IF NOT EXISTS rows_id ON rows (id);
+CREATE TABLE IF NOT EXISTS info (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def quantize(vectors):
+    """
+    Quantizes normalized vectors to int8 with one scale per row.
+    """
+    scales = np.abs(vectors).max(axis=1, keepdims=True) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.round(vectors / scales).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def matches(metadata, where):
+    """
+    Evaluates a Chroma style `where` clause against one metadata dict.
+    Supports $and, $or, $eq, $ne, $in, $nin, $gt, $gte, $lt and $lte.
+    """
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(matches(metadata, clause) for clause in condition):
+                return False
+        elif key == "$or":
+            if not any(matches(metadata, clause) for clause in condition):
+                return False
+        else:
+            if not isinstance(condition, dict):
+                condition = {"$eq": condition}
+            value = metadata.get(key)
+            for op, operand in condition.items():
+                if not _compare(value, op, operand):
+                    return False
+    return True
+
+
+def _compare(value, op, operand):
+    if op == "$eq":
+        return value == operand
+    if op == "$ne":
+        return value != operand
+    if op == "$in":
+        return value in operand
+    if op == "$nin":
+        return value not in operand
+    if value is None:
+        return False
+    if op == "$gt":
+        return value > operand
+    if op == "$gte":
+        return value >= operand
+    if op == "$lt":
+        return value < operand
+    if op == "$lte":
+        return value <= operand
+    raise ValueError(f"Unsupported operator '{op}'")
+
+
+class NumpyCollection:
+    """
+    An in-process vector collection with the subset of the Chroma
+    collection interface this application uses (add, get, update,
+    delete, query and count), so it can stand in for Chroma.
+
+    Normalized embeddings are appended to a float32 matrix on disk and
+    memory-mapped, together with an int8 quantized copy. A query scans
+    the int8 copy with vectorized brute-force cosine similarity, then
+    re-scores the best candidates exactly against the float32 vectors.
+    Because the matrices are memory-mapped read-only, opening is instant
+    and worker processes share the same pages. Ids, documents and
+    metadata live in a SQLite file next to the matrices.
+
+    The document id of every row is kept in its own column and indexed
+    in memory, so filtering on documents never looks at the metadata.
+    The metadata of a row is only read and parsed when a result or a
+    filter on another field needs it.
+
+    Only one process should write to a collection; readers in other
+    processes pick up its changes on their next call.
+    """
+
+    def __init__(self, path, name, metadata=None, quantized=True):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.name = name
+        self.quantized = quantized
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(
+            os.path.join(path, "rows.sqlite3"), check_same_thread=False
+        )
+        self._db.executescript(SCHEMA)
+        self._migrate()
+
+        if metadata and self._info("metadata") is None:
+            self._set_info("metadata", json.dumps(metadata))
+        self.metadata = json.loads(self._info("metadata") or "{}")
+        self._load()
+
+    def _migrate(self):
+        # collections written before the document_id column existed
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(rows)")]
+        if "document_id" not in columns:
+            with self._db:
+                self._db.execute("ALTER TABLE rows ADD COLUMN document_id TEXT")
+                self._db.execute(
+                    "UPDATE rows SET document_id = "
+                    "json_extract(metadata, '$.document_id')"
+                )
+
+    def _info(self, key):
+        row = self._db.execute(
+            "SELECT value FROM info WHERE key = ?", (key,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def _set_info(self, key, value):
+        with self._db:
+            self._db.execute("INSERT OR REPLACE INTO info VALUES (?, ?)", (key, value))
+
+    def _data_version(self):
+        return self._db.execute("PRAGMA data_version").fetchone()[0]
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _map(self, name, dtype, rows, width):
+        if rows == 0 or width is None:
+            return np.empty((0, width or 0), dtype=dtype)
+        return np.memmap(self._file(name), dtype=dtype, mode="r", shape=(rows, width))
+
+    def _load(self):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, document_id, alive FROM rows ORDER BY row"
+            ).fetchall()
+            dimension = self._info("dimension")
+            self.dimension = int(dimension) if dimension else None
+
+            self._ids = [row[0] for row in rows]
+            self._document_ids = [row[1] for row in rows]
+            # parsed metadata by row, filled in as rows are needed
+            self._metadatas = {}
+            self._alive = np.array([row[2] for row in rows], dtype=bool)
+            self._rows = {uid: i for i, uid in enumerate(self._ids) if self._alive[i]}
+            self._index_documents()
+            self._remap()
+            self._version = self._data_version()
+
+    def _index_documents(self):
+        self._documents = {}
+        for row, document_id in enumerate(self._document_ids):
+            self._documents.setdefault(document_id, []).append(row)
+
+    def _load_metadatas(self, rows):
+        """
+        Returns the metadata of the rows, reading the ones not seen yet.
+        """
+        with self._lock:
+            missing = [int(row) for row in rows if int(row) not in self._metadatas]
+            for start in range(0, len(missing), SQL_BATCH):
+                batch = missing[start : start + SQL_BATCH]
+                for row, metadata in self._db.execute(
+                    f"SELECT row, metadata FROM rows WHERE row IN ({','.join('?' * len(batch))})",
+                    batch,
+                ):
+                    self._metadatas[row] = json.loads(metadata)
+            return [self._metadatas[int(row)] for row in rows]
+
+    def _remap(self):
+        rows = len(self._ids)
+        self._vectors = self._map("vectors.f32", np.float32, rows, self.dimension)
+        self._codes = self._map("vectors.i8", np.int8, rows, self.dimension)
+        self._scales = self._map("scales.f32", np.float32, rows, 1)
+
+    def _refresh(self):
+        # another process committed since we last loaded
+        if self._data_version() != self._version:
+            self._load()
+
+    def count(self):
+        with self._lock:
+            self._refresh()
+            return int(self._alive.sum())
+
+    def add(self, ids, embeddings, documents=None, metadatas=None):
+        """
+        Appends new rows. Ids that are already stored are left alone,
+        as Chroma does.
+        """
+        with self._lock:
+            self._refresh()
+            keep = [i for i, uid in enumerate(ids) if uid not in self._rows]
+            if not keep:
+                return
+            self._append(
+                [ids[i] for i in keep],
+                [embeddings[i] for i in keep],
+                [documents[i] for i in keep] if documents else [None] * len(keep),
+                [metadatas[i] for i in keep] if metadatas else [{}] * len(keep),
+            )
+
+    def _append(self, ids, embeddings, documents, metadatas):
+        vectors = normalize(embeddings)
+        if self.dimension is None:
+            self.dimension = vectors.shape[1]
+            self._set_info("dimension", str(self.dimension))
+        if vectors.shape[1] != self.dimension:
+            raise ValueError(
+                f"Embedding dimension {vectors.shape[1]} does not match "
+                f"collection dimension {self.dimension}"
+            )
+        codes, scales = quantize(vectors)
+
+        first = len(self._ids)
+        for name, data in (
+            ("vectors.f32", vectors),
+            ("vectors.i8", codes),
+            ("scales.f32", scales),
+        ):
+            with open(self._file(name), "ab") as f:
+                # drop anything left behind by a write that never committed
+                f.truncate(first * data.shape[1] * data.itemsize)
+                f.write(data.tobytes())
+
+        metadatas = [m or {} for m in metadatas]
+        with self._db:
+            self._db.executemany(
+                "INSERT INTO rows (row, id, document, metadata, alive, document_id) "
+                "VALUES (?, ?, ?, ?, 1, ?)",
+                [
+                    (
+                        first + i,
+                        uid,
+                        documents[i],
+                        json.dumps(metadatas[i]),
+                        metadatas[i].get("document_id"),
+                    )
+                    for i, uid in enumerate(ids)
+                ],
+            )
+
+        for i, uid in enumerate(ids):
+            self._rows[uid] = first + i
+            self._metadatas[first + i] = metadatas[i]
+            self._document_ids.append(metadatas[i].get("document_id"))
+            self._documents.setdefault(metadatas[i].get("document_id"), []).append(
+                first + i
+            )
+        self._ids.extend(ids)
+        self._alive = np.concatenate([self._alive, np.ones(len(ids), dtype=bool)])
+        self._remap()
+        self._version = self._data_version()
+
+    def update(self, ids, embeddings=None, metadatas=None, documents=None):
+        """
+        Updates stored rows. New metadata is merged into the old; rows
+        whose embedding changes are re-appended and the old row retired.
+        """
+        with self._lock:
+            self._refresh()
+            ids = [uid for uid in ids if uid in self._rows]
+            rows = [self._rows[uid] for uid in ids]
+            if not rows:
+                return
+
+            merged = [
+                {**stored, **(metadatas[i] if metadatas else {})}
+                for i, stored in enumerate(self._load_metadatas(rows))
+            ]
+            if documents is None:
+                documents = [
+                    self._db.execute(
+                        "SELECT document FROM rows WHERE row = ?", (row,)
+                    ).fetchone()[0]
+                    for row in rows
+                ]
+
+            if embeddings is not None:
+                self._retire(rows)
+                self._append(ids, embeddings, documents, merged)
+                return
+
+            with self._db:
+                self._db.executemany(
+                    "UPDATE rows SET metadata = ?, document = ?, document_id = ? "
+                    "WHERE row = ?",
+                    [
+                        (
+                            json.dumps(merged[i]),
+                            documents[i],
+                            merged[i].get("document_id"),
+                            row,
+                        )
+                        for i, row in enumerate(rows)
+                    ],
+                )
+            moved = False
+            for i, row in enumerate(rows):
+                self._metadatas[row] = merged[i]
+                if self._document_ids[row] != merged[i].get("document_id"):
+                    self._document_ids[row] = merged[i].get("document_id")
+                    moved = True
+            if moved:
+                self._index_documents()
+            self._version = self._data_version()
+
+    def upsert(self, ids, embeddings, documents=None, metadatas=None):
+        with self._lock:
+            self.delete(ids=ids)
+            self.add(ids, embeddings, documents, metadatas)
+
+    def _retire(self, rows):
+        with self._db:
+            self._db.executemany(
+                "UPDATE rows SET alive = 0 WHERE row = ?", [(row,) for row in rows]
+            )
+        for row in rows:
+            self._alive[row] = False
+            self._rows.pop(self._ids[row], None)
+
+    def delete(self, ids=None, where=None):
+        with self._lock:
+            self._refresh()
+            rows = self._select(ids, where)
+            if len(rows):
+                self._retire(rows.tolist())
+                self._version = self._data_version()
+
+    def _document_rows(self, condition):
+        """
+        The rows of the documents a condition on document_id allows, or
+        None when the condition isn't a plain lookup.
+        """
+        if not isinstance(condition, dict):
+            values = [condition]
+        elif set(condition) == {"$eq"}:
+            values = [condition["$eq"]]
+        elif set(condition) == {"$in"}:
+            values = condition["$in"]
+        else:
+            return None
+        return np.fromiter(
+            chain.from_iterable(self._documents.get(value, ()) for value in values),
+            dtype=np.int64,
+        )
+
+    def _narrow(self, where):
+        """
+        Splits a where clause into the rows its document_id conditions
+        allow (None if it has none) and the clause left for the metadata.
+        """
+        rows, rest = None, {}
+        for key, condition in where.items():
+            if key == "$and":
+                clauses = [self._narrow(clause) for clause in condition]
+                found = [found for found, _ in clauses if found is not None]
+                remaining = [clause for _, clause in clauses if clause]
+                if remaining:
+                    rest["$and"] = remaining
+            elif key == "document_id":
+                found = [self._document_rows(condition)]
+                if found[0] is None:
+                    found = []
+                    rest[key] = condition
+            else:
+                found = []
+                rest[key] = condition
+            for allowed in found:
+                rows = allowed if rows is None else np.intersect1d(rows, allowed)
+        return rows, rest
+
+    def _mask(self, where):
+        allowed = self._alive.copy()
+        if where:
+            rows, rest = self._narrow(where)
+            if rows is not None:
+                narrowed = np.zeros_like(allowed)
+                narrowed[rows] = True
+                allowed &= narrowed
+            if rest:
+                candidates = np.flatnonzero(allowed)
+                for row, metadata in zip(candidates, self._load_metadatas(candidates)):
+                    if not matches(metadata, rest):
+                        allowed[row] = False
+        return allowed
+
+    def _select(self, ids=None, where=None):
+        if ids is not None:
+            rows = np.array([self._rows[uid] for uid in ids if uid in self._rows])
+            rows = rows.astype(np.int64)
+            if where:
+                rows = rows[self._mask(where)[rows]]
+            return rows
+        return np.flatnonzero(self._mask(where))
+
+    def _result_fields(self, rows, include):
+        result = {}
+        if "metadatas" in include:
+            result["metadatas"] = self._load_metadatas(rows)
+        if "documents" in include and len(rows):
+            documents = dict(
+                self._db.execute(
+                    f"SELECT row, document FROM rows WHERE row IN ({','.join('?' * len(rows))})",
+                    [int(row) for row in rows],
+                ).fetchall()
+            )
+            result["documents"] = [documents.get(int(row)) for row in rows]
+        elif "documents" in include:
+            result["documents"] = []
+        if "embeddings" in include:
+            result["embeddings"] = [np.array(self._vectors[row]) for row in rows]
+        return result
+
+    def get(
+        self,
+        ids=None,
+        where=None,
+        limit=None,
+        offset=None,
+        include=("metadatas", "documents"),
+    ):
+        with self._lock:
+            self._refresh()
+            rows = self._select(ids, where)
+            rows = rows[offset or 0 :]
+            if limit is not None:
+                rows = rows[:limit]
+            return {
+                "ids": [self._ids[row] for row in rows],
+                **self._result_fields(rows, include),
+            }
+
+    def _scores(self, queries, matrix, scales=None):
+        """
+        Cosine similarity of every query against every row, block by block.
+        """
+        scores = np.empty((len(queries), len(matrix)), dtype=np.float32)
+        for start in range(0, len(matrix), BLOCK_ROWS):
+            block = np.asarray(matrix[start : start + BLOCK_ROWS], dtype=np.float32)
+            part = queries @ block.T
+            if scales is not None:
+                part *= scales[start : start + BLOCK_ROWS, 0]
+            scores[:, start : start + BLOCK_ROWS] = part
+        return scores
+
+    def query(
+        self,
+        query_embeddings,
+        n_results=10,
+        where=None,
+        include=("metadatas", "documents", "distances"),
+    ):
+        with self._lock:
+            self._refresh()
+            allowed = self._mask(where)
+            vectors, codes, scales = self._vectors, self._codes, self._scales
+
+        queries = normalize(query_embeddings)
+        available = int(allowed.sum())
+        k = min(n_results, available)
+        result = {"ids": [], "distances": []}
+        for field in ("metadatas", "documents", "embeddings"):
+            if field in include:
+                result[field] = []
+
+        if k == 0:
+            for values in result.values():
+                values.extend([] for _ in queries)
+            return result
+
+        candidates = min(available, max(k * RESCORE_FACTOR, MIN_CANDIDATES))
+        if self.quantized and candidates < available:
+            # approximate pass over the int8 copy, exact pass over the shortlist
+            approx = self._scores(queries, codes, scales)
+            approx[:, ~allowed] = -np.inf
+            shortlist = np.argpartition(-approx, candidates - 1, axis=1)[:, :candidates]
+            exact = np.einsum(
+                "qd,qcd->qc",
+                queries,
+                np.asarray(vectors[shortlist.ravel()]).reshape(
+                    len(queries), candidates, -1
+                ),
+            )
+        else:
+            shortlist = np.tile(np.flatnonzero(allowed), (len(queries), 1))
+            exact = self._scores(queries, vectors)[:, allowed]
+
+        order = np.argsort(-exact, axis=1)[:, :k]
+        for q in range(len(queries)):
+            rows = shortlist[q, order[q]]
+            result["ids"].append([self._ids[row] for row in rows])
+            result["distances"].append((1.0 - exact[q, order[q]]).tolist())
+            for field, values in self._result_fields(rows, include).items():
+                result[field].append(values)
+        return result
+
+    def compact(self):
+        """
+        Rewrites the matrices without retired rows to reclaim space.
+        """
+        with self._lock:
+            self._refresh()
+            alive = np.flatnonzero(self._alive)
+            records = self._db.execute(
+                "SELECT id, document, metadata FROM rows WHERE alive = 1 ORDER BY row"
+            ).fetchall()
+            vectors = np.array(self._vectors[alive]) if len(alive) else None
+
+            for name in ("vectors.f32", "vectors.i8", "scales.f32"):
+                if os.path.exists(self._file(name)):
+                    os.remove(self._file(name))
+            with self._db:
+                self._db.execute("DELETE FROM rows")
+            self._load()
+
+            if vectors is not None:
+                self._append(
+                    [r[0] for r in records],
+                    vectors,
+                    [r[1] for r in records],
+                    [json.loads(r[2]) for r in records],
+                )
@@ -0,0 +1,90 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# the application modules import each other by their flat names
+sys.path.insert(0, str(Path(__file__).parent.parent / "src" / "vector_search"))
+
+
+def text_pdf(path, *texts):
+    """
+    Writes a PDF with one page of text per argument.
+    """
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, None]
+    objects[2] = b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"
+    kids = []
+    for text in texts:
+        stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET".encode()
+        objects.append(
+            b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream)
+        )
+        kids.append(len(objects) + 1)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % len(objects)
+        )
+    refs = " ".join(f"{kid} 0 R" for kid in kids)
+    objects[1] = f"<< /Type /Pages /Kids [{refs}] /Count {len(kids)} >>".encode()
+
+    pdf = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(pdf))
+        pdf += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    pdf += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1,
+        xref,
+    )
+    path.write_bytes(pdf)
+
+
+@pytest.fixture(autouse=True)
+def _isolated_versions(tmp_path, monkeypatch):
+    """
+    Keeps the collection version counters, the page cache and the indexes
+    of every test apart, and out of the working directory.
+    """
+    import caching
+    import filters
+    import keyword_index
+    import page_cache
+
+    monkeypatch.setattr(caching, "VERSIONS_PATH", str(tmp_path / "versions.sqlite3"))
+    monkeypatch.setattr(page_cache, "PAGE_CACHE_PATH", str(tmp_path / "pages.sqlite3"))
+    monkeypatch.setattr(keyword_index, "KEYWORD_INDEX_PATH", str(tmp_path / "keywords"))
+    monkeypatch.setattr(keyword_index, "_indexes", {})
+    monkeypatch.setattr(filters, "_indexes", {})
+
+
+@pytest.fixture(name="collection")
+def _collection(tmp_path, monkeypatch):
+    """
+    An empty local collection whose chunks are embedded by hashing.
+    """
+    import embeddings
+    from embeddings import HashingEmbedder
+    from vector_store import NumpyCollection
+
+    monkeypatch.setattr(embeddings, "EMBEDDER", "hashing")
+    return NumpyCollection(
+        tmp_path / "library", "library", metadata=HashingEmbedder().metadata()
+    )
+
+
+@pytest.fixture(name="workdir")
+def _workdir(tmp_path, monkeypatch):
+    """
+    Runs the test in tmp_path, where ChromaClient opens its db/ folder.
+    Chroma shares one system per path, and "db/" names a different
+    folder in every test, so its shared systems are dropped as well.
+    """
+    from chromadb.api.client import SharedSystemClient
+
+    monkeypatch.chdir(tmp_path)
+    SharedSystemClient.clear_system_cache()
+    yield tmp_path
+    SharedSystemClient.clear_system_cache()
@@ -0,0 +1,87 @@
+import json
+
+import pytest
+
+import embeddings
+from batch_ingest import document_metadata, load_manifest, parse_args, run
+from chroma_db import ChromaClient
+from conftest import text_pdf
+
+
+@pytest.fixture(name="uploaded")
+def _uploaded(workdir, monkeypatch):
+    """
+    An upload folder in a working directory of its own, embedding with
+    the hashing embedder.
+    """
+    monkeypatch.setattr(embeddings, "EMBEDDER", "hashing")
+    (workdir / "uploaded").mkdir()
+    return workdir / "uploaded"
+
+
+def test_load_csv_manifest(tmp_path):
+    """
+    A CSV manifest is keyed by the file name of its "file" column.
+    """
+    manifest = tmp_path / "manifest.csv"
+    manifest.write_text(
+        "file,title,authors,publisher,date_published\n"
+        "scans/manual.pdf,Pump Manual,Jane Smith,Acme,1999\n",
+        encoding="utf-8",
+    )
+
+    entries = load_manifest(str(manifest))
+
+    assert ["manual.pdf"] == list(entries)
+    assert "Pump Manual" == entries["manual.pdf"]["title"]
+
+
+def test_load_json_manifest(tmp_path):
+    """
+    A JSON manifest is either a list of entries or keyed by file name.
+    """
+    listed = tmp_path / "listed.json"
+    listed.write_text(json.dumps([{"file": "a.pdf", "title": "A"}]))
+    keyed = tmp_path / "keyed.json"
+    keyed.write_text(json.dumps({"a.pdf": {"title": "A"}}))
+
+    assert {"a.pdf": {"file": "a.pdf", "title": "A"}} == load_manifest(str(listed))
+    assert load_manifest(str(listed)) == load_manifest(str(keyed))
+
+
+def test_sidecar_wins_over_manifest(uploaded):
+    """
+    A `<name>.pdf.json` next to the file is used instead of the manifest,
+    and the title falls back to the file name.
+    """
+    (uploaded / "manual.pdf.json").write_text(
+        json.dumps({"authors": "Ann Lee", "document_key": "manual"})
+    )
+    manifest = {"manual.pdf": {"title": "From the manifest"}}
+
+    metadata = document_metadata(str(uploaded / "manual.pdf"), manifest)
+    other = document_metadata(
+        str(uploaded / "other.pdf"), {"other.pdf": {"title": "Other"}}
+    )
+
+    assert "manual" == metadata["title"]
+    assert "Ann Lee" == metadata["authors"]
+    assert "manual" == metadata["document_key"]
+    assert ("Other", None) == (other["title"], other["document_key"])
+
+
+def test_bad_sidecar_fails_only_its_file(uploaded, tmp_path):
+    """
+    A malformed sidecar counts its file as failed and leaves it in place,
+    while the other files are ingested and moved.
+    """
+    text_pdf(uploaded / "good.pdf", "Replace the pump gasket yearly.")
+    text_pdf(uploaded / "bad.pdf", "Invoices are due within thirty days.")
+    (uploaded / "bad.pdf.json").write_text("{not json")
+
+    failures = run(parse_args([str(uploaded), "--processed", str(tmp_path / "done")]))
+
+    assert 1 == failures
+    assert (uploaded / "bad.pdf").exists()
+    assert not (uploaded / "good.pdf").exists()
+    assert 1 == ChromaClient().create_collection("library").count()
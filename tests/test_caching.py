@@ -0,0 +1,71 @@
+import pytest
+
+import caching
+from caching import CollectionVersions, EmbeddingCache, ResultCache
+
+KEY = ("library", 10, "null")
+
+
+@pytest.fixture(name="cache")
+def _cache():
+    return ResultCache(max_size=4, threshold=0.95)
+
+
+def test_near_duplicate_query_hits(cache):
+    """
+    An embedding within the threshold of a cached one reuses its results.
+    """
+    cache.put([1.0, 0.0, 0.1], KEY, 1, "results")
+
+    assert "results" == cache.get([1.0, 0.02, 0.1], KEY, 1)
+    assert cache.get([0.5, 0.5, 0.0], KEY, 1) is None
+    assert cache.get([1.0, 0.0, 0.1], ("library", 5, "null"), 1) is None
+
+
+def test_new_version_invalidates(cache, tmp_path):
+    """
+    Results cached before ingestion changed the collection are not reused.
+    """
+    versions = CollectionVersions(str(tmp_path / "versions.sqlite3"))
+    cache.put([1.0, 0.0], KEY, versions.get("library"), "results")
+
+    versions.bump("library")
+
+    assert 1 == versions.get("library")
+    assert cache.get([1.0, 0.0], KEY, versions.get("library")) is None
+    assert 0 == cache.stats()["size"]
+
+
+def test_embedding_cache_evicts_least_recently_used():
+    """
+    A full cache drops the query used longest ago, and spellings that
+    only differ in case and spacing share an entry.
+    """
+    cache = EmbeddingCache(max_size=2)
+    cache.put("Invoice  policy", "model", [1.0])
+    cache.put("tax rules", "model", [2.0])
+    assert [1.0] == cache.get("invoice policy", "model")
+
+    cache.put("pump housing", "model", [3.0])
+
+    assert cache.get("tax rules", "model") is None
+    assert [1.0] == cache.get("invoice policy", "model")
+    assert cache.get("invoice policy", "other model") is None
+
+
+def test_embedding_cache_expires_entries(monkeypatch):
+    """
+    Entries older than the time to live are misses.
+    """
+    now = [100.0]
+    monkeypatch.setattr(caching.time, "monotonic", lambda: now[0])
+    cache = EmbeddingCache(ttl=60)
+    cache.put("invoice policy", "model", [1.0])
+
+    now[0] += 59
+    assert [1.0] == cache.get("invoice policy", "model")
+    now[0] += 2
+    assert cache.get("invoice policy", "model") is None
+    assert {"hits": 1, "misses": 1} == {
+        k: v for k, v in cache.stats().items() if k in ("hits", "misses")
+    }
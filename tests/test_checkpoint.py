@@ -0,0 +1,104 @@
+import pytest
+
+import ingestion
+from checkpoint import IngestJournal
+from ingestion import ingest_document
+
+TEXTS = ["Pump maintenance.", "Filter cleaning.", "Gasket sizes."]
+
+
+class ScannedFile:
+    """
+    Stands in for a FileReader, scanning its pages from memory and
+    failing on request.
+    """
+
+    document_id = "manual"
+    filepath = "manual.pdf"
+    title = "Manual"
+    authors = publisher = date_published = ""
+
+    def __init__(self, texts, crash_on=None, error_on=None):
+        self.texts = texts
+        self.crash_on = crash_on
+        self.error_on = error_on
+        self.scanned = []
+
+    def content_hash(self):
+        return "hash"
+
+    def page_count(self):
+        return len(self.texts)
+
+    def iter_pages(self, completed_pages=None, on_page=None):
+        for number, text in enumerate(self.texts, 1):
+            if str(number) in (completed_pages or {}):
+                yield completed_pages[str(number)]
+                continue
+            if number == self.crash_on:
+                raise KeyboardInterrupt()
+            self.scanned.append(number)
+            page = {"page_number": str(number), "contents": text}
+            if number == self.error_on:
+                page["contents"] = ""
+                page["error"] = "OCR failed"
+            elif on_page is not None:
+                on_page(page)
+            yield page
+
+
+@pytest.fixture(name="journal")
+def _journal(tmp_path):
+    journal = IngestJournal(str(tmp_path / "journal.sqlite3"))
+    yield journal
+    journal.close()
+
+
+@pytest.fixture(name="embedded")
+def _embedded(monkeypatch):
+    embedded = []
+    embed_texts = ingestion.embed_texts
+
+    def counting(texts, embedder=None):
+        embedded.extend(texts)
+        return embed_texts(texts, embedder)
+
+    monkeypatch.setattr(ingestion, "embed_texts", counting)
+    return embedded
+
+
+def test_interrupted_run_resumes(collection, journal, embedded):
+    """
+    A run killed halfway is resumed without scanning or embedding the
+    pages it already finished.
+    """
+    with pytest.raises(KeyboardInterrupt):
+        ingest_document(
+            ScannedFile(TEXTS, crash_on=3), collection, journal, batch_size=1
+        )
+    assert "in_progress" == journal.status("manual")
+    assert TEXTS[:2] == embedded
+
+    embedded.clear()
+    resumed = ScannedFile(TEXTS)
+    stats = ingest_document(resumed, collection, journal, batch_size=1)
+
+    assert [3] == resumed.scanned
+    assert TEXTS[2:] == embedded
+    assert (1, 2) == (stats.chunks, stats.existing)
+    assert "done" == journal.status("manual")
+    assert 3 == collection.count()
+
+
+def test_failed_page_leaves_the_document_unfinished(collection, journal):
+    """
+    A page that could not be scanned counts as failed: the journal entry
+    stays open and the chunks stored for the page earlier are kept.
+    """
+    ingest_document(ScannedFile(TEXTS), collection, journal)
+
+    stats = ingest_document(ScannedFile(TEXTS, error_on=2), collection, journal)
+
+    assert (1, 0) == (stats.failed, stats.removed)
+    assert "in_progress" == journal.status("manual")
+    assert 3 == collection.count()
@@ -0,0 +1,67 @@
+import pytest
+
+from chunking import iter_chunks, split_spans, split_text
+
+
+@pytest.fixture(name="text")
+def _text():
+    return " ".join(f"word{i}" for i in range(500))
+
+
+def test_chunks_respect_size(text):
+    """
+    No chunk is longer than the configured chunk size.
+    """
+    chunks = split_text(text, chunk_size=100, chunk_overlap=20)
+
+    assert len(chunks) > 1
+    assert all(len(chunk) <= 100 for chunk in chunks)
+
+
+def test_chunks_overlap_and_cover_text(text):
+    """
+    Consecutive chunks overlap, and together they cover the whole text.
+    """
+    spans = list(split_spans(text, chunk_size=100, chunk_overlap=20))
+
+    assert spans[0][0] == 0
+    assert spans[-1][1] == len(text)
+    for (start, end), (next_start, _) in zip(spans, spans[1:]):
+        assert start < next_start < end
+
+
+def test_chunks_break_on_words(text):
+    """
+    Chunks start and end on word boundaries.
+    """
+    words = set(text.split())
+
+    for chunk in split_text(text, chunk_size=100, chunk_overlap=20):
+        assert set(chunk.split()) <= words
+
+
+def test_iter_chunks_carries_offsets():
+    """
+    Every chunk records its page and where it sits within that page.
+    """
+    pages = [
+        {"page_number": "1", "contents": "alpha beta gamma delta"},
+        {"page_number": "2", "contents": ""},
+        {"page_number": "3", "contents": "  epsilon  "},
+    ]
+
+    chunks = list(iter_chunks(pages, chunk_size=12, chunk_overlap=0))
+
+    assert [c["page_number"] for c in chunks] == ["1", "1", "3"]
+    for chunk in chunks:
+        page = pages[int(chunk["page_number"]) - 1]["contents"]
+        assert page[chunk["char_start"] : chunk["char_end"]] == chunk["contents"]
+    assert chunks[-1]["contents"] == "epsilon"
+
+
+def test_overlap_must_be_smaller_than_size():
+    """
+    An overlap as large as the chunk size is rejected.
+    """
+    with pytest.raises(ValueError):
+        list(split_spans("some text", chunk_size=10, chunk_overlap=10))
@@ -0,0 +1,104 @@
+import math
+from types import SimpleNamespace
+
+import pytest
+
+import chroma_db
+
+from embeddings import (
+    LEGACY_ENDPOINT,
+    HashingEmbedder,
+    OllamaEmbedder,
+    embed_texts,
+    embedder_for,
+    get_embedder,
+)
+from vector_store import NumpyCollection
+
+
+@pytest.fixture(name="embedder")
+def _embedder():
+    return HashingEmbedder(dimension=256)
+
+
+def cosine(a, b):
+    return sum(x * y for x, y in zip(a, b))
+
+
+def test_hashing_is_deterministic(embedder):
+    """
+    The same text always gets the same vector, even across instances.
+    """
+    text = "Invoice policy for overseas suppliers"
+
+    assert embedder.embed([text]) == HashingEmbedder(dimension=256).embed([text])
+
+
+def test_hashing_vectors_are_normalized(embedder):
+    """
+    Vectors have the configured dimension and unit length.
+    """
+    (vector,) = embedder.embed(["quarterly revenue report"])
+
+    assert 256 == len(vector)
+    assert math.isclose(1.0, math.sqrt(sum(v * v for v in vector)))
+
+
+def test_hashing_ranks_shared_vocabulary_higher(embedder):
+    """
+    Texts that share words are closer than texts that don't.
+    """
+    query, related, unrelated = embedder.embed(
+        [
+            "invoice policy",
+            "the policy on paying an invoice",
+            "migratory patterns of arctic terns",
+        ]
+    )
+
+    assert cosine(query, related) > cosine(query, unrelated)
+
+
+def test_embed_texts_uses_the_given_embedder(embedder):
+    """
+    The module level helpers accept an explicit embedder.
+    """
+    assert embedder.embed(["a", "b"]) == embed_texts(["a", "b"], embedder)
+
+
+def test_unknown_embedder():
+    """
+    Asking for an embedder that doesn't exist is an error.
+    """
+    with pytest.raises(ValueError):
+        get_embedder("nonexistent")
+
+
+def test_collections_keep_their_endpoint():
+    """
+    Collections that predate /api/embed are embedded the legacy way.
+    """
+    embedder = OllamaEmbedder()
+    legacy = embedder_for(SimpleNamespace(metadata=None), embedder)
+
+    assert LEGACY_ENDPOINT == legacy.endpoint
+    assert embedder.key != legacy.key
+    assert embedder is embedder_for(
+        SimpleNamespace(metadata=embedder.metadata()), embedder
+    )
+    with pytest.raises(ValueError):
+        embedder_for(SimpleNamespace(metadata=None), HashingEmbedder())
+
+
+def test_collection_without_a_model_is_not_assumed_compatible(tmp_path, monkeypatch):
+    """
+    A collection that doesn't record its model can't be opened with the
+    hashing embedder, which can't have produced its vectors.
+    """
+    monkeypatch.setattr(chroma_db, "NUMPY_PATH", str(tmp_path))
+    NumpyCollection(tmp_path / "library", "library", metadata={"hnsw:space": "l2"})
+    client = chroma_db.ChromaClient(backend="numpy")
+
+    with pytest.raises(ValueError):
+        client.create_collection("library", HashingEmbedder(), sharding="")
+    assert client.create_collection("other", HashingEmbedder(), sharding="")
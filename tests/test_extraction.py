@@ -0,0 +1,82 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import extraction
+from extraction import annotate
+from utils.utils import get_keywords
+
+
+class SlowNLP:
+    """
+    Stands in for a spaCy pipeline, recording how many threads run it at
+    the same time.
+    """
+
+    def __init__(self):
+        self.running = 0
+        self.most = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, text):
+        (doc,) = self.pipe([text], batch_size=1)
+        return doc
+
+    def pipe(self, texts, batch_size):
+        with self._lock:
+            self.running += 1
+            self.most = max(self.most, self.running)
+        time.sleep(0.02)
+        with self._lock:
+            self.running -= 1
+        for text in texts:
+            words = text.split()
+            yield SimpleNamespace(
+                ents=[SimpleNamespace(text=words[0])] * 2,
+                _=SimpleNamespace(phrases=[SimpleNamespace(text=w) for w in words]),
+            )
+
+
+def test_annotate_returns_phrases_and_entities():
+    """
+    The top phrases and the distinct entities become comma-separated strings.
+    """
+    (annotation,) = annotate(["pump gasket seal"], SlowNLP(), phrases=2)
+
+    assert {"keywords": "pump, gasket", "entities": "pump"} == annotation
+
+
+def test_pipeline_is_used_by_one_thread_at_a_time():
+    """
+    Threads annotating with the same pipeline wait for each other.
+    """
+    nlp = SlowNLP()
+    threads = [
+        threading.Thread(target=annotate, args=(["pump gasket"], nlp)) for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert 1 == nlp.most
+
+
+def test_keywords_share_the_pipeline_one_thread_at_a_time(monkeypatch):
+    """
+    Helpers that run the shared pipeline directly wait for each other too.
+    """
+    nlp = SlowNLP()
+    monkeypatch.setitem(extraction._models, extraction.SPACY_MODEL, nlp)
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(get_keywords("pump gasket")))
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert [["pump", "gasket"]] * 4 == results
+    assert 1 == nlp.most
@@ -0,0 +1,64 @@
+import pytest
+
+import file_reader
+from conftest import text_pdf
+from file_reader import FileReader
+
+
+@pytest.fixture(name="mixed")
+def _mixed(tmp_path, monkeypatch):
+    """
+    A three-page PDF whose middle page has no usable text layer, and a
+    record of the pages sent to OCR and of when their scan was closed.
+    """
+    text_pdf(tmp_path / "mixed.pdf", "Typed page one", "SCANNED", "Typed page three")
+    monkeypatch.setattr(
+        file_reader, "is_usable_text", lambda text: "SCANNED" not in text
+    )
+    monkeypatch.setattr(file_reader, "ocr_pdf_page", lambda *args: "")
+    ocr = {"pages": [], "closed": False}
+
+    def scan(page_numbers):
+        try:
+            for page_number in page_numbers:
+                ocr["pages"].append(page_number)
+                yield {"page_number": str(page_number), "contents": "OCR'd page"}
+        finally:
+            ocr["closed"] = True
+
+    def collect(self, executor, page_numbers, futures, completed_pages, on_page):
+        executor.shutdown()
+        # held on to, so the scan is not closed by being garbage collected
+        ocr["scan"] = scan(page_numbers)
+        return ocr["scan"]
+
+    monkeypatch.setattr(FileReader, "_collect_ocr_pages", collect)
+    reader = FileReader(str(tmp_path / "mixed.pdf"), ocr_workers=1, cache=False)
+    reader.title = "Mixed"
+    return reader, ocr
+
+
+def test_only_unusable_pages_are_ocrd(mixed):
+    """
+    Pages keep their text layer unless it is unusable, in page order.
+    """
+    reader, ocr = mixed
+
+    pages = [page["contents"] for page in reader.iter_hybrid()]
+
+    assert ["Typed page one", "OCR'd page", "Typed page three"] == pages
+    assert [2] == ocr["pages"]
+
+
+def test_closing_early_closes_the_ocr_scan(mixed):
+    """
+    A reader that stops part way through stops the OCR as well.
+    """
+    reader, ocr = mixed
+    pages = reader.iter_hybrid()
+
+    next(pages)
+    next(pages)
+    pages.close()
+
+    assert ocr["closed"]
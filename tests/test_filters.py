@@ -0,0 +1,106 @@
+import pytest
+
+from caching import collection_versions
+from filters import MetadataIndex, metadata_index, parse_query
+from ingestion import apply_metadata, remove_stale_chunks
+from vector_store import NumpyCollection
+
+
+@pytest.fixture(name="collection")
+def _collection(tmp_path):
+    collection = NumpyCollection(tmp_path / "library", "library")
+    documents = [
+        ("a", "Annual Report", "Jane Smith, John Doe", "1999"),
+        ("b", "Tax Rules", "John Doe", "2004"),
+        ("c", "Smithing", "Ann Lee", "2004"),
+    ]
+    for i, (document_id, source, authors, date) in enumerate(documents):
+        collection.add(
+            ids=[f"{document_id}{page}" for page in range(3)],
+            embeddings=[[1.0, float(i), float(page)] for page in range(3)],
+            metadatas=[
+                {
+                    "document_id": document_id,
+                    "source": source,
+                    "authors": authors,
+                    "date_published": date,
+                }
+            ]
+            * 3,
+        )
+    return collection
+
+
+@pytest.fixture(name="index")
+def _index(collection):
+    return MetadataIndex(collection, ("source", "authors", "date_published"))
+
+
+def test_parse_query_extracts_filters():
+    """
+    Known prefixes become filters and the rest stays the prompt.
+    """
+    prompt, filters = parse_query(
+        'author:Smith deductions title:"annual report" see http://x.org'
+    )
+
+    assert "deductions see http://x.org" == prompt
+    assert {"authors": "Smith", "source": "annual report"} == filters
+
+
+def test_index_matches_part_of_a_value(index):
+    """
+    Filters ignore case and match part of a value, on the right field.
+    """
+    assert ["a"] == index.match({"authors": "smith"})
+    assert ["b", "c"] == index.match({"date_published": "2004"})
+    assert [] == index.match({"authors": "smith", "date_published": "2004"})
+    assert index.match({}) is None
+
+
+def test_where_limits_search_to_matching_documents(collection, index):
+    """
+    The pushed down clause only lets the matching documents through.
+    """
+    document_ids = index.match({"authors": "doe"})
+    where = index.where(document_ids, ["authors"])
+
+    results = collection.query(query_embeddings=[[1.0, 2.0, 0.0]], where=where)
+
+    assert {"a", "b"} == {m["document_id"] for m in results["metadatas"][0]}
+
+
+def test_chunk_fields_match_on_any_chunk(collection):
+    """
+    A document matches a keyword found on only one of its chunks.
+    """
+    collection.update(ids=["b1"], metadatas=[{"keywords": "withholding tax, payroll"}])
+    index = MetadataIndex(collection, ("source", "keywords"))
+
+    assert ["b"] == index.match({"keywords": "payroll"})
+    assert [] == index.match({"keywords": "payroll", "source": "annual"})
+
+
+def test_ingestion_updates_the_index_in_place(collection, monkeypatch):
+    """
+    Metadata applied and chunks removed by ingestion are reflected in the
+    index without scanning the collection again, while a change made
+    elsewhere still makes it rebuild.
+    """
+    index = metadata_index(collection, ("source", "authors"))
+    assert ["b"] == index.match({"source": "tax"})
+    builds = []
+    build = index._build
+    monkeypatch.setattr(index, "_build", lambda: builds.append(1) or build())
+
+    apply_metadata(collection, "b", {"source": "Payroll Rules"})
+    remove_stale_chunks(collection, "c", keep_ids=set())
+
+    assert [] == index.match({"source": "tax"})
+    assert ["b"] == index.match({"source": "payroll"})
+    assert [] == index.match({"authors": "lee"})
+    assert [] == builds
+
+    collection_versions().bump(collection.name)
+    assert [] == index.match({"authors": "lee"})
+    assert [1] == builds
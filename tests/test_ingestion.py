@@ -0,0 +1,164 @@
+
+import ingestion
+import keyword_index
+from embeddings import HashingEmbedder
+from file_reader import FileReader
+from ingestion import apply_metadata, ingest_pages
+
+METADATA = {"source": "Manual", "authors": "", "publisher": "", "date_published": ""}
+
+
+def pages(*texts):
+    return [
+        {"page_number": str(number), "contents": text}
+        for number, text in enumerate(texts, 1)
+    ]
+
+
+def stored_documents(collection):
+    stored = collection.get(include=["metadatas"])
+    return sorted(m["document_id"] for m in stored["metadatas"])
+
+
+def test_files_with_the_same_name_coexist(collection, tmp_path):
+    """
+    Two different files called report.pdf are two documents, and
+    ingesting one leaves the other's chunks alone.
+    """
+    readers = []
+    for folder, contents in (("a", b"first report"), ("b", b"second report")):
+        (tmp_path / folder).mkdir()
+        (tmp_path / folder / "report.pdf").write_bytes(contents)
+        readers.append(FileReader(str(tmp_path / folder / "report.pdf"), cache=False))
+
+    first = ingest_pages(
+        collection, pages("Pump maintenance."), METADATA, readers[0].document_id
+    )
+    second = ingest_pages(
+        collection, pages("Filter cleaning."), METADATA, readers[1].document_id
+    )
+
+    assert readers[0].document_id != readers[1].document_id
+    assert (0, 0) == (first.removed, second.removed)
+    assert sorted(r.document_id for r in readers) == stored_documents(collection)
+
+
+def test_document_key_makes_a_revision(collection, tmp_path):
+    """
+    Files ingested with the same document key are revisions of one
+    document: unchanged chunks are kept and the ones that are gone removed.
+    """
+    (tmp_path / "v1.pdf").write_bytes(b"first revision")
+    (tmp_path / "v2.pdf").write_bytes(b"second revision")
+    v1 = FileReader(str(tmp_path / "v1.pdf"), cache=False, document_key="manual")
+    v2 = FileReader(str(tmp_path / "v2.pdf"), cache=False, document_key="manual")
+    assert v1.document_id == v2.document_id
+
+    ingest_pages(
+        collection,
+        pages("Pump maintenance.", "Old safety notes."),
+        METADATA,
+        v1.document_id,
+    )
+    stats = ingest_pages(
+        collection,
+        pages("Pump maintenance.", "New safety notes."),
+        METADATA,
+        v2.document_id,
+    )
+
+    assert (1, 1, 1) == (stats.chunks, stats.existing, stats.removed)
+    assert 2 == collection.count()
+
+
+def test_reingesting_embeds_nothing(collection, monkeypatch):
+    """
+    Chunks that are already stored are not embedded again.
+    """
+    ingest_pages(
+        collection, pages("Pump maintenance.", "Filter cleaning."), METADATA, "doc"
+    )
+
+    def embed_texts(texts, embedder=None):
+        raise AssertionError("nothing should be embedded")
+
+    monkeypatch.setattr(ingestion, "embed_texts", embed_texts)
+    stats = ingest_pages(
+        collection, pages("Pump maintenance.", "Filter cleaning."), METADATA, "doc"
+    )
+
+    assert (0, 2, 0, 0) == (stats.chunks, stats.existing, stats.removed, stats.failed)
+
+
+def test_embedding_failure_is_counted_and_keeps_old_chunks(collection, monkeypatch):
+    """
+    Chunks that fail to embed count as failed, and a failed run removes
+    none of the chunks stored by an earlier one.
+    """
+    ingest_pages(collection, pages("Pump maintenance."), METADATA, "doc")
+
+    def embed_texts(texts, embedder=None):
+        raise ConnectionError("embedder is down")
+
+    monkeypatch.setattr(ingestion, "embed_texts", embed_texts)
+    stats = ingest_pages(
+        collection,
+        pages("Filter cleaning.", "Gasket sizes."),
+        METADATA,
+        "doc",
+        batch_size=1,
+    )
+
+    assert (0, 2, 0) == (stats.chunks, stats.failed, stats.removed)
+    assert ["doc"] == stored_documents(collection)
+
+
+def test_apply_metadata_updates_every_chunk(collection, monkeypatch):
+    """
+    Document metadata entered later is written onto all of the document's
+    chunks, and nothing is embedded again.
+    """
+    ingest_pages(
+        collection, pages("Pump maintenance.", "Filter cleaning."), METADATA, "doc"
+    )
+    ingest_pages(collection, pages("Unrelated."), METADATA, "other")
+
+    def embed_texts(texts, embedder=None):
+        raise AssertionError("nothing should be embedded")
+
+    monkeypatch.setattr(ingestion, "embed_texts", embed_texts)
+    updated = apply_metadata(collection, "doc", {"source": "Pump Manual"})
+
+    stored = collection.get(include=["metadatas"])["metadatas"]
+    sources = sorted((m["document_id"], m["source"]) for m in stored)
+    assert 2 == updated
+    assert [
+        ("doc", "Pump Manual"),
+        ("doc", "Pump Manual"),
+        ("other", "Manual"),
+    ] == sources
+
+
+def test_keyword_index_is_built_before_writing(collection, monkeypatch):
+    """
+    The keyword index of a collection that already has chunks is built
+    before the pipeline starts, and then holds the old and new chunks.
+    """
+    collection.add(
+        ids=["old"],
+        embeddings=HashingEmbedder().embed(["Gasket sizes."]),
+        documents=["Gasket sizes."],
+        metadatas=[{**METADATA, "document_id": "old"}],
+    )
+    opened = []
+    write_batch = ingestion.write_batch
+
+    def recording(collection, *args, **kwargs):
+        opened.append(collection.name in keyword_index._indexes)
+        return write_batch(collection, *args, **kwargs)
+
+    monkeypatch.setattr(ingestion, "write_batch", recording)
+    ingest_pages(collection, pages("Pump maintenance."), METADATA, "doc")
+
+    assert [True] == opened
+    assert 2 == len(keyword_index.keyword_index(collection))
@@ -0,0 +1,128 @@
+import pytest
+
+import filters
+import keyword_index
+import search
+from keyword_index import KeywordIndex, is_lexical, tokenize
+from vector_store import NumpyCollection
+
+CHUNKS = {
+    "a": "Replace the filter cartridge with part AB-1234 every six months.",
+    "b": "The pump housing is sealed with a rubber gasket.",
+    "c": "Filters should be cleaned before the pump is restarted.",
+}
+
+
+@pytest.fixture(name="collection")
+def _collection(tmp_path, monkeypatch):
+    monkeypatch.setattr(keyword_index, "KEYWORD_INDEX_PATH", str(tmp_path / "kw"))
+    monkeypatch.setattr(keyword_index, "_indexes", {})
+    monkeypatch.setattr(filters, "_indexes", {})
+
+    collection = NumpyCollection(tmp_path / "library", "library")
+    collection.add(
+        ids=list(CHUNKS),
+        embeddings=[[1.0, 0.0], [0.0, 1.0], [0.7, 0.7]],
+        documents=list(CHUNKS.values()),
+        metadatas=[
+            {
+                "unique_id": uid,
+                "document_id": "manual",
+                "source": "Manual",
+                "authors": "",
+                "publisher": "",
+                "date_published": "",
+                "page": "1",
+            }
+            for uid in CHUNKS
+        ],
+    )
+    return collection
+
+
+def test_tokenize_keeps_codes_whole_and_split():
+    """
+    Part numbers are indexed whole and by their parts.
+    """
+    assert ["ab-1234", "ab", "1234", "x"] == tokenize("AB-1234 x")
+
+
+def test_is_lexical():
+    """
+    Codes, single words and quoted phrases skip the embedder.
+    """
+    assert is_lexical("AB-1234")
+    assert is_lexical("Smith")
+    assert is_lexical('"rubber gasket"')
+    assert not is_lexical("how do I seal the pump")
+
+
+def test_bm25_ranks_exact_term_first(tmp_path):
+    """
+    The chunk containing a rare term is ranked above the rest.
+    """
+    index = KeywordIndex(str(tmp_path / "kw.sqlite3"))
+    index.add(list(CHUNKS), list(CHUNKS.values()))
+
+    assert "b" == index.search("gasket pump", 3)[0][0]
+
+    index.delete(["b"])
+    reopened = KeywordIndex(str(tmp_path / "kw.sqlite3"))
+    assert ["c"] == [uid for uid, _ in reopened.search("gasket pump", 3)]
+
+
+def test_changes_from_another_process_are_replayed(tmp_path, monkeypatch):
+    """
+    An index picks up the chunks another one added and deleted without
+    reloading, and reloads once the changes it missed were trimmed.
+    """
+    path = str(tmp_path / "kw.sqlite3")
+    writer = KeywordIndex(path)
+    reader = KeywordIndex(path)
+    reloads = []
+    load = reader._load
+    monkeypatch.setattr(reader, "_load", lambda: reloads.append(1) or load())
+
+    writer.add(list(CHUNKS), list(CHUNKS.values()))
+    assert ["b", "c"] == sorted(uid for uid, _ in reader.search("pump", 3))
+    writer.delete(["b"])
+    assert ["c"] == [uid for uid, _ in reader.search("pump", 3)]
+    assert [] == reloads
+
+    monkeypatch.setattr(keyword_index, "CHANGE_LOG_SIZE", 1)
+    writer.delete(["a"])
+    writer.add(["b"], [CHUNKS["b"]])
+    assert ["b", "c"] == sorted(uid for uid, _ in reader.search("pump", 3))
+    assert 2 == len(reader)
+    assert [1] == reloads
+
+    writer.clear()
+    assert 0 == len(reader)
+
+
+def test_lexical_query_skips_embedding(collection, monkeypatch):
+    """
+    A part number is answered from the keyword index alone.
+    """
+
+    def embed_query(prompt):
+        raise AssertionError("the prompt should not be embedded")
+
+    monkeypatch.setattr(search, "embed_query", embed_query)
+
+    results = search.query_documents(collection, "AB-1234", n_results=2)
+
+    assert ["a"] == [result["unique_id"] for result in results]
+
+
+def test_fusion_combines_both_rankings(collection):
+    """
+    Chunks found only by keyword are merged into the vector results.
+    """
+    results = collection.query(query_embeddings=[[0.0, 1.0]], n_results=1)
+    hits = keyword_index.keyword_index(collection).search("cartridge", 3)
+
+    fused = search.fuse(collection, results, hits, n_results=3)
+
+    assert {"a", "b"} == set(fused["ids"][0])
+    assert "Manual" == fused["metadatas"][0][0]["source"]
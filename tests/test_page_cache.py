@@ -0,0 +1,68 @@
+import os
+
+import pytest
+
+import file_reader
+from file_reader import FileReader
+from page_cache import PageCache
+
+SETTINGS = "ocr dpi=150 engine=region"
+
+
+@pytest.fixture(name="cache")
+def _cache(tmp_path):
+    return PageCache(str(tmp_path / "pages.sqlite3"), max_bytes=1 << 20)
+
+
+def test_pages_are_keyed_by_file_and_settings(cache):
+    """
+    A page is only reused for the same file hash and settings.
+    """
+    cache.put("abc", SETTINGS, 1, "first page")
+    cache.put("abc", SETTINGS, 2, "second page")
+
+    assert {1: "first page", 2: "second page"} == cache.pages("abc", SETTINGS)
+    assert {2: "second page"} == cache.pages("abc", SETTINGS, [2, 3])
+    assert {} == cache.pages("abc", "ocr dpi=300 engine=region")
+    assert {} == cache.pages("def", SETTINGS)
+
+
+def test_least_recently_used_pages_are_evicted(cache):
+    """
+    Past its size limit the cache drops the pages used longest ago.
+    """
+    for page_number in range(1, 5):
+        # random text, so every page compresses to about the same size
+        cache.put("abc", SETTINGS, page_number, os.urandom(500).hex())
+    cache.max_bytes = cache.size() + 100
+    cache.pages("abc", SETTINGS, [1])
+
+    cache.put("abc", SETTINGS, 5, os.urandom(500).hex())
+
+    assert cache.size() <= cache.max_bytes
+    assert {1, 5} <= set(cache.pages("abc", SETTINGS))
+    assert 2 not in cache.pages("abc", SETTINGS)
+
+
+def test_identical_file_is_not_scanned_again(tmp_path, monkeypatch):
+    """
+    A byte-identical upload under another name reuses the OCR'd pages.
+    """
+    scanned = []
+
+    def fake_ocr(filepath, page_number, *args):
+        scanned.append(page_number)
+        return f"page {page_number}"
+
+    monkeypatch.setattr(file_reader, "ocr_pdf_page", fake_ocr)
+    for name in ("scan.pdf", "copy of scan.pdf"):
+        (tmp_path / name).write_bytes(b"%PDF-1.4 scanned")
+
+    first = FileReader(str(tmp_path / "scan.pdf"), ocr_workers=1)
+    assert ["page 1", "page 2"] == [p["contents"] for p in first.iter_ocr_pages([1, 2])]
+
+    second = FileReader(str(tmp_path / "copy of scan.pdf"), ocr_workers=1)
+    assert ["page 1", "page 2", "page 3"] == [
+        p["contents"] for p in second.iter_ocr_pages([1, 2, 3])
+    ]
+    assert [1, 2, 3] == scanned
@@ -0,0 +1,72 @@
+import threading
+
+import pytest
+
+from pipeline import Pipeline
+
+
+def test_single_worker_stages_keep_the_order():
+    """
+    Items come out of a chain of single-worker stages in the order they
+    went in, followed by whatever the flush returns.
+    """
+    written = []
+    pipeline = Pipeline(queue_size=2)
+    pipeline.add_stage("double", lambda n: [n, n], flush=lambda: ["end"])
+    pipeline.add_stage("write", written.append)
+
+    pipeline.run(range(5))
+
+    assert [0, 0, 1, 1, 2, 2, 3, 3, 4, 4, "end"] == written
+
+
+def test_every_item_passes_through_parallel_workers():
+    """
+    A stage with several workers processes every item exactly once.
+    """
+    written = []
+    lock = threading.Lock()
+
+    def write(n):
+        with lock:
+            written.append(n)
+
+    pipeline = Pipeline(queue_size=2)
+    pipeline.add_stage("square", lambda n: [n * n], workers=4)
+    pipeline.add_stage("write", write)
+
+    pipeline.run(range(50))
+
+    assert sorted(n * n for n in range(50)) == sorted(written)
+
+
+def test_failing_stage_aborts_the_pipeline():
+    """
+    The first error stops every stage, is re-raised by run() and closes
+    the source before it is used up.
+    """
+    fed = []
+    closed = threading.Event()
+
+    def source():
+        try:
+            for n in range(1000):
+                fed.append(n)
+                yield n
+        finally:
+            closed.set()
+
+    def fail(n):
+        if n == 3:
+            raise ValueError("bad item")
+        return [n]
+
+    pipeline = Pipeline(queue_size=2)
+    pipeline.add_stage("check", fail)
+    pipeline.add_stage("write", lambda n: None)
+
+    with pytest.raises(ValueError, match="bad item"):
+        pipeline.run(source())
+
+    assert closed.is_set()
+    assert len(fed) < 1000
@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+
+from scheduler import QueryScheduler
+
+
+@pytest.fixture(name="calls")
+def _calls():
+    return {"search": [], "results": [], "prefetch": []}
+
+
+def make_scheduler(calls, **kwargs):
+    async def search(prompt):
+        calls["search"].append(prompt)
+        return [prompt]
+
+    async def prefetch(prompt):
+        calls["prefetch"].append(prompt)
+
+    return QueryScheduler(
+        search,
+        lambda prompt, results: calls["results"].append((prompt, results)),
+        debounce=0.01,
+        prefetch=prefetch,
+        prefetch_delay=0.01,
+        **kwargs,
+    )
+
+
+def test_only_the_last_keystroke_is_searched(calls):
+    """
+    Prompts replaced before the debounce has passed are never searched.
+    """
+
+    async def typing():
+        scheduler = make_scheduler(calls)
+        for prompt in ("i", "in", "inv"):
+            scheduler.submit(prompt)
+        await asyncio.sleep(0.2)
+
+    asyncio.run(typing())
+
+    assert ["inv"] == calls["search"]
+    assert [("inv", ["inv"])] == calls["results"]
+
+
+def test_cancel_stops_the_pending_search(calls):
+    """
+    Clearing the search box cancels the search that was scheduled.
+    """
+
+    async def clearing():
+        scheduler = make_scheduler(calls)
+        scheduler.submit("invoice")
+        scheduler.cancel()
+        await asyncio.sleep(0.2)
+
+    asyncio.run(clearing())
+
+    assert [] == calls["search"]
+    assert [] == calls["results"]
+
+
+def test_earlier_queries_are_prefetched(calls):
+    """
+    Earlier queries that continue the prompt are prefetched once idle.
+    """
+
+    async def searching():
+        scheduler = make_scheduler(calls, prefetch_limit=2)
+        for prompt in ("invoice policy", "invoice dates", "tax", "invoice"):
+            scheduler.submit(prompt)
+            await asyncio.sleep(0.2)
+
+    asyncio.run(searching())
+
+    assert ["invoice dates", "invoice policy"] == calls["prefetch"]
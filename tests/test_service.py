@@ -0,0 +1,143 @@
+import time
+
+from fastapi.testclient import TestClient
+
+import pytest
+
+import embeddings
+import service
+from checkpoint import IngestJournal
+from conftest import text_pdf
+from embeddings import HashingEmbedder
+from ingestion import ingest_pages
+from service import app
+from vector_store import NumpyCollection
+
+
+@pytest.fixture(name="client")
+def _client():
+    return TestClient(app)
+
+
+@pytest.fixture(name="library")
+def _library(tmp_path, monkeypatch):
+    """
+    Points the service at an empty local collection, a fresh journal and
+    an upload directory in tmp_path, embedding with the hashing embedder.
+    """
+    monkeypatch.setattr(embeddings, "EMBEDDER", "hashing")
+    monkeypatch.setattr(service, "UPLOAD_DIR", str(tmp_path / "uploaded"))
+    (tmp_path / "uploaded").mkdir()
+    collection = NumpyCollection(
+        tmp_path / "library", "library", metadata=HashingEmbedder().metadata()
+    )
+    journal = IngestJournal(str(tmp_path / "journal.sqlite3"))
+    monkeypatch.setattr(
+        service, "_state", {"collection": collection, "journal": journal}
+    )
+    yield collection
+    journal.close()
+
+
+def test_health(client):
+    """
+    The service reports that it is up.
+    """
+    resp = client.get("/health")
+
+    assert 200 == resp.status_code
+    assert {"status": "ok"} == resp.json()
+
+
+def test_search_rejects_bad_result_count(client):
+    """
+    Asking for no results is a validation error.
+    """
+    resp = client.get("/search", params={"q": "invoice", "n_results": 0})
+
+    assert 422 == resp.status_code
+
+
+def test_batch_search_needs_queries(client):
+    """
+    A batch search without any queries is a validation error.
+    """
+    resp = client.post("/search", json={"queries": []})
+
+    assert 422 == resp.status_code
+
+
+def test_ingest_missing_file(client):
+    """
+    Ingesting a file that doesn't exist is refused before a job is queued.
+    """
+    resp = client.post("/ingest", json={"filepath": "does/not/exist.pdf"})
+
+    assert 404 == resp.status_code
+
+
+def test_unknown_job(client):
+    """
+    Unknown ingestion jobs are not found.
+    """
+    resp = client.get("/ingest/unknown")
+
+    assert 404 == resp.status_code
+
+
+def test_ingest_outside_the_upload_directory(client, library):
+    """
+    Paths that resolve outside of the upload directory are refused.
+    """
+    resp = client.post("/ingest", json={"filepath": "../journal.sqlite3"})
+
+    assert 403 == resp.status_code
+
+
+def test_search(client, library):
+    """
+    A search returns the stored chunk that matches the query best.
+    """
+    ingest_pages(
+        library,
+        [
+            {"page_number": "1", "contents": "Replace the pump gasket yearly."},
+            {"page_number": "2", "contents": "Invoices are due within thirty days."},
+        ],
+        {"source": "Manual", "authors": "", "publisher": "", "date_published": ""},
+        "manual",
+    )
+
+    resp = client.get("/search", params={"q": "invoices due", "n_results": 1})
+
+    assert 200 == resp.status_code
+    (result,) = resp.json()["results"]
+    assert "Invoices are due within thirty days." == result["contents"]
+
+
+def test_ingest_round_trip(client, library, tmp_path):
+    """
+    A PDF queued for ingestion ends up in the collection and is found
+    by a search afterwards.
+    """
+    text_pdf(
+        tmp_path / "uploaded" / "manual.pdf",
+        "Replace the pump gasket yearly.",
+        "Invoices are due within thirty days.",
+    )
+
+    resp = client.post("/ingest", json={"filepath": "manual.pdf", "title": "Manual"})
+    assert 202 == resp.status_code
+    job_id = resp.json()["job_id"]
+
+    for _ in range(100):
+        job = client.get(f"/ingest/{job_id}").json()
+        if job["status"] not in ("queued", "running"):
+            break
+        time.sleep(0.05)
+
+    assert "done" == job["status"], job
+    assert 2 == library.count()
+    resp = client.get("/search", params={"q": "pump gasket", "n_results": 1})
+    (result,) = resp.json()["results"]
+    assert "Manual" == result["source"]
@@ -0,0 +1,206 @@
+import os
+
+import numpy as np
+import pytest
+
+import chroma_db
+from embeddings import HashingEmbedder
+from sharding import ShardedCollection, shard_strategy
+from vector_store import NumpyCollection
+
+
+@pytest.fixture(name="sharded")
+def _sharded(tmp_path):
+    def open_shard(name, metadata):
+        return NumpyCollection(tmp_path / name, name, metadata=metadata)
+
+    collection = ShardedCollection(
+        "library",
+        shard_strategy("source"),
+        open_shard=open_shard,
+        list_shards=lambda: os.listdir(tmp_path),
+        drop_shard=lambda name: None,
+    )
+    vectors = np.random.default_rng(2).standard_normal((300, 16)).astype(np.float32)
+    collection.add(
+        ids=[str(i) for i in range(len(vectors))],
+        embeddings=vectors.tolist(),
+        documents=[f"chunk {i}" for i in range(len(vectors))],
+        metadatas=[{"source": f"Book {i % 3}"} for i in range(len(vectors))],
+    )
+    return collection, vectors
+
+
+def record_reads(shards):
+    """
+    Records the name of every shard that is read from.
+    """
+    reads = []
+    for shard in shards:
+        get = shard.get
+
+        def recording(*args, _get=get, _name=shard.name, **kwargs):
+            reads.append(_name)
+            return _get(*args, **kwargs)
+
+        shard.get = recording
+    return reads
+
+
+def test_query_merges_shards_into_global_top_k(sharded):
+    """
+    The merged results are the same as searching one unsharded collection.
+    """
+    collection, vectors = sharded
+    query = vectors[7] + 0.1
+
+    results = collection.query(query_embeddings=[query.tolist()], n_results=10)
+
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    expected = np.argsort(-(normalized @ query))[:10]
+    assert 3 == len(collection.shards())
+    assert [str(i) for i in expected] == results["ids"][0]
+    assert results["distances"][0] == sorted(results["distances"][0])
+
+
+def test_filter_prunes_shards(sharded):
+    """
+    A filter on the shard key only touches the matching shard.
+    """
+    collection, vectors = sharded
+    where = {"source": {"$eq": "Book 1"}}
+
+    results = collection.query(
+        query_embeddings=[vectors[0].tolist()], n_results=5, where=where
+    )
+
+    assert 1 == len(collection.shards(where))
+    assert all(m["source"] == "Book 1" for m in results["metadatas"][0])
+
+
+def test_update_moves_chunks_to_their_new_shard(sharded):
+    """
+    Renaming a source moves its chunks, so filters keep finding them.
+    """
+    collection, _ = sharded
+
+    collection.update(ids=["0", "3"], metadatas=[{"source": "Renamed"}] * 2)
+
+    renamed = collection.get(where={"source": "Renamed"})
+    assert ["0", "3"] == sorted(renamed["ids"])
+    assert 300 == collection.count()
+
+
+def test_paging_reads_every_row_once(sharded):
+    """
+    Reading page after page returns the same rows, in the same order,
+    as reading everything at once, and a page can start anywhere.
+    """
+    collection, _ = sharded
+    everything = collection.get(include=[])["ids"]
+
+    paged, offset = [], 0
+    while True:
+        page = collection.get(include=[], limit=40, offset=offset)["ids"]
+        if not page:
+            break
+        paged.extend(page)
+        offset += len(page)
+
+    assert everything == paged
+    assert everything[95:130] == collection.get(include=[], limit=35, offset=95)["ids"]
+
+
+def test_next_page_starts_from_the_cursor(sharded):
+    """
+    A page that follows the previous one only reads the shards it
+    falls in.
+    """
+    collection, _ = sharded
+    first = collection.get(include=[], limit=10)
+    shards = collection.shards()
+    reads = record_reads(shards)
+
+    second = collection.get(include=[], limit=10, offset=10)
+
+    assert [shards[0].name] == reads
+    assert 20 == len(set(first["ids"] + second["ids"]))
+
+
+def test_update_looks_in_the_pinned_shard(sharded):
+    """
+    An update whose metadata names the shard its chunks are in doesn't
+    look for them in the other shards.
+    """
+    collection, _ = sharded
+    shards = collection.shards()
+    reads = record_reads(shards)
+
+    collection.update(
+        ids=["1", "4"], metadatas=[{"source": "Book 1", "title": "B"}] * 2
+    )
+
+    assert [collection.shard_name(collection.strategy.key("Book 1"))] == reads
+    assert ["B", "B"] == [
+        m["title"]
+        for m in collection.get(ids=["1", "4"], include=["metadatas"])["metadatas"]
+    ]
+
+
+def test_client_shares_one_sharded_collection(tmp_path, monkeypatch):
+    """
+    Opening a sharded collection again returns the same instance.
+    """
+    monkeypatch.setattr(chroma_db, "NUMPY_PATH", str(tmp_path))
+    client = chroma_db.ChromaClient(backend="numpy")
+
+    first = client.create_collection("library", HashingEmbedder(), sharding="source")
+
+    assert first is client.create_collection(
+        "library", HashingEmbedder(), sharding="source"
+    )
+    assert first is not client.create_collection(
+        "library", HashingEmbedder(), sharding="date"
+    )
+
+
+@pytest.fixture(name="chroma_sharded")
+def _chroma_sharded(workdir):
+    client = chroma_db.ChromaClient(host=None, backend="chroma")
+    collection = client.create_collection(
+        "library", HashingEmbedder(), sharding="source"
+    )
+    vectors = np.random.default_rng(3).standard_normal((90, 512)).astype(np.float32)
+    collection.add(
+        ids=[str(i) for i in range(len(vectors))],
+        embeddings=vectors.tolist(),
+        documents=[f"chunk {i}" for i in range(len(vectors))],
+        metadatas=[{"source": f"Book {i % 3}"} for i in range(len(vectors))],
+    )
+    return collection, vectors
+
+
+def test_sharding_on_chroma(chroma_sharded):
+    """
+    A sharded collection spread over Chroma collections lists its shards,
+    prunes them, pages through them and moves chunks between them.
+    """
+    collection, vectors = chroma_sharded
+    where = {"source": "Book 1"}
+
+    assert 3 == len(collection.shards())
+    assert 1 == len(collection.shards(where))
+    results = collection.query(
+        query_embeddings=[vectors[4].tolist()], n_results=3, where=where
+    )
+    paged = [
+        uid
+        for offset in range(0, 90, 25)
+        for uid in collection.get(include=[], limit=25, offset=offset)["ids"]
+    ]
+    collection.update(ids=["0"], metadatas=[{"source": "Renamed"}])
+
+    assert "4" == results["ids"][0][0]
+    assert sorted(str(i) for i in range(90)) == sorted(paged)
+    assert ["0"] == collection.get(where={"source": "Renamed"}, include=[])["ids"]
+    assert 90 == collection.count()
@@ -0,0 +1,23 @@
+from startup_benchmark import measure_first_frame, measure_import
+
+# generous, these guard against heavy imports creeping back in, which
+# cost seconds, rather than measuring small regressions
+IMPORT_BUDGET = 1.0
+FIRST_FRAME_BUDGET = 3.0
+
+
+def test_main_imports_no_heavy_dependencies():
+    """
+    Importing the app loads none of the OCR, embedding or database stacks.
+    """
+    imported = measure_import(runs=1)
+
+    assert [] == imported["loaded"]
+    assert imported["seconds"] < IMPORT_BUDGET
+
+
+def test_first_frame_is_fast():
+    """
+    The first frame is drawn without waiting for the search stack.
+    """
+    assert measure_first_frame(runs=1) < FIRST_FRAME_BUDGET
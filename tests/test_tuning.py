@@ -0,0 +1,47 @@
+import numpy as np
+
+import embeddings
+from chroma_db import ChromaClient
+from tuning import evaluate, exact_neighbours, parse_args, run
+from vector_store import NumpyCollection
+
+
+def test_exact_search_has_full_recall(tmp_path):
+    """
+    An exact index scores a recall of 1 against the brute-force truth.
+    """
+    vectors = np.random.default_rng(1).standard_normal((500, 16)).astype(np.float32)
+    ids = [str(i) for i in range(len(vectors))]
+    collection = NumpyCollection(tmp_path / "library", "library")
+    collection.add(ids=ids, embeddings=vectors.tolist())
+
+    queries = vectors[:20] + 0.05
+    truth = [
+        [ids[i] for i in row]
+        for row in exact_neighbours(vectors, queries, 10, space="cosine")
+    ]
+    report = evaluate(collection, queries, truth, k=10)
+
+    assert 1.0 == report["recall"]
+    assert report["p50_ms"] <= report["p99_ms"]
+
+
+def test_profiles_are_compared_on_chroma(workdir, monkeypatch):
+    """
+    Every index profile gets a copy of a Chroma collection, measured
+    against the held-out queries.
+    """
+    monkeypatch.setattr(embeddings, "EMBEDDER", "hashing")
+    vectors = np.random.default_rng(4).standard_normal((200, 512)).astype(np.float32)
+    collection = ChromaClient(host=None, backend="chroma").create_collection(
+        "library", sharding=""
+    )
+    collection.add(
+        ids=[str(i) for i in range(len(vectors))], embeddings=vectors.tolist()
+    )
+
+    profiles = ["low-latency", "balanced", "high-recall"]
+    report = run(parse_args(["--profiles", *profiles, "--samples", "20", "-k", "5"]))
+
+    assert profiles == [result["profile"] for result in report]
+    assert all(result["recall"] > 0.8 for result in report)
@@ -0,0 +1,83 @@
+import cv2
+import numpy as np
+import pytesseract
+
+from utils.utils import get_page_text, mark_region
+
+# two regions stacked on a 200 x 100 page
+REGIONS = [((0, 0), (200, 50)), ((0, 50), (200, 100))]
+
+
+def word_data(*words):
+    """
+    image_to_data output for words given as
+    (text, conf, left, top, block, paragraph, line), each 20 x 10 pixels.
+    """
+    keys = ("text", "conf", "left", "top", "block_num", "par_num", "line_num")
+    data = {key: list(values) for key, values in zip(keys, zip(*words))}
+    data["width"] = [20] * len(words)
+    data["height"] = [10] * len(words)
+    return data
+
+
+def test_page_text_is_rebuilt_per_region(monkeypatch):
+    """
+    One image_to_data pass is split back into regions, lines and
+    paragraphs in reading order, without empty or doubtful words.
+    """
+    data = word_data(
+        ("", -1, 0, 0, 1, 0, 0),
+        ("Pump", 96, 5, 5, 1, 1, 1),
+        ("maintenance", 91, 30, 5, 1, 1, 1),
+        ("Every", 95, 5, 20, 1, 1, 2),
+        ("%~", 12, 30, 20, 1, 1, 2),
+        ("month.", 88, 55, 20, 1, 1, 2),
+        ("Gaskets", 93, 5, 60, 2, 1, 1),
+        (" ", 95, 30, 60, 2, 1, 1),
+        ("Seals", 90, 5, 80, 2, 2, 1),
+    )
+    calls = []
+    monkeypatch.setattr(
+        pytesseract, "image_to_data", lambda page, **kwargs: calls.append(1) or data
+    )
+    image = np.full((100, 200, 3), 255, dtype=np.uint8)
+
+    assert [
+        "Pump maintenance\nEvery month.\n",
+        "Gaskets\nSeals\n",
+    ] == get_page_text(REGIONS, image)
+    assert [1] == calls
+
+
+def test_scaled_layout_finds_the_full_layout_regions():
+    """
+    Regions found on the scaled-down copy of a page twice the layout width
+    match those found on the page itself, in the page's own coordinates.
+    """
+    image = np.full((2000, 1600, 3), 255, dtype=np.uint8)
+    paragraphs = {
+        300: ["PUMP MAINTENANCE", "Replace the filter yearly"],
+        1200: ["GASKET SIZES", "Seal 40 mm and 60 mm"],
+    }
+    for top, lines in paragraphs.items():
+        for number, line in enumerate(lines):
+            cv2.putText(
+                image,
+                line,
+                (200, top + 60 * number),
+                cv2.FONT_HERSHEY_SIMPLEX,
+                1.5,
+                (0, 0, 0),
+                3,
+            )
+
+    full, scaled = (
+        sorted(mark_region(image, layout, debug=False), key=lambda r: r[0][1])
+        for layout in ("full", "scaled")
+    )
+
+    assert 2 == len(full) == len(scaled)
+    for (full_start, full_end), (start, end), top in zip(full, scaled, paragraphs):
+        assert np.allclose(full_start + full_end, start + end, atol=6)
+        # the region holds both lines of its paragraph
+        assert start[0] < 200 and start[1] < top - 40 and end[1] > top + 60
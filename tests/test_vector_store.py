@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+
+from vector_store import NumpyCollection
+
+
+@pytest.fixture(name="vectors")
+def _vectors():
+    rng = np.random.default_rng(0)
+    return rng.standard_normal((2000, 32)).astype(np.float32)
+
+
+@pytest.fixture(name="collection")
+def _collection(tmp_path, vectors):
+    collection = NumpyCollection(tmp_path / "library", "library")
+    collection.add(
+        ids=[str(i) for i in range(len(vectors))],
+        embeddings=vectors.tolist(),
+        documents=[f"chunk {i}" for i in range(len(vectors))],
+        metadatas=[{"document_id": str(i % 4)} for i in range(len(vectors))],
+    )
+    return collection
+
+
+def test_query_matches_exact_search(collection, vectors):
+    """
+    The quantized scan followed by rescoring returns the exact top results.
+    """
+    query = vectors[:5] + 0.1
+    results = collection.query(query_embeddings=query.tolist(), n_results=10)
+
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    expected = np.argsort(-(query @ normalized.T), axis=1)[:, :10]
+    assert [[str(i) for i in row] for row in expected] == results["ids"]
+
+
+def test_query_applies_where_filter(collection, vectors):
+    """
+    Only chunks whose metadata matches the filter are returned.
+    """
+    results = collection.query(
+        query_embeddings=[vectors[1].tolist()],
+        n_results=5,
+        where={"document_id": "1"},
+    )
+
+    assert "1" == results["ids"][0][0]
+    assert all(m["document_id"] == "1" for m in results["metadatas"][0])
+
+
+def test_changes_survive_reopening(collection, tmp_path):
+    """
+    Updates and deletes are persisted and seen by a new instance.
+    """
+    collection.update(ids=["2"], metadatas=[{"source": "Report"}])
+    collection.delete(where={"document_id": "3"})
+
+    reopened = NumpyCollection(tmp_path / "library", "library")
+
+    assert 1500 == reopened.count()
+    assert "Report" == reopened.get(ids=["2"])["metadatas"][0]["source"]
+
+
+def test_document_filter_reads_only_matching_metadata(collection, tmp_path):
+    """
+    Filtering on documents uses the document index, and only the
+    metadata of the matching rows is read from disk.
+    """
+    collection.update(ids=["5"], metadatas=[{"source": "Report"}])
+    reopened = NumpyCollection(tmp_path / "library", "library")
+
+    stored = reopened.get(
+        where={"$and": [{"document_id": {"$in": ["1", "2"]}}, {"source": "Report"}]},
+        include=["metadatas"],
+    )
+
+    assert ["5"] == stored["ids"]
+    assert 1000 == len(reopened._metadatas)
+
+
+def test_collections_without_document_column_are_migrated(collection, tmp_path):
+    """
+    Rows written before document ids had their own column get it filled
+    in from their metadata when the collection is opened.
+    """
+    with collection._db:
+        collection._db.execute("ALTER TABLE rows DROP COLUMN document_id")
+
+    reopened = NumpyCollection(tmp_path / "library", "library")
+
+    assert 500 == len(reopened.get(where={"document_id": "3"}, include=[])["ids"])